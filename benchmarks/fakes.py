@@ -0,0 +1,260 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""In-process stand-ins for the AWS clients used by the lambdas, for offline benchmarks.
+Every stand-in sleeps a configurable latency per call and counts its calls per operation.
+"""
+
+import json
+import time
+import datetime
+import threading
+from collections import Counter
+from types import SimpleNamespace
+from botocore.exceptions import ClientError
+
+
+class FakeClient:
+    """Base class of the stand-ins: latency, call counting and the bits of client.meta used by the code"""
+
+    service_name = None
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self.meta = SimpleNamespace(
+            service_model=SimpleNamespace(service_name=self.service_name),
+            region_name="eu-west-1",
+        )
+
+    def _call(self, operation):
+        with self._lock:
+            self.calls[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class FakePaginator:
+    def __init__(self, client, operation, result_key):
+        self.client = client
+        self.operation = operation
+        self.result_key = result_key
+
+    def paginate(self, **kwargs):
+        return FakePageIterator(self, kwargs)
+
+
+class FakePageIterator:
+    def __init__(self, paginator, kwargs):
+        self.paginator = paginator
+        self.kwargs = kwargs
+
+    def __iter__(self):
+        token = None
+        while True:
+            page = getattr(self.paginator.client, self.paginator.operation)(
+                NextToken=token, **self.kwargs
+            )
+            yield page
+            token = page.get("NextToken")
+            if token is None:
+                return
+
+    def build_full_result(self):
+        items = []
+        for page in self:
+            items.extend(page[self.paginator.result_key])
+        return {self.paginator.result_key: items}
+
+
+class FakeSageMaker(FakeClient):
+    """Serves n_jobs training jobs (modified one every 10 minutes, going back in time) and
+    n_endpoints endpoints, paginated like the real API"""
+
+    service_name = "sagemaker"
+    page_size = 100
+
+    def __init__(self, n_jobs=0, n_endpoints=0, latency=0.0):
+        super().__init__(latency)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.jobs = [
+            {
+                "TrainingJobName": f"job-{i}",
+                "TrainingJobArn": f"arn:aws:sagemaker:eu-west-1:123456789012:training-job/job-{i}",
+                "TrainingJobStatus": "Completed" if i % 4 else "Failed",
+                "CreationTime": now - datetime.timedelta(minutes=10 * i + 30),
+                "LastModifiedTime": now - datetime.timedelta(minutes=10 * i),
+                "TrainingEndTime": now - datetime.timedelta(minutes=10 * i),
+            }
+            for i in range(n_jobs)
+        ]
+        self.endpoints = [
+            {"EndpointName": f"endpoint-{i}", "EndpointStatus": "InService"}
+            for i in range(n_endpoints)
+        ]
+
+    def _page(self, items, token, result_key):
+        start = int(token or 0)
+        page = {result_key: items[start : start + self.page_size]}
+        if start + self.page_size < len(items):
+            page["NextToken"] = str(start + self.page_size)
+        return page
+
+    def get_paginator(self, operation):
+        result_key = {
+            "list_training_jobs": "TrainingJobSummaries",
+            "list_endpoints": "Endpoints",
+        }[operation]
+        return FakePaginator(self, operation, result_key)
+
+    def list_training_jobs(self, NextToken=None, **kwargs):
+        self._call("list_training_jobs")
+        jobs = self.jobs
+        if "StatusEquals" in kwargs:
+            jobs = [j for j in jobs if j["TrainingJobStatus"] == kwargs["StatusEquals"]]
+        if "LastModifiedTimeAfter" in kwargs:
+            jobs = [j for j in jobs if j["LastModifiedTime"] > kwargs["LastModifiedTimeAfter"]]
+        if "LastModifiedTimeBefore" in kwargs:
+            jobs = [j for j in jobs if j["LastModifiedTime"] < kwargs["LastModifiedTimeBefore"]]
+        return self._page(jobs, NextToken, "TrainingJobSummaries")
+
+    def list_endpoints(self, NextToken=None, **kwargs):
+        self._call("list_endpoints")
+        return self._page(self.endpoints, NextToken, "Endpoints")
+
+
+class FakeSSM(FakeClient):
+    service_name = "ssm"
+
+    def __init__(self, parameters=None, latency=0.0):
+        super().__init__(latency)
+        self.parameters = parameters or {}
+
+    def get_parameter(self, Name):
+        self._call("get_parameter")
+        return {"Parameter": {"Name": Name, "Value": self.parameters.get(Name, "value")}}
+
+
+class FakeEvents(FakeClient):
+    """Accepts every entry, optionally failing a fraction of them, and keeps the bytes received"""
+
+    service_name = "events"
+
+    def __init__(self, latency=0.0, failure_rate=0.0):
+        super().__init__(latency)
+        self.failure_rate = failure_rate
+        self.bytes_received = 0
+        self.entries = []
+        self._n = 0
+
+    def put_events(self, Entries):
+        self._call("put_events")
+        results = []
+        failed = 0
+        with self._lock:
+            for entry in Entries:
+                self._n += 1
+                if self.failure_rate and (self._n * self.failure_rate) % 1 < self.failure_rate:
+                    results.append({"ErrorCode": "InternalFailure", "ErrorMessage": "fake"})
+                    failed += 1
+                    continue
+                self.bytes_received += len(entry["Detail"].encode("utf-8"))
+                self.entries.append(entry)
+                results.append({"EventId": str(self._n)})
+        return {"FailedEntryCount": failed, "Entries": results}
+
+
+class FakeTable:
+    """A DynamoDB table stand-in, keyed by (partition key, sort key)"""
+
+    def __init__(self, resource, name, partition_key, sort_key):
+        self.resource = resource
+        self.name = name
+        self.partition_key = partition_key
+        self.sort_key = sort_key
+        self.items = {}
+        # number of writes of each key, and time of its first write
+        self.writes = Counter()
+        self.written_at = {}
+
+    def _key(self, item):
+        return (str(item[self.partition_key]), str(item[self.sort_key]))
+
+    def _store(self, item):
+        key = self._key(item)
+        self.items[key] = item
+        self.writes[key] += 1
+        self.written_at.setdefault(key, time.time())
+
+    def put_item(self, Item, **kwargs):
+        self.resource._call("put_item")
+        with self.resource._lock:
+            if not self.resource._consume():
+                error = {"Code": "ProvisionedThroughputExceededException", "Message": "fake"}
+                raise ClientError({"Error": error}, "PutItem")
+            self._store(Item)
+        return {}
+
+    def size_bytes(self):
+        return sum(len(json.dumps(i, default=str)) for i in self.items.values())
+
+
+class FakeDynamoDB(FakeClient):
+    """A DynamoDB resource stand-in. BatchWriteItem leaves a fraction of the items unprocessed,
+    to exercise the retries. With write_capacity (items per second, with one second of burst),
+    the writes beyond the capacity are throttled: PutItem raises, BatchWriteItem leaves them
+    unprocessed"""
+
+    service_name = "dynamodb"
+
+    def __init__(self, latency=0.0, unprocessed_rate=0.0, write_capacity=None):
+        super().__init__(latency)
+        self.unprocessed_rate = unprocessed_rate
+        self.write_capacity = write_capacity
+        self.throttled = 0
+        self.tables = {}
+        self._n = 0
+        self._tokens = write_capacity
+        self._refilled_at = time.monotonic()
+
+    def _consume(self):
+        """Takes one write from the capacity, called with the lock held"""
+
+        if self.write_capacity is None:
+            return True
+
+        now = time.monotonic()
+        self._tokens = min(
+            self.write_capacity, self._tokens + (now - self._refilled_at) * self.write_capacity
+        )
+        self._refilled_at = now
+        if self._tokens < 1:
+            self.throttled += 1
+            return False
+        self._tokens -= 1
+        return True
+
+    def add_table(self, name, partition_key, sort_key):
+        self.tables[name] = FakeTable(self, name, partition_key, sort_key)
+        return self.tables[name]
+
+    def Table(self, name):
+        return self.tables[name]
+
+    def batch_write_item(self, RequestItems):
+        self._call("batch_write_item")
+        unprocessed = {}
+        with self._lock:
+            for name, requests in RequestItems.items():
+                target = self.tables[name]
+                for request in requests:
+                    self._n += 1
+                    if (
+                        self.unprocessed_rate
+                        and (self._n * self.unprocessed_rate) % 1 < self.unprocessed_rate
+                    ) or not self._consume():
+                        unprocessed.setdefault(name, []).append(request)
+                        continue
+                    target._store(request["PutRequest"]["Item"])
+        return {"UnprocessedItems": unprocessed}
@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""Load and soak harness of the hub ingest path.
+
+N simulated spokes extract M metrics (with Metric.extract, so the events have the exact schema
+sent by retrieve_values) in fetch rounds, and emit them with event_emitter. A local stand-in of
+the hub event bus delivers the events, at least once, to dynamo_write as the hub does: either
+one asynchronous invocation per event (direct mode, retried twice on errors) or through a
+queue polled in batches (queue mode, with partial batch failures, redelivery after the
+visibility timeout and a dead letter queue). The table is the DynamoDB stand-in of fakes.py,
+with a configurable write capacity. Times are in seconds of wall clock, scaled down: a fetch
+round every few seconds stands for one every hour.
+
+For each run, one JSON line reports the sustained throughput, the latency from extraction to
+write, the retries at each stage, the backlog, and the items lost or written more than once.
+
+Example:
+
+    python3 benchmarks/load_harness.py --spokes 50 200 --metrics 10 --shape burst staggered \\
+        --duration 60 --interval 5 --write-capacity 1000 --output load.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import heapq
+import random
+import argparse
+import platform
+import datetime
+import threading
+import itertools
+from concurrent import futures
+
+# the clients are created at import time: they need a region, never credentials
+os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+os.environ.setdefault("LOGLEVEL", "CRITICAL")
+os.environ.setdefault("METRICS_ENABLED", "false")
+os.environ["DDB_TABLE_NAME"] = "ds-dashboard-hub-metrics"
+os.environ.pop("STATE_STORE_URI", None)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "lambda_function_code"))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import dynamo_write
+import event_emitter
+from metric import Metric
+from table_schema import add_keys, SERIES_KEY, TIMESTAMP
+from fakes import FakeClient, FakeDynamoDB
+from run_benchmarks import git_revision
+
+# Lambda retries a failed asynchronous invocation twice
+ASYNC_MAX_RETRIES = 2
+
+
+class LoadMetric(Metric):
+    """A metric with a random value, computed instantly"""
+
+    def _compute_value(self):
+        return round(random.uniform(0, 1000), 3)
+
+
+def percentile(values, q):
+    """Nearest-rank q-percentile (0 <= q <= 100) of values, None if there are none"""
+
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values))) - 1))]
+
+
+class DirectTarget:
+    """One asynchronous invocation of dynamo_write.lambda_handler per event, with at most
+    concurrency invocations at a time. Failed invocations are retried ASYNC_MAX_RETRIES times,
+    retry_delay seconds later, then the event is lost"""
+
+    def __init__(self, concurrency, retry_delay):
+        self.retry_delay = retry_delay
+        self.executor = futures.ThreadPoolExecutor(max_workers=concurrency)
+        self.invocations = 0
+        self.retries = 0
+        self.lost = 0
+        # events delivered, not yet written nor lost
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def deliver(self, event, attempt=0):
+        if attempt == 0:
+            with self._lock:
+                self._pending += 1
+        self.executor.submit(self._invoke, event, attempt)
+
+    def _invoke(self, event, attempt):
+        with self._lock:
+            self.invocations += 1
+        try:
+            dynamo_write.lambda_handler(event, None)
+        except Exception:
+            if attempt < ASYNC_MAX_RETRIES:
+                with self._lock:
+                    self.retries += 1
+                timer = threading.Timer(self.retry_delay, self.deliver, (event, attempt + 1))
+                timer.daemon = True
+                timer.start()
+                return
+            with self._lock:
+                self.lost += 1
+        with self._lock:
+            self._pending -= 1
+
+    def backlog(self):
+        return self._pending
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class QueueTarget:
+    """A queue polled by pollers concurrent invocations of dynamo_write.queue_handler, with
+    batches of up to batch_size records, waiting at most batching_window seconds for a batch to
+    fill. The records reported as failed become visible again after visibility_timeout seconds;
+    after max_receive_count receptions, they go to the dead letter queue"""
+
+    def __init__(self, pollers, batch_size, batching_window, visibility_timeout, max_receive_count):
+        self.batch_size = batch_size
+        self.batching_window = batching_window
+        self.visibility_timeout = visibility_timeout
+        self.max_receive_count = max_receive_count
+        self.invocations = 0
+        self.retries = 0
+        self.lost = 0
+        # (visible at, sequence, message id, body, receive count)
+        self._messages = []
+        self._in_flight = 0
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._threads = [threading.Thread(target=self._poll, daemon=True) for _ in range(pollers)]
+        for t in self._threads:
+            t.start()
+
+    def deliver(self, event):
+        self._push(str(uuid.uuid4()), json.dumps(event), 0, time.monotonic())
+
+    def _push(self, message_id, body, receive_count, visible_at):
+        with self._condition:
+            heapq.heappush(
+                self._messages,
+                (visible_at, next(self._sequence), message_id, body, receive_count),
+            )
+            self._condition.notify()
+
+    def _receive(self):
+        """Waits for a batch of visible messages, as the SQS event source does"""
+
+        with self._condition:
+            deadline = None
+            while not self._closed:
+                now = time.monotonic()
+                visible = sum(1 for m in self._messages if m[0] <= now)
+                if visible and deadline is None:
+                    deadline = now + self.batching_window
+                if visible >= self.batch_size or (deadline is not None and now >= deadline):
+                    batch = []
+                    while (
+                        self._messages
+                        and self._messages[0][0] <= now
+                        and len(batch) < self.batch_size
+                    ):
+                        batch.append(heapq.heappop(self._messages))
+                    self._in_flight += len(batch)
+                    return batch
+                waits = [self.batching_window if deadline is None else deadline - now]
+                if self._messages and self._messages[0][0] > now:
+                    waits.append(self._messages[0][0] - now)
+                self._condition.wait(max(0.001, min(waits)))
+            return []
+
+    def _poll(self):
+        while not self._closed:
+            batch = self._receive()
+            if not batch:
+                continue
+
+            with self._condition:
+                self.invocations += 1
+            records = [{"messageId": m[2], "body": m[3]} for m in batch]
+            try:
+                response = dynamo_write.queue_handler({"Records": records}, None)
+                failed = {f["itemIdentifier"] for f in response["batchItemFailures"]}
+            except Exception:
+                failed = {m[2] for m in batch}
+
+            visible_at = time.monotonic() + self.visibility_timeout
+            for _, _, message_id, body, receive_count in batch:
+                if message_id not in failed:
+                    continue
+                if receive_count + 1 >= self.max_receive_count:
+                    with self._condition:
+                        self.lost += 1
+                else:
+                    with self._condition:
+                        self.retries += 1
+                    self._push(message_id, body, receive_count + 1, visible_at)
+
+            with self._condition:
+                self._in_flight -= len(batch)
+
+    def backlog(self):
+        return len(self._messages) + self._in_flight
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class EventBus(FakeClient):
+    """The hub event bus: accepts PutEvents calls (failing a fraction of the entries, which
+    event_emitter retries) and delivers each accepted entry to the target as an EventBridge
+    event. A fraction of the events is delivered twice, as EventBridge may"""
+
+    service_name = "events"
+
+    def __init__(self, target, latency=0.0, failure_rate=0.0, duplicate_rate=0.0):
+        super().__init__(latency)
+        self.target = target
+        self.failure_rate = failure_rate
+        self.duplicate_rate = duplicate_rate
+        self.rejected = 0
+        self.duplicated = 0
+
+    def put_events(self, Entries):
+        self._call("put_events")
+        results = []
+        for entry in Entries:
+            if random.random() < self.failure_rate:
+                with self._lock:
+                    self.rejected += 1
+                results.append({"ErrorCode": "ThrottlingException", "ErrorMessage": "fake"})
+                continue
+
+            event_id = str(uuid.uuid4())
+            event = {
+                "version": "0",
+                "id": event_id,
+                "detail-type": entry["DetailType"],
+                "source": entry["Source"],
+                "account": "123456789012",
+                "time": datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "region": "eu-west-1",
+                "resources": entry["Resources"],
+                "detail": json.loads(entry["Detail"]),
+            }
+            self.target.deliver(event)
+            if random.random() < self.duplicate_rate:
+                with self._lock:
+                    self.duplicated += 1
+                self.target.deliver(event)
+            results.append({"EventId": event_id})
+
+        failed = sum(1 for r in results if "ErrorCode" in r)
+        return {"FailedEntryCount": failed, "Entries": results}
+
+
+def schedule(n_spokes, duration, interval, shape):
+    """Returns the (offset in seconds, spoke) emissions of the run, in time order. In each
+    round, the spokes emit together (burst), evenly spread over the interval (staggered), or
+    at random times of the interval (jittered)"""
+
+    emissions = []
+    rounds = max(1, int(round(duration / interval)))
+    for r in range(rounds):
+        for s in range(n_spokes):
+            if shape == "burst":
+                offset = 0.0
+            elif shape == "staggered":
+                offset = interval * s / n_spokes
+            else:
+                offset = random.uniform(0, interval)
+            emissions.append((r * interval + offset, s))
+
+    return sorted(emissions)
+
+
+def run_load(args, n_spokes, n_metrics, mode, shape):
+    """Runs one load test, returns its result"""
+
+    dynamodb = FakeDynamoDB(latency=args.latency, write_capacity=args.write_capacity)
+    dynamo_write.dynamodb = dynamodb
+    dynamo_write.table = dynamodb.add_table(dynamo_write.ddb_table_name, SERIES_KEY, TIMESTAMP)
+
+    if mode == "direct":
+        target = DirectTarget(args.concurrency, args.retry_delay)
+    else:
+        target = QueueTarget(
+            args.concurrency,
+            args.batch_size,
+            args.batching_window,
+            args.visibility_timeout,
+            args.max_receive_count,
+        )
+    bus = EventBus(target, args.latency, args.put_events_failure_rate, args.duplicate_rate)
+
+    # the metrics of each spoke, as instantiated by retrieve_values
+    spokes = [
+        [LoadMetric(f"LoadMetric{m}", f"LoadProject{s}", {}, "load") for m in range(n_metrics)]
+        for s in range(n_spokes)
+    ]
+
+    # key of every event emitted, with the time of its extraction (epoch seconds)
+    emitted = {}
+    dropped_at_emission = []
+    lock = threading.Lock()
+
+    def fetch(s):
+        payloads = [m.extract() for m in spokes[s]]
+        dropped = event_emitter.put_entries(
+            [event_emitter.make_entry(p) for p in payloads], client=bus
+        )
+        with lock:
+            for p in payloads:
+                item = add_keys(p)
+                emitted[(str(item[SERIES_KEY]), str(item[TIMESTAMP]))] = item[TIMESTAMP] / 1e6
+            dropped_at_emission.extend(dropped)
+
+    backlog = []
+    start = time.monotonic()
+    started_at = time.time()
+    with futures.ThreadPoolExecutor(max_workers=min(n_spokes, args.spoke_workers)) as spokes_pool:
+        for offset, s in schedule(n_spokes, args.duration, args.interval, shape):
+            delay = start + offset - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            spokes_pool.submit(fetch, s)
+            backlog.append(target.backlog())
+    generated_in = time.monotonic() - start
+
+    # the events still in flight are given drain_timeout seconds to be written
+    drain_start = time.monotonic()
+    while target.backlog() and time.monotonic() - drain_start < args.drain_timeout:
+        backlog.append(target.backlog())
+        time.sleep(0.05)
+    drain_seconds = time.monotonic() - drain_start
+    left_in_flight = target.backlog()
+    target.close()
+
+    table = dynamo_write.table
+    written = set(table.written_at)
+    latencies = [
+        (table.written_at[k] - emitted_at) * 1000
+        for k, emitted_at in emitted.items()
+        if k in written
+    ]
+    write_times = sorted(table.written_at.values())
+    per_second = {}
+    for t in write_times:
+        per_second[int(t - started_at)] = per_second.get(int(t - started_at), 0) + 1
+    elapsed = (write_times[-1] - started_at) if write_times else None
+
+    return {
+        "benchmark": "load",
+        "params": {
+            "spokes": n_spokes,
+            "metrics": n_metrics,
+            "mode": mode,
+            "shape": shape,
+            "duration": args.duration,
+            "interval": args.interval,
+            "concurrency": args.concurrency,
+            "write_capacity": args.write_capacity,
+            "latency": args.latency,
+        },
+        "results": {
+            "events_emitted": len(emitted),
+            "items_stored": len(written & set(emitted)),
+            "generation_seconds": round(generated_in, 3),
+            "drain_seconds": round(drain_seconds, 3),
+            "items_per_second": round(len(write_times) / elapsed, 1) if elapsed else None,
+            "peak_items_per_second": max(per_second.values()) if per_second else 0,
+            "latency_ms": {
+                "p50": round(percentile(latencies, 50) or 0, 1),
+                "p95": round(percentile(latencies, 95) or 0, 1),
+                "p99": round(percentile(latencies, 99) or 0, 1),
+                "max": round(max(latencies, default=0), 1),
+            },
+            "max_backlog": max(backlog, default=0),
+            "retries": {
+                "put_events": bus.rejected,
+                "delivery": target.retries,
+                "throttled_writes": dynamodb.throttled,
+            },
+            "invocations": target.invocations,
+            "api_calls": dict(dynamodb.calls + bus.calls),
+            "lost": {
+                "at_emission": len(dropped_at_emission),
+                "at_ingest": target.lost,
+                "in_flight": left_in_flight,
+                "missing": len(set(emitted) - written),
+            },
+            "duplicated": {
+                "deliveries": bus.duplicated,
+                "writes": sum(c - 1 for c in table.writes.values() if c > 1),
+                "unexpected_items": len(written - set(emitted)),
+            },
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--spokes", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--metrics", type=int, nargs="+", default=[10], help="metrics per spoke")
+    parser.add_argument(
+        "--mode", nargs="+", choices=["direct", "queue"], default=["direct", "queue"]
+    )
+    parser.add_argument(
+        "--shape", nargs="+", choices=["burst", "staggered", "jittered"], default=["burst"]
+    )
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load")
+    parser.add_argument("--interval", type=float, default=5, help="seconds between fetch rounds")
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds per API call")
+    parser.add_argument(
+        "--write-capacity", type=float, help="table writes per second, on-demand by default"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=10, help="concurrent invocations of dynamo_write"
+    )
+    parser.add_argument("--put-events-failure-rate", type=float, default=0.0)
+    parser.add_argument("--duplicate-rate", type=float, default=0.0, help="events delivered twice")
+    parser.add_argument("--retry-delay", type=float, default=1.0, help="direct mode")
+    parser.add_argument("--batch-size", type=int, default=100, help="queue mode")
+    parser.add_argument("--batching-window", type=float, default=0.5, help="queue mode")
+    parser.add_argument("--visibility-timeout", type=float, default=2.0, help="queue mode")
+    parser.add_argument("--max-receive-count", type=int, default=5, help="queue mode")
+    parser.add_argument("--spoke-workers", type=int, default=32, help="spokes extracting at once")
+    parser.add_argument("--drain-timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file to append the results to, stdout by default")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    header = {
+        "revision": git_revision(),
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+    }
+
+    out = open(args.output, "a") if args.output else sys.stdout
+    for n_spokes, n_metrics, mode, shape in itertools.product(
+        args.spokes, args.metrics, args.mode, args.shape
+    ):
+        result = run_load(args, n_spokes, n_metrics, mode, shape)
+        out.write(json.dumps({**header, **result}) + "\n")
+        out.flush()
+    if args.output:
+        out.close()
+
+
+if __name__ == "__main__":
+    main()
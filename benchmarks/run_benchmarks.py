@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""Offline benchmarks of the extraction (spoke) and ingest (hub) hot paths.
+
+The AWS clients are replaced by the in-process stand-ins of fakes.py, with a configurable
+latency, so the benchmarks need no network access and no credentials. Each result is written
+as one JSON line, to stdout or to --output, so that runs can be compared over time.
+
+Example:
+
+    python3 benchmarks/run_benchmarks.py --latency 0.02 --output bench.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import datetime
+
+# the clients are created at import time: they need a region, never credentials
+os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+os.environ.setdefault("LOGLEVEL", "WARNING")
+os.environ.setdefault("METRICS_ENABLED", "false")
+os.environ["DDB_TABLE_NAME"] = "ds-dashboard-hub-metrics"
+os.environ.pop("STATE_STORE_URI", None)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "lambda_function_code"))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import metric
+import retrieve_values
+import event_emitter
+import training_job_index
+import value_cache
+import dynamo_write
+from api_cache import CachedClient
+from table_schema import SERIES_KEY, TIMESTAMP
+from fakes import FakeSageMaker, FakeSSM, FakeEvents, FakeDynamoDB
+
+# the metrics shipped with the solution, cycled to reach the number of metrics requested
+BASE_METRICS = [
+    metric.TotalCompletedTrainingJobs,
+    metric.CompletedTrainingJobs24h,
+    metric.NumberEndPointsInService,
+    metric.SSMParamStoreValueMyName,
+]
+
+
+def git_revision():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except Exception:
+        return None
+
+
+def define_metrics(n_metrics):
+    """Defines n_metrics metric classes, registered by name as all the Metric subclasses"""
+
+    names = []
+    for i in range(n_metrics):
+        base = BASE_METRICS[i % len(BASE_METRICS)]
+        name = f"Bench{i}{base.__name__}"
+        type(name, (base,), {})
+        names.append(name)
+
+    return names
+
+
+def bench_imports(modules=("retrieve_values", "dynamo_write", "dashboard_connection")):
+    """Time to import the handler modules in a fresh interpreter, as in a cold start"""
+
+    results = []
+    for module in modules:
+        code = (
+            "import sys, time; "
+            f"sys.path.insert(0, {os.path.join(ROOT, 'lambda_function_code')!r}); "
+            f"start = time.perf_counter(); import {module}; "
+            "print(time.perf_counter() - start, 'boto3' in sys.modules)"
+        )
+        output = subprocess.check_output([sys.executable, "-c", code], env=os.environ)
+        seconds, boto3_loaded = output.decode().split()
+        results.append(
+            {
+                "benchmark": "import",
+                "params": {"module": module},
+                "results": {
+                    "wall_seconds": round(float(seconds), 4),
+                    "boto3_imported": boto3_loaded == "True",
+                },
+            }
+        )
+
+    return results
+
+
+def bench_extraction(n_metrics, n_jobs, latency):
+    """One cold extraction (empty job index) followed by a warm one"""
+
+    sagemaker = FakeSageMaker(n_jobs=n_jobs, n_endpoints=20, latency=latency)
+    ssm = FakeSSM(latency=latency)
+    events = FakeEvents(latency=latency)
+
+    metric.sagemaker_client = CachedClient(sagemaker)
+    metric.ssm_client = CachedClient(ssm)
+    event_emitter.events_client = events
+    training_job_index._indexes.clear()
+
+    os.environ["METRIC_NAMES"] = ",".join(define_metrics(n_metrics))
+    os.environ["PROJECT_NAME"] = "BenchProject"
+    os.environ["ENVIRONMENT"] = "bench"
+
+    results = []
+    for run in ["cold", "warm"]:
+        sagemaker.calls.clear()
+        ssm.calls.clear()
+        events.calls.clear()
+        events.bytes_received = 0
+        # the warm run refreshes the index, as a later invocation would
+        for index in training_job_index._indexes.values():
+            index.synced_at = None
+        # and computes the metrics again, whatever their _ttl_seconds
+        value_cache._values = {}
+
+        start = time.perf_counter()
+        response = retrieve_values.lambda_handler({}, None)
+        wall = time.perf_counter() - start
+
+        results.append(
+            {
+                "benchmark": "extraction",
+                "params": {
+                    "metrics": n_metrics,
+                    "jobs": n_jobs,
+                    "latency": latency,
+                    "run": run,
+                },
+                "results": {
+                    "wall_seconds": round(wall, 4),
+                    "api_calls": dict(sagemaker.calls + ssm.calls + events.calls),
+                    "total_api_calls": sum(
+                        (sagemaker.calls + ssm.calls + events.calls).values()
+                    ),
+                    "bytes_emitted": events.bytes_received,
+                    "emitted": response["emitted"],
+                    "timed_out": len(response["timed_out"]),
+                    "failed": len(response["failed"]),
+                },
+            }
+        )
+
+    return results
+
+
+def bench_ingest(n_spokes, n_metrics, latency, batch_size=100):
+    """Ingest of one fetch round (n_spokes x n_metrics events), through the direct path
+    (one invocation and PutItem per event) and the queue path (batches of SQS records)"""
+
+    base_timestamp = int(time.time() * 1e6)
+    events = [
+        {
+            "source": "metric_extractor",
+            "detail-type": "metric_extractor",
+            "resources": [],
+            "detail": {
+                "MetricName": f"Metric{m}",
+                "MetricValue": m * 1.5,
+                "ExtractionDate": "",
+                "ExtractionTimestamp": base_timestamp + s,
+                "Metadata": {},
+                "Environment": "bench",
+                "ProjectName": f"Project{s}",
+            },
+        }
+        for s in range(n_spokes)
+        for m in range(n_metrics)
+    ]
+
+    results = []
+
+    for mode in ["direct", "queue"]:
+        dynamodb = FakeDynamoDB(latency=latency)
+        dynamo_write.dynamodb = dynamodb
+        dynamo_write.table = dynamodb.add_table(
+            dynamo_write.ddb_table_name, SERIES_KEY, TIMESTAMP
+        )
+
+        start = time.perf_counter()
+        if mode == "direct":
+            invocations = len(events)
+            for e in events:
+                dynamo_write.lambda_handler(e, None)
+        else:
+            invocations = 0
+            for i in range(0, len(events), batch_size):
+                records = [
+                    {"messageId": str(j), "body": json.dumps(e)}
+                    for j, e in enumerate(events[i : i + batch_size], start=i)
+                ]
+                dynamo_write.queue_handler({"Records": records}, None)
+                invocations += 1
+        wall = time.perf_counter() - start
+
+        results.append(
+            {
+                "benchmark": "ingest",
+                "params": {
+                    "spokes": n_spokes,
+                    "metrics": n_metrics,
+                    "latency": latency,
+                    "mode": mode,
+                },
+                "results": {
+                    "wall_seconds": round(wall, 4),
+                    "items_per_second": round(len(events) / wall, 1) if wall else None,
+                    "invocations": invocations,
+                    "api_calls": dict(dynamodb.calls),
+                    "items_stored": len(dynamo_write.table.items),
+                    "bytes_stored": dynamo_write.table.size_bytes(),
+                },
+            }
+        )
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds per API call")
+    parser.add_argument("--metrics", type=int, nargs="+", default=[4, 16, 64])
+    parser.add_argument("--jobs", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--spokes", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--output", help="file to append the results to, stdout by default")
+    args = parser.parse_args()
+
+    header = {
+        "revision": git_revision(),
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+    }
+
+    results = bench_imports()
+    for n_metrics in args.metrics:
+        for n_jobs in args.jobs:
+            results.extend(bench_extraction(n_metrics, n_jobs, args.latency))
+    for n_spokes in args.spokes:
+        results.extend(bench_ingest(n_spokes, 10, args.latency))
+
+    out = open(args.output, "a") if args.output else sys.stdout
+    for r in results:
+        out.write(json.dumps({**header, **r}) + "\n")
+    if args.output:
+        out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import ast
+from aws_cdk import aws_lambda
+
+LAMBDA_CODE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lambda_function_code"
+)
+
+
+def local_dependencies(modules, code_dir=LAMBDA_CODE_DIR):
+    """Returns the modules of code_dir needed by the given ones, including themselves.
+    Imports are followed transitively, wherever they appear in the code (also inside functions)
+
+    Args:
+        modules (list): the names of the modules, e.g. ["retrieve_values"]
+        code_dir (str): the directory of the lambda code
+
+    Returns:
+        [set]: the names of the modules
+    """
+
+    found = set()
+    to_visit = list(modules)
+
+    while to_visit:
+        module = to_visit.pop()
+        path = os.path.join(code_dir, f"{module}.py")
+        if module in found or not os.path.isfile(path):
+            continue
+        found.add(module)
+
+        with open(path) as f:
+            tree = ast.parse(f.read(), filename=path)
+
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                to_visit.extend(a.name.split(".")[0] for a in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                to_visit.append(node.module.split(".")[0])
+
+    return found
+
+
+def lambda_code(*modules):
+    """Returns an asset with only the modules of the lambda code needed by the given ones,
+    instead of the whole directory, to keep each lambda package (and its cold start) small.
+    Modules imported dynamically (e.g. the metric modules) must be listed explicitly
+
+    Args:
+        modules (str): the names of the modules, starting with the one of the handler
+
+    Returns:
+        [aws_lambda.Code]: the asset
+    """
+
+    included = sorted(local_dependencies(modules))
+
+    return aws_lambda.Code.from_asset(
+        LAMBDA_CODE_DIR, exclude=["*"] + [f"!{m}.py" for m in included]
+    )
@@ -8,7 +8,16 @@ from aws_cdk import (
     aws_iam,
     aws_events,
     aws_events_targets,
+    aws_lambda_event_sources,
+    aws_sqs,
+    aws_s3,
 )
+from ds_dashboard.assets import lambda_code
+
+# the longest a lambda can run
+LAMBDA_MAX_TIMEOUT_SECONDS = 900
+# the longest fetch_window_seconds: the fetch lambda needs 30 more seconds to send the requests
+MAX_FETCH_WINDOW_SECONDS = LAMBDA_MAX_TIMEOUT_SECONDS - 30
 
 
 class HubStack(core.Stack):
@@ -16,7 +25,16 @@ class HubStack(core.Stack):
     This class deploys the resources needed to operate the Hub of this solution.
     The list of resources created is:
 
-    * A DDB table, a lambda to write new items into it, and an EventBridge rule to trigger the lambda
+    * A DDB table, a lambda to write new items into it, and an EventBridge rule to trigger the lambda.
+    The lambda reads the large Metadata that the spokes offloaded to their state bucket
+    With the context variable ingest_mode=queue, the rule sends the events to an SQS queue instead,
+    and the lambda drains it in batches
+    * a table of hourly and daily rollups, maintained by a lambda reading the stream of the DDB table.
+    Raw items expire after raw_retention_days (context variable, default 90)
+    * a table with the latest value of each time series, maintained by the same lambda
+    * a lambda answering time-series queries on the tables
+    * with the context variable export_layer_arn, a bucket and an hourly lambda exporting the new
+    items to Parquet files, partitioned by project and date
     * a lambda to setup the connection to al new spoke
     * a lambda to request new data from all the spokes
     """
@@ -24,7 +42,10 @@ class HubStack(core.Stack):
     def __init__(self, scope: core.Construct, construct_id: str, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
-        table = aws_dynamodb.Table(
+        # the table written by the first version of this solution (MetricName / ExtractionDate).
+        # It is not written anymore, and it is kept until its items are moved to the new table
+        # with scripts/migrate_table.py
+        aws_dynamodb.Table(
             self,
             id="ds-dashboard-hub-table",
             table_name="ds-dashboard-hub-table",
@@ -38,17 +59,114 @@ class HubStack(core.Stack):
             removal_policy=core.RemovalPolicy.DESTROY,
         )
 
+        # one partition per time series (ProjectName#Environment#MetricName), sorted by UTC epoch
+        table = aws_dynamodb.Table(
+            self,
+            id="ds-dashboard-hub-metrics",
+            table_name="ds-dashboard-hub-metrics",
+            partition_key=aws_dynamodb.Attribute(
+                name="SeriesKey", type=aws_dynamodb.AttributeType.STRING
+            ),
+            sort_key=aws_dynamodb.Attribute(
+                name="ExtractionTimestamp", type=aws_dynamodb.AttributeType.NUMBER
+            ),
+            point_in_time_recovery=True,
+            removal_policy=core.RemovalPolicy.DESTROY,
+            # raw items expire after raw_retention_days, the rollups keep the long-term history
+            time_to_live_attribute="ExpiresAt",
+            # the stream carries the new items, so that the latest-value table is updated
+            # without reading them back
+            stream=aws_dynamodb.StreamViewType.NEW_IMAGE,
+        )
+
+        # all metrics for a project in a time range
+        table.add_global_secondary_index(
+            index_name="project-time-index",
+            partition_key=aws_dynamodb.Attribute(
+                name="ProjectName", type=aws_dynamodb.AttributeType.STRING
+            ),
+            sort_key=aws_dynamodb.Attribute(
+                name="ExtractionTimestamp", type=aws_dynamodb.AttributeType.NUMBER
+            ),
+        )
+
+        # all projects for a metric on a given day (MetricName#YYYY-MM-DD)
+        table.add_global_secondary_index(
+            index_name="metric-day-index",
+            partition_key=aws_dynamodb.Attribute(
+                name="MetricDay", type=aws_dynamodb.AttributeType.STRING
+            ),
+            sort_key=aws_dynamodb.Attribute(
+                name="ExtractionTimestamp", type=aws_dynamodb.AttributeType.NUMBER
+            ),
+        )
+
+        # hourly and daily min/max/sum/count/last of each time series
+        rollup_table = aws_dynamodb.Table(
+            self,
+            id="ds-dashboard-hub-rollups",
+            table_name="ds-dashboard-hub-rollups",
+            partition_key=aws_dynamodb.Attribute(
+                name="RollupKey", type=aws_dynamodb.AttributeType.STRING
+            ),
+            sort_key=aws_dynamodb.Attribute(
+                name="BucketStart", type=aws_dynamodb.AttributeType.NUMBER
+            ),
+            point_in_time_recovery=True,
+            removal_policy=core.RemovalPolicy.DESTROY,
+            time_to_live_attribute="ExpiresAt",
+        )
+
+        # the newest item of each time series, for the "current value of everything" reads
+        latest_table = aws_dynamodb.Table(
+            self,
+            id="ds-dashboard-hub-latest",
+            table_name="ds-dashboard-hub-latest",
+            partition_key=aws_dynamodb.Attribute(
+                name="ProjectName", type=aws_dynamodb.AttributeType.STRING
+            ),
+            sort_key=aws_dynamodb.Attribute(
+                name="SeriesKey", type=aws_dynamodb.AttributeType.STRING
+            ),
+            removal_policy=core.RemovalPolicy.DESTROY,
+        )
+
+        # the current value of a metric in all the projects
+        latest_table.add_global_secondary_index(
+            index_name="metric-series-index",
+            partition_key=aws_dynamodb.Attribute(
+                name="MetricName", type=aws_dynamodb.AttributeType.STRING
+            ),
+            sort_key=aws_dynamodb.Attribute(
+                name="SeriesKey", type=aws_dynamodb.AttributeType.STRING
+            ),
+        )
+
+        ingest_mode = self.node.try_get_context("ingest_mode") or "direct"
+        # retention of raw items and hourly rollups, in days. 0 keeps them forever
+        raw_retention_days = self.node.try_get_context("raw_retention_days")
+        raw_retention_days = str(90 if raw_retention_days is None else raw_retention_days)
+        hourly_retention_days = self.node.try_get_context("hourly_retention_days")
+        hourly_retention_days = str(
+            400 if hourly_retention_days is None else hourly_retention_days
+        )
+
         # This lambda is triggered by events arriving from the spoke accounts and writes to ddb
         dynamo_write_lambda = aws_lambda.Function(
             self,
             "ds-dashboard-dynamo-write",
             function_name="ds-dashboard-dynamo-write",
             runtime=aws_lambda.Runtime.PYTHON_3_9,
-            code=aws_lambda.Code.asset("lambda_function_code"),
-            handler="dynamo_write.lambda_handler",
+            code=lambda_code("dynamo_write"),
+            handler="dynamo_write.queue_handler"
+            if ingest_mode == "queue"
+            else "dynamo_write.lambda_handler",
             timeout=core.Duration.minutes(1),
             memory_size=128,
-            environment={"DDB_TABLE_NAME": table.table_name},
+            environment={
+                "DDB_TABLE_NAME": table.table_name,
+                "RAW_RETENTION_DAYS": raw_retention_days,
+            },
         )
 
         dynamo_rule = aws_events.Rule(
@@ -65,24 +183,167 @@ class HubStack(core.Stack):
 
         dynamo_rule.apply_removal_policy(core.RemovalPolicy.DESTROY)
 
-        dynamo_rule.add_target(aws_events_targets.LambdaFunction(dynamo_write_lambda))
+        if ingest_mode == "queue":
+            # events are buffered in a queue, and written in batches
+            dead_letter_queue = aws_sqs.Queue(
+                self,
+                "ds-dashboard-ingest-dlq",
+                retention_period=core.Duration.days(14),
+            )
 
-        dynamo_write_lambda.add_permission(
-            "fromEB",
-            principal=aws_iam.ServicePrincipal("events.amazonaws.com"),
-            action="lambda:InvokeFunction",
-            source_arn=dynamo_rule.rule_arn,
-        )
+            ingest_queue = aws_sqs.Queue(
+                self,
+                "ds-dashboard-ingest-queue",
+                # recommended: at least 6 times the timeout of the consumer
+                visibility_timeout=core.Duration.minutes(6),
+                dead_letter_queue=aws_sqs.DeadLetterQueue(
+                    max_receive_count=5, queue=dead_letter_queue
+                ),
+            )
+
+            dynamo_rule.add_target(aws_events_targets.SqsQueue(ingest_queue))
+
+            dynamo_write_lambda.add_event_source(
+                aws_lambda_event_sources.SqsEventSource(
+                    ingest_queue,
+                    batch_size=100,
+                    max_batching_window=core.Duration.seconds(10),
+                    report_batch_item_failures=True,
+                )
+            )
+        else:
+            dynamo_rule.add_target(
+                aws_events_targets.LambdaFunction(dynamo_write_lambda)
+            )
+
+            dynamo_write_lambda.add_permission(
+                "fromEB",
+                principal=aws_iam.ServicePrincipal("events.amazonaws.com"),
+                action="lambda:InvokeFunction",
+                source_arn=dynamo_rule.rule_arn,
+            )
 
         table.grant_write_data(dynamo_write_lambda)
 
+        # the large Metadata offloaded by the spokes (deployed with hub_account) is read from
+        # their state buckets, which grant this account access to it. The lambda checks that
+        # the bucket is the one of the account sending the event (see payload_codec)
+        dynamo_write_lambda.role.add_to_policy(
+            aws_iam.PolicyStatement(
+                actions=["s3:GetObject"],
+                resources=["arn:aws:s3:::ds-dashboard-spoke-state-*/payloads/*"],
+            )
+        )
+
+        # this lambda maintains the rollups from the stream of the hub table
+        materialize_lambda = aws_lambda.Function(
+            self,
+            "ds-dashboard-materialize",
+            function_name="ds-dashboard-materialize",
+            runtime=aws_lambda.Runtime.PYTHON_3_9,
+            code=lambda_code("materialize"),
+            handler="materialize.lambda_handler",
+            timeout=core.Duration.minutes(1),
+            memory_size=128,
+            environment={
+                "DDB_TABLE_NAME": table.table_name,
+                "ROLLUP_TABLE_NAME": rollup_table.table_name,
+                "LATEST_TABLE_NAME": latest_table.table_name,
+                "HOURLY_RETENTION_DAYS": hourly_retention_days,
+            },
+        )
+
+        materialize_lambda.add_event_source(
+            aws_lambda_event_sources.DynamoEventSource(
+                table,
+                starting_position=aws_lambda.StartingPosition.TRIM_HORIZON,
+                batch_size=100,
+                max_batching_window=core.Duration.seconds(30),
+                bisect_batch_on_error=True,
+                retry_attempts=10,
+            )
+        )
+
+        table.grant_read_data(materialize_lambda)
+        rollup_table.grant_read_write_data(materialize_lambda)
+        latest_table.grant_read_write_data(materialize_lambda)
+
+        # this lambda answers time-series queries on the metrics and rollups tables
+        query_lambda = aws_lambda.Function(
+            self,
+            "ds-dashboard-query",
+            function_name="ds-dashboard-query",
+            runtime=aws_lambda.Runtime.PYTHON_3_9,
+            code=lambda_code("query_metrics"),
+            handler="query_metrics.lambda_handler",
+            timeout=core.Duration.minutes(1),
+            memory_size=128,
+            environment={
+                "DDB_TABLE_NAME": table.table_name,
+                "ROLLUP_TABLE_NAME": rollup_table.table_name,
+                "LATEST_TABLE_NAME": latest_table.table_name,
+            },
+        )
+
+        table.grant_read_data(query_lambda)
+        rollup_table.grant_read_data(query_lambda)
+        latest_table.grant_read_data(query_lambda)
+
+        # optional: an hourly export of the new items to Parquet files, for Athena and QuickSight.
+        # it needs a layer providing pyarrow, e.g. the AWS SDK for pandas one
+        export_layer_arn = self.node.try_get_context("export_layer_arn")
+        if export_layer_arn:
+            export_bucket = aws_s3.Bucket(
+                self,
+                "ds-dashboard-exports",
+                block_public_access=aws_s3.BlockPublicAccess.BLOCK_ALL,
+                encryption=aws_s3.BucketEncryption.S3_MANAGED,
+                enforce_ssl=True,
+                removal_policy=core.RemovalPolicy.RETAIN,
+            )
+
+            export_lambda = aws_lambda.Function(
+                self,
+                "ds-dashboard-export",
+                function_name="ds-dashboard-export",
+                runtime=aws_lambda.Runtime.PYTHON_3_9,
+                code=lambda_code("export_parquet"),
+                handler="export_parquet.lambda_handler",
+                layers=[
+                    aws_lambda.LayerVersion.from_layer_version_arn(
+                        self, "pyarrow-layer", export_layer_arn
+                    )
+                ],
+                timeout=core.Duration.minutes(15),
+                memory_size=1024,
+                # runs never overlap, they share the watermark
+                reserved_concurrent_executions=1,
+                environment={
+                    "DDB_TABLE_NAME": table.table_name,
+                    "LATEST_TABLE_NAME": latest_table.table_name,
+                    "EXPORT_URI": f"s3://{export_bucket.bucket_name}/metrics",
+                },
+            )
+
+            table.grant_read_data(export_lambda)
+            latest_table.grant_read_data(export_lambda)
+            export_bucket.grant_read_write(export_lambda)
+            export_bucket.grant_delete(export_lambda)
+
+            export_rule = aws_events.Rule(
+                self,
+                id="ds-dashboard-export-schedule",
+                schedule=aws_events.Schedule.rate(core.Duration.hours(1)),
+            )
+            export_rule.add_target(aws_events_targets.LambdaFunction(export_lambda))
+
         # this lambda configures the connection to the spokes.
         dashboard_connection_lambda = aws_lambda.Function(
             self,
             "ds-dashboard-connection",
             function_name="ds-dashboard-connection",
             runtime=aws_lambda.Runtime.PYTHON_3_9,
-            code=aws_lambda.Code.asset("lambda_function_code"),
+            code=lambda_code("dashboard_connection"),
             handler="dashboard_connection.lambda_handler",
             timeout=core.Duration.minutes(1),
             memory_size=128,
@@ -93,6 +354,12 @@ class HubStack(core.Stack):
                 "events:PutRule",
                 "events:PutTargets",
                 "events:PutPermission",
+                "events:ListRules",
+                "events:ListTargetsByRule",
+                "events:DescribeEventBus",
+                "events:RemovePermission",
+                "events:RemoveTargets",
+                "events:DeleteRule",
                 "ssm:GetParametersByPath",
             ],
             resources=["*"],
@@ -102,19 +369,53 @@ class HubStack(core.Stack):
 
         # a third lambda, just a utility function to emit a custom event. the event will be forwarded to all spokes and will trigger there new extractions
 
+        # with fetch_tick_minutes, a schedule invokes it to fetch each spoke once per interval,
+        # at its own offset. fetch_window_seconds spreads the on-demand fetches
+        fetch_tick_minutes = self.node.try_get_context("fetch_tick_minutes")
+        fetch_window_seconds = int(self.node.try_get_context("fetch_window_seconds") or 0)
+        # the window must leave the lambda time to send the last shard, within its 15 minutes
+        if not 0 <= fetch_window_seconds <= MAX_FETCH_WINDOW_SECONDS:
+            raise ValueError(
+                f"fetch_window_seconds must be between 0 and {MAX_FETCH_WINDOW_SECONDS}, "
+                f"got {fetch_window_seconds}"
+            )
+
         fetch_new_data = aws_lambda.Function(
             self,
             "ds-dashboard-fetch-new-data",
             function_name="ds-dashboard-fetch-new-data",
             runtime=aws_lambda.Runtime.PYTHON_3_9,
-            code=aws_lambda.Code.asset("lambda_function_code"),
+            code=lambda_code("fetch_metric_values"),
             handler="fetch_metric_values.lambda_handler",
-            timeout=core.Duration.minutes(1),
+            timeout=core.Duration.seconds(
+                min(LAMBDA_MAX_TIMEOUT_SECONDS, max(60, fetch_window_seconds + 30))
+            ),
             memory_size=128,
+            environment={
+                "FETCH_TICK_SECONDS": str(int(fetch_tick_minutes or 0) * 60),
+                "FETCH_WINDOW_SECONDS": str(fetch_window_seconds),
+            },
         )
 
+        # the function reads the forwarding rules to shard the spokes along them
         fetch_policy_statement = aws_iam.PolicyStatement(
-            actions=["events:PutEvents"], resources=["*"]
+            actions=[
+                "events:PutEvents",
+                "events:ListRules",
+                "events:ListTargetsByRule",
+                "ssm:GetParametersByPath",
+            ],
+            resources=["*"],
         )
 
         fetch_new_data.role.add_to_policy(fetch_policy_statement)
+
+        if fetch_tick_minutes:
+            fetch_schedule = aws_events.Rule(
+                self,
+                id="ds-dashboard-fetch-schedule",
+                schedule=aws_events.Schedule.rate(
+                    core.Duration.minutes(int(fetch_tick_minutes))
+                ),
+            )
+            fetch_schedule.add_target(aws_events_targets.LambdaFunction(fetch_new_data))
@@ -0,0 +1,189 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import inspect
+import fnmatch
+import logging
+import os
+
+logging.basicConfig()
+
+logger = logging.getLogger("stack:iam_policy")
+logger.setLevel(os.getenv("LOGLEVEL", "INFO"))
+
+# IAM limits the aggregate size of the inline policies of a role, whitespace excluded, see
+# https://docs.aws.amazon.com/IAM/latest/UserGuide/reference_iam-quotas.html
+ROLE_INLINE_POLICIES_MAX_CHARACTERS = 10240
+# left for the other inline policies of the role, written by CDK (e.g. bucket grants)
+DEFAULT_HEADROOM_CHARACTERS = 1024
+
+# the size is checked with values as long as the longest the placeholders can take
+SIZING_REGION = "ap-northeast-1"
+SIZING_ACCOUNT_ID = "123456789012"
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+
+def _unique(values):
+    """Removes the duplicates (case-insensitively, as IAM compares actions), keeping the order"""
+
+    seen = set()
+    unique = []
+    for v in values:
+        if v.lower() not in seen:
+            seen.add(v.lower())
+            unique.append(v)
+
+    return unique
+
+
+def _compact_actions(actions):
+    """Deduplicates the actions, and drops those matched by a wildcard action of the list"""
+
+    actions = _unique(actions)
+    wildcards = [a.lower() for a in actions if "*" in a or "?" in a]
+
+    return sorted(
+        a
+        for a in actions
+        if not any(w != a.lower() and fnmatch.fnmatchcase(a.lower(), w) for w in wildcards)
+    )
+
+
+def _compact_resources(resources):
+    resources = _unique(resources)
+
+    return ["*"] if "*" in resources else sorted(resources)
+
+
+def _single(values):
+    return values[0] if len(values) == 1 else values
+
+
+def merge_statements(statements):
+    """Merges policy statements granting the same access: first the actions of the statements
+    with the same effect, resources and condition, then the resources of the statements with
+    the same effect, actions and condition. Duplicate actions and resources are dropped.
+    Statements with NotAction, NotResource or Principal are only deduplicated.
+
+    Args:
+        statements (list): the statements, with Action and Resource as strings or lists
+
+    Returns:
+        [list]: the merged statements, in a deterministic order
+    """
+
+    others = []
+    by_resources = {}
+
+    for s in statements:
+        if any(k in s for k in ("NotAction", "NotResource", "Principal")):
+            if s not in others:
+                others.append(s)
+            continue
+
+        effect = s.get("Effect", "Allow")
+        condition = json.dumps(s.get("Condition"), sort_keys=True)
+        resources = tuple(_compact_resources(_as_list(s.get("Resource"))))
+        by_resources.setdefault((effect, condition, resources), []).extend(
+            _as_list(s.get("Action"))
+        )
+
+    by_actions = {}
+    for (effect, condition, resources), actions in by_resources.items():
+        key = (effect, condition, tuple(_compact_actions(actions)))
+        by_actions.setdefault(key, []).extend(resources)
+
+    merged = []
+    for (effect, condition, actions), resources in sorted(by_actions.items()):
+        statement = {
+            "Effect": effect,
+            "Action": _single(list(actions)),
+            "Resource": _single(_compact_resources(resources)),
+        }
+        if condition != "null":
+            statement["Condition"] = json.loads(condition)
+        merged.append(statement)
+
+    return merged + others
+
+
+def policy_size(document):
+    """Returns the size of a policy document as IAM counts it, whitespace excluded"""
+
+    return sum(1 for c in json.dumps(document) if not c.isspace())
+
+
+def metric_permissions(metric_class, region, account_id):
+    """Returns the statements needed by a metric class. get_iam_permissions is a class method of
+    Metric: a class overriding it with an instance method (as was allowed before) is given a
+    dummy instance"""
+
+    if isinstance(inspect.getattr_static(metric_class, "get_iam_permissions"), classmethod):
+        return metric_class.get_iam_permissions(region, account_id)
+
+    logger.warning(
+        f"{metric_class.__name__}.get_iam_permissions should be a classmethod, "
+        "instantiating the metric to call it"
+    )
+    return metric_class("", "", "", "").get_iam_permissions(region, account_id)
+
+
+def build_policy_document(
+    metric_classes,
+    region,
+    account_id,
+    max_characters=ROLE_INLINE_POLICIES_MAX_CHARACTERS - DEFAULT_HEADROOM_CHARACTERS,
+    metric_regions=(),
+):
+    """Builds the policy document granting the permissions needed by metric_classes, with the
+    statements merged. Fails if the document, once deployed, would be larger than max_characters
+
+    Args:
+        metric_classes (list): the metric classes, duplicates are ignored
+        region (str): the region of the spoke, usually the CDK token Aws.REGION
+        account_id (str): the account of the spoke, usually the CDK token Aws.ACCOUNT_ID
+        max_characters (int): the maximum size of the document, whitespace excluded
+        metric_regions (list): the regions the metrics are extracted from, for those that do
+        not declare their own _regions (see retrieve_values.METRIC_REGIONS)
+
+    Returns:
+        [dict]: the policy document
+    """
+
+    metric_classes = list(dict.fromkeys(metric_classes))
+
+    def build(region, account_id):
+        statements = []
+        for c in metric_classes:
+            # the region of the spoke is always needed, e.g. to emit the events
+            regions = [region] + [
+                r for r in getattr(c, "_regions", None) or metric_regions if r != region
+            ]
+            for r in regions:
+                statements.extend(metric_permissions(c, r, account_id))
+        return {"Version": "2012-10-17", "Statement": merge_statements(statements)}
+
+    # the CDK tokens only get their value at deploy time: the size is checked with the longest
+    # values they can take
+    size = policy_size(build(SIZING_REGION, SIZING_ACCOUNT_ID))
+    if size > max_characters:
+        raise ValueError(
+            f"The IAM policy of the {len(metric_classes)} metrics takes {size} characters, "
+            f"more than the {max_characters} allowed in the inline policies of a role: "
+            "narrow the permissions of the metrics (e.g. with wildcards), or split them "
+            "among several spokes"
+        )
+
+    document = build(region, account_id)
+    logger.info(
+        f"IAM policy of {len(metric_classes)} metrics: {len(document['Statement'])} statements, "
+        f"about {size} characters"
+    )
+
+    return document
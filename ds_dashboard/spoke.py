@@ -1,14 +1,31 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
-from lambda_function_code.metric import *
-from aws_cdk import core, aws_iam, aws_lambda, aws_events, aws_events_targets
-from aws_cdk.core import Aws, Environment, RemovalPolicy
-from botocore.utils import merge_dicts
 import json
 import os
+import sys
 import logging
 
+# the lambda code imports its modules as top-level ones, as in the lambda runtime
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "lambda_function_code")
+)
+
+import metric_registry
+from fetch_selector import spoke_pattern
+from aws_cdk import (
+    core,
+    aws_iam,
+    aws_lambda,
+    aws_events,
+    aws_events_targets,
+    aws_s3,
+)
+from aws_cdk.core import Aws, Environment, RemovalPolicy
+from botocore.utils import merge_dicts
+from ds_dashboard.assets import lambda_code
+from ds_dashboard.iam_policy import build_policy_document
+
 logging.basicConfig()
 
 logger = logging.getLogger("stack:spoke")
@@ -26,7 +43,7 @@ class SpokeStack(core.Stack):
     * the name of the project
 
     For each metric specified in the context, the stack will retrieve from the python code the AIM permissions it needs
-    and add them to a new IAM policy
+    and merge them into a new IAM policy
 
     This policy will be attached to the execution role of the extraction lambda (created also here), which takes care
     of collecting metrics from the local account and writing their values in custom EventBridge events
@@ -43,22 +60,34 @@ class SpokeStack(core.Stack):
         metrics = self.node.try_get_context("metrics")
         environment = self.node.try_get_context("environment")
         project_name = self.node.try_get_context("project_name")
+        # the modules defining the metrics, in addition to the ones shipped in metric.py
+        metric_modules = self.node.try_get_context("metric_modules") or "metric"
+        # with a heartbeat (seconds), only the values that changed are emitted, and the
+        # unchanged ones once per heartbeat. 0 emits every value at every fetch
+        heartbeat_seconds = self.node.try_get_context("heartbeat_seconds") or 0
+        # other regions to extract the metrics from, comma separated, in addition to the one
+        # of the stack (for the metrics that do not declare their own _regions)
+        regions = self.node.try_get_context("regions") or ""
+        # the account of the hub: with it, the large Metadata of the values is offloaded to the
+        # state bucket, which the hub is allowed to read, and the events only carry a reference
+        hub_account = self.node.try_get_context("hub_account")
 
         if metrics is not None and environment is not None and project_name is not None:
 
             metrics_parsed = metrics.split(",")
             logger.info(f"Will deploy with the following metrics: {metrics_parsed}")
 
-            iam_list = []
-            for m in metrics_parsed:
-                class_m = eval(m)
-
-                # create a dummy instance, to retrieve its IAM permissions
-                instance_m = class_m("", "", "", "")
-                iam_m = instance_m.get_iam_permissions(Aws.REGION, Aws.ACCOUNT_ID)
-                iam_list = iam_list + iam_m
+            metric_registry.METRIC_MODULES = metric_modules.split(",")
 
-            policy_document = {"Version": "2012-10-17", "Statement": iam_list}
+            # the permissions are read from the classes, and merged into as few statements
+            # as possible. fails here, rather than at deploy time, if they are too large
+            metric_regions = [Aws.REGION] + [r for r in regions.split(",") if r]
+            policy_document = build_policy_document(
+                [metric_registry.get_metric_class(m) for m in metrics_parsed],
+                Aws.REGION,
+                Aws.ACCOUNT_ID,
+                metric_regions=metric_regions if len(metric_regions) > 1 else (),
+            )
 
             logger.debug("Policy for lambda execution role")
             logger.debug(policy_document)
@@ -68,24 +97,62 @@ class SpokeStack(core.Stack):
             pol = aws_iam.Policy(self, "metric-lambda", document=doc)
 
             # define a lambda, trigger it from a rule
+            # the extraction lambda persists here its state between invocations
+            # (e.g. the index of the training jobs). Its name is known to the hub, which
+            # only reads the offloaded Metadata from the bucket of the account sending it
+            state_bucket = aws_s3.Bucket(
+                self,
+                "ds-dashboard-spoke-state",
+                bucket_name=f"ds-dashboard-spoke-state-{Aws.ACCOUNT_ID}-{Aws.REGION}",
+                block_public_access=aws_s3.BlockPublicAccess.BLOCK_ALL,
+                encryption=aws_s3.BucketEncryption.S3_MANAGED,
+                enforce_ssl=True,
+                removal_policy=core.RemovalPolicy.DESTROY,
+                auto_delete_objects=True,
+            )
+
+            # the offloaded Metadata is only read by the hub, once, soon after the event
+            state_bucket.add_lifecycle_rule(
+                prefix="payloads/", expiration=core.Duration.days(14)
+            )
+
             metric_lambda = aws_lambda.Function(
                 self,
                 "ds-dashboard-metric-extraction",
                 function_name="ds-dashboard-metric-extraction",
                 runtime=aws_lambda.Runtime.PYTHON_3_9,
-                code=aws_lambda.Code.asset("lambda_function_code"),
+                code=lambda_code("retrieve_values", *metric_modules.split(",")),
                 handler="retrieve_values.lambda_handler",
                 timeout=core.Duration.minutes(1),
                 memory_size=128,
                 environment={
                     "METRIC_NAMES": metrics,
+                    "METRIC_MODULES": metric_modules,
                     "PROJECT_NAME": str(project_name),
                     "ENVIRONMENT": str(environment),
+                    "STATE_STORE_URI": f"s3://{state_bucket.bucket_name}/state",
+                    "HEARTBEAT_SECONDS": str(heartbeat_seconds),
+                    "METRIC_REGIONS": ",".join(metric_regions)
+                    if len(metric_regions) > 1
+                    else "",
+                    "PAYLOAD_STORE_URI": f"s3://{state_bucket.bucket_name}/payloads"
+                    if hub_account
+                    else "",
                 },
             )
 
             metric_lambda.role.attach_inline_policy(pol)
+            state_bucket.grant_read_write(metric_lambda, "state/*")
+
+            if hub_account:
+                state_bucket.grant_write(metric_lambda, "payloads/*")
+                state_bucket.grant_read(aws_iam.AccountPrincipal(str(hub_account)), "payloads/*")
 
+            # requests listing Targets (a shard of the spokes), Projects, Environments or
+            # MetricNames are for the spokes they select only
+            fetch_pattern = spoke_pattern(
+                Aws.ACCOUNT_ID, str(project_name), str(environment), metrics_parsed
+            )
             fetch_rule = aws_events.Rule(
                 self,
                 id="fetch-request-from-hub",
@@ -93,7 +160,9 @@ class SpokeStack(core.Stack):
                 description="fetch-request-from-hub",
                 enabled=True,
                 event_pattern=aws_events.EventPattern(
-                    source=["metric_fetch"], detail_type=["metric_fetch"]
+                    source=fetch_pattern["source"],
+                    detail_type=fetch_pattern["detail-type"],
+                    detail=fetch_pattern["detail"],
                 ),
             )
 
@@ -112,7 +181,7 @@ class SpokeStack(core.Stack):
                 "ds-dashboard-connection",
                 function_name="ds-dashboard-connection",
                 runtime=aws_lambda.Runtime.PYTHON_3_9,
-                code=aws_lambda.Code.asset("lambda_function_code"),
+                code=lambda_code("dashboard_connection"),
                 handler="dashboard_connection.lambda_handler",
                 timeout=core.Duration.minutes(1),
                 memory_size=128,
@@ -123,6 +192,12 @@ class SpokeStack(core.Stack):
                     "events:PutRule",
                     "events:PutTargets",
                     "events:PutPermission",
+                    "events:ListRules",
+                    "events:ListTargetsByRule",
+                    "events:DescribeEventBus",
+                    "events:RemovePermission",
+                    "events:RemoveTargets",
+                    "events:DeleteRule",
                     "ssm:GetParametersByPath",
                 ],
                 resources=["*"],
@@ -0,0 +1,212 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import json
+import threading
+import contextlib
+import logging
+from rate_limits import check_deadline
+
+logging.basicConfig()
+
+logger = logging.getLogger("lambda:api_cache")
+logger.setLevel(os.getenv("LOGLEVEL", "INFO"))
+
+# only the results of these (read only) operations are memoized
+CACHED_PREFIXES = ("list_", "get_", "describe_")
+NOT_CACHED = ("get_paginator", "get_waiter", "can_paginate")
+
+
+class RequestCache:
+    """Memoizes API results for the duration of a request. Concurrent callers asking for the
+    same key wait for a single call instead of issuing their own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._key_locks = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns the cached value for key, or None. A value found counts as a hit"""
+
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self.hits += 1
+            return value
+
+    def get_or_call(self, key, fn):
+        """Returns the cached value for key, calling fn to compute it on a miss
+
+        Args:
+            key (tuple): the key of the entry
+            fn (callable): computes the value
+
+        Returns:
+            the value. It is shared between callers and must not be modified
+        """
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                if key in self._entries:
+                    self.hits += 1
+                    return self._entries[key]
+
+            value = fn()
+
+            with self._lock:
+                self._entries[key] = value
+                self.misses += 1
+
+            return value
+
+
+# the cache of the calling thread, see cache_scope
+_thread = threading.local()
+
+
+def current_cache():
+    """Returns the RequestCache set by cache_scope for the calling thread, None outside
+    of a request scope"""
+
+    return getattr(_thread, "cache", None)
+
+
+@contextlib.contextmanager
+def cache_scope(cache):
+    """Within it, the CachedClients used by the calling thread memoize their results in cache.
+    The workers of a request enter it with the cache of the request (see request_scope)"""
+
+    previous = current_cache()
+    _thread.cache = cache
+    try:
+        yield cache
+    finally:
+        _thread.cache = previous
+
+
+@contextlib.contextmanager
+def request_scope():
+    """Opens a new request scope: API calls issued through a CachedClient within it, by the
+    calling thread, share one RequestCache, which is discarded when the scope ends. Threads
+    working on the request share it by entering cache_scope(current_cache()).
+    """
+
+    with cache_scope(RequestCache()) as cache:
+        try:
+            yield cache
+        finally:
+            logger.info(f"API cache: {cache.hits} hits, {cache.misses} calls")
+
+
+def _params_key(params):
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+def _split_window(params):
+    """Separates the time window filters (e.g. LastModifiedTimeAfter) from the other parameters"""
+
+    window = {}
+    rest = {}
+    for k, v in params.items():
+        if k.endswith("After") or k.endswith("Before"):
+            window[k] = v
+        else:
+            rest[k] = v
+
+    return window, rest
+
+
+def _in_window(item, window):
+    for k, v in window.items():
+        if k.endswith("After"):
+            field = k[: -len("After")]
+            if item.get(field) is None or not item[field] > v:
+                return False
+        else:
+            field = k[: -len("Before")]
+            if item.get(field) is None or not item[field] < v:
+                return False
+
+    return True
+
+
+class CachedClient:
+    """Wraps a boto3 client. Within a request scope, the results of read operations are memoized,
+    keyed by service, region, operation and parameters. Outside a request scope, calls go
+    straight to the client.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    @property
+    def _service(self):
+        # read when needed, so that wrapping a LazyClient does not create it, and the region
+        # is the one the LazyClient resolves to for the calling thread
+        meta = self._client.meta
+        return f"{meta.service_model.service_name}@{meta.region_name}"
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+
+        if not name.startswith(CACHED_PREFIXES) or name in NOT_CACHED:
+            return attr
+
+        def call(**kwargs):
+            # also when the result is cached: an abandoned metric stops here
+            check_deadline()
+            cache = current_cache()
+            if cache is None:
+                return attr(**kwargs)
+            return cache.get_or_call(
+                (self._service, name, _params_key(kwargs)), lambda: attr(**kwargs)
+            )
+
+        return call
+
+    def list_all(self, operation, **params):
+        """Returns the full, paginated listing of a list operation, as one result dict.
+        A listing restricted by a time window (e.g. LastModifiedTimeAfter) is served, filtering
+        client-side, from the listing with the same other parameters and no window, which is
+        fetched first: all the windows share it, whatever the order they are requested in.
+
+        Args:
+            operation (str): the name of the operation, e.g. list_training_jobs
+            params: the parameters of the operation
+
+        Returns:
+            [dict]: the full result, e.g. {"TrainingJobSummaries": [...]}
+        """
+
+        check_deadline()
+        cache = current_cache()
+        paginator = self._client.get_paginator(operation)
+
+        def full_listing(p):
+            return paginator.paginate(**p).build_full_result()
+
+        if cache is None:
+            return full_listing(params)
+
+        window, rest = _split_window(params)
+
+        broader = cache.get_or_call(
+            (self._service, f"{operation}:all", _params_key(rest)),
+            lambda: full_listing(rest),
+        )
+
+        if not window:
+            return broader
+
+        return {
+            k: [i for i in v if _in_window(i, window)] if isinstance(v, list) else v
+            for k, v in broader.items()
+        }
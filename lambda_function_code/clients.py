@@ -0,0 +1,80 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import threading
+import contextlib
+from instrumentation import instrument_client
+from rate_limits import limit_client
+
+# clients by (service, region), reused across the invocations of a warm container
+_clients = {}
+_lock = threading.Lock()
+
+# the region the calling thread works on, see region_scope
+_thread = threading.local()
+
+
+def current_region():
+    """Returns the region set by region_scope for the calling thread, None for the region of
+    the lambda"""
+
+    return getattr(_thread, "region_name", None)
+
+
+@contextlib.contextmanager
+def region_scope(region_name):
+    """Within it, the LazyClients used by the calling thread are the ones of region_name.
+    None stands for the region of the lambda"""
+
+    previous = current_region()
+    _thread.region_name = region_name
+    try:
+        yield
+    finally:
+        _thread.region_name = previous
+
+
+def get_client(service_name, region_name=None):
+    """Returns the boto3 client of a service in a region, created on first use and shared
+    afterwards. boto3 itself is only imported when the first client is created.
+    The calls of the client are rate limited and retried by rate_limits.limit_client,
+    instead of botocore.
+
+    Args:
+        service_name (str): the name of the service, e.g. sagemaker
+        region_name (str): the region, None for the region of the lambda
+
+    Returns:
+        the client
+    """
+
+    key = (service_name, region_name)
+
+    with _lock:
+        if key not in _clients:
+            import boto3
+            from botocore.config import Config
+
+            kwargs = {"region_name": region_name} if region_name else {}
+            client = boto3.client(
+                service_name,
+                config=Config(retries={"mode": "standard", "total_max_attempts": 1}),
+                **kwargs,
+            )
+            _clients[key] = limit_client(instrument_client(client))
+
+        return _clients[key]
+
+
+class LazyClient:
+    """Stands for the boto3 client of a service, which is only created when one of its
+    methods is first used. Module-level clients can then be declared for every service a
+    module may need, and only the ones actually used cost import and creation time.
+    Calls go to the region of the calling thread (see region_scope).
+    """
+
+    def __init__(self, service_name):
+        self.service_name = service_name
+
+    def __getattr__(self, name):
+        return getattr(get_client(self.service_name, current_region()), name)
@@ -4,16 +4,98 @@
 import boto3
 import json
 import os
+import re
+import time
+import random
 import logging
+from concurrent import futures
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from instrumentation import instrumented, instrument_client, log_payload, count
 
 logging.basicConfig()
 
 logger = logging.getLogger("lambda:dashboard_connection")
 logger.setLevel(os.getenv("LOGLEVEL", "INFO"))
 
+# number of EventBridge writes issued in parallel
+CONNECTION_WORKERS = int(os.getenv("CONNECTION_WORKERS", "8"))
+CONNECTION_MAX_ATTEMPTS = int(os.getenv("CONNECTION_MAX_ATTEMPTS", "8"))
+CONNECTION_BASE_BACKOFF_SECONDS = float(
+    os.getenv("CONNECTION_BASE_BACKOFF_SECONDS", "0.2")
+)
+
+# errors worth retrying: throttling, and concurrent changes to the bus policy
+RETRYABLE_ERRORS = [
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ConcurrentModificationException",
+    "InternalException",
+]
+
+# actions of the payload: the bus policy, the forwarding rules, or both
+ACTIONS = ["EBPut", "EBRule", "Reconcile"]
+
+# prefix of the rules created by this function
+RULE_PREFIX = "forwardTo"
+# forwarding rules are packed: each holds up to this many targets (the EventBridge limit)
+MAX_TARGETS_PER_RULE = 5
+# rules holding a pack of targets, e.g. forwardToFetchData-000
+PACKED_RULE = re.compile(rf"^{RULE_PREFIX}(?P<tag>[A-Za-z]+)-(?P<index>\d+)$")
+# rules created by previous versions of this function, one per account, e.g. forwardTo123456789012FetchData
+LEGACY_RULE = re.compile(rf"^{RULE_PREFIX}(?P<account>\d{{12}})(?P<tag>[A-Za-z]+)$")
+
+ssm_client = instrument_client(boto3.client("ssm"))
+# adaptive mode rate-limits the client itself when EventBridge throttles
+event_client = instrument_client(
+    boto3.client(
+        "events", config=Config(retries={"mode": "adaptive", "max_attempts": 10})
+    )
+)
+
 
-ssm_client = boto3.client("ssm")
-event_client = boto3.client("events")
+def call_with_retries(fn, **kwargs):
+    """Calls fn, retrying throttling and concurrent modification errors with
+    exponential backoff and jitter
+
+    Args:
+        fn (callable): the client method
+        kwargs: its arguments
+
+    Returns:
+        the response of fn
+    """
+
+    for attempt in range(CONNECTION_MAX_ATTEMPTS):
+        try:
+            return fn(**kwargs)
+        except ClientError as e:
+            if (
+                e.response["Error"]["Code"] not in RETRYABLE_ERRORS
+                or attempt == CONNECTION_MAX_ATTEMPTS - 1
+            ):
+                raise
+            backoff = CONNECTION_BASE_BACKOFF_SECONDS * (2**attempt)
+            count("Retries")
+            time.sleep(random.uniform(0, backoff))
+
+
+def get_parameters(path):
+    """Returns all the parameters under a path of the SSM parameter store, following the pagination
+
+    Args:
+        path (str): the path, e.g. /monitors/
+
+    Returns:
+        [list]: the parameters
+    """
+
+    parameters = []
+    paginator = ssm_client.get_paginator("get_parameters_by_path")
+    for page in paginator.paginate(Path=path, Recursive=True):
+        parameters.extend(page["Parameters"])
+
+    return parameters
 
 
 def flatten_parameters(parameters):
@@ -39,6 +121,10 @@ def flatten_parameters(parameters):
     return accounts
 
 
+def bus_arn(account_id):
+    return f'arn:aws:events:{os.getenv("AWS_REGION", "eu-west-1")}:{account_id}:event-bus/default'
+
+
 def allow_event_puts(account_id):
     """allows event puts from the account_id
 
@@ -46,7 +132,8 @@ def allow_event_puts(account_id):
         account_id (str): the AWS account id
     """
 
-    return event_client.put_permission(
+    return call_with_retries(
+        event_client.put_permission,
         EventBusName="default",
         Action="events:PutEvents",
         Principal=account_id,
@@ -54,47 +141,345 @@ def allow_event_puts(account_id):
     )
 
 
-def forward_events(account_id, pattern, name_tag):
-    """This creates an EventBridge rule to forward events to the target account id
+def revoke_event_puts(account_id):
+    """revokes the permission to put events granted to account_id by allow_event_puts
 
     Args:
-        account_id (str): The target AWS account id
+        account_id (str): the AWS account id
     """
 
-    put_rule_response = event_client.put_rule(
-        Name=f"forwardTo{account_id}{name_tag}",
-        EventPattern=json.dumps(pattern),
-        State="ENABLED",
-        Description=f"forwardTo{account_id}{name_tag}",
+    return call_with_retries(
+        event_client.remove_permission,
+        EventBusName="default",
+        StatementId=account_id,
+        RemoveAllPermissions=False,
     )
 
-    if put_rule_response["ResponseMetadata"]["HTTPStatusCode"] not in [200, 204]:
-        return put_rule_response
 
-    logger.debug("Response from PutRule:")
-    logger.debug(put_rule_response)
+def packed_rule_name(name_tag, index):
+    """Returns the name of the index-th rule forwarding name_tag events"""
 
-    bus_arn = f'arn:aws:events:{os.getenv("AWS_REGION", "eu-west-1")}:{account_id}:event-bus/default'
+    return f"{RULE_PREFIX}{name_tag}-{index:03d}"
 
-    target = {"Arn": bus_arn, "Id": f"{account_id}-bus"}
 
-    put_target_response = event_client.put_targets(
-        Rule=f"forwardTo{account_id}{name_tag}", Targets=[target]
-    )
+def update_forward_rule(rule_name, pattern, targets, removed_target_ids):
+    """Creates or updates an EventBridge rule forwarding events to other accounts' buses
+
+    Args:
+        rule_name (str): the name of the rule
+        pattern (dict): the event pattern. None leaves the pattern of an existing rule as it is
+        targets (list): the targets to add or update
+        removed_target_ids (list): the ids of the targets to remove. They are removed first,
+        so that their slots can be reused by targets
+    """
+
+    if removed_target_ids:
+        call_with_retries(
+            event_client.remove_targets, Rule=rule_name, Ids=removed_target_ids
+        )
+
+    if pattern is not None:
+        put_rule_response = call_with_retries(
+            event_client.put_rule,
+            Name=rule_name,
+            EventPattern=json.dumps(pattern),
+            State="ENABLED",
+            Description=rule_name,
+        )
+
+        logger.debug("Response from PutRule:")
+        logger.debug(put_rule_response)
+
+    if targets:
+        put_target_response = call_with_retries(
+            event_client.put_targets, Rule=rule_name, Targets=targets
+        )
+
+        logger.debug("Response from PutTargets:")
+        logger.debug(put_target_response)
+
+        if put_target_response.get("FailedEntryCount"):
+            raise RuntimeError(
+                f"PutTargets failed on {rule_name}: {put_target_response['FailedEntries']}"
+            )
+
+
+def delete_rule(rule_name, target_ids):
+    """Removes the targets of a rule, then the rule itself"""
+
+    if target_ids:
+        call_with_retries(event_client.remove_targets, Rule=rule_name, Ids=target_ids)
+
+    return call_with_retries(event_client.delete_rule, Name=rule_name)
+
+
+def existing_permissions():
+    """Returns the ids of the statements in the resource policy of the default bus
+    that were created by allow_event_puts (their id is an account id)"""
+
+    policy = event_client.describe_event_bus(Name="default").get("Policy")
+    if not policy:
+        return set()
+
+    return {
+        s["Sid"]
+        for s in json.loads(policy).get("Statement", [])
+        if re.fullmatch(r"\d{12}", s.get("Sid", ""))
+    }
+
+
+def existing_rules():
+    """Returns the forwarding rules created by this function, with their pattern and targets
+
+    Returns:
+        [dict]: {rule name: {"pattern": dict, "targets": {target id: target arn}}}
+    """
+
+    rules = {}
+    paginator = event_client.get_paginator("list_rules")
+    for page in paginator.paginate(NamePrefix=RULE_PREFIX, EventBusName="default"):
+        for r in page["Rules"]:
+            rules[r["Name"]] = {
+                "pattern": json.loads(r.get("EventPattern") or "{}"),
+                "targets": {},
+            }
 
-    logger.debug("Response from PutTargets:")
-    logger.debug(put_target_response)
+    def list_targets(name):
+        paginator = event_client.get_paginator("list_targets_by_rule")
+        targets = {}
+        for page in paginator.paginate(Rule=name, EventBusName="default"):
+            for t in page["Targets"]:
+                targets[t["Id"]] = t["Arn"]
+        return name, targets
 
-    return put_target_response
+    with futures.ThreadPoolExecutor(max_workers=CONNECTION_WORKERS) as executor:
+        for name, targets in executor.map(list_targets, list(rules)):
+            rules[name]["targets"] = targets
 
+    return rules
 
+
+def apply_concurrently(changes):
+    """Applies a list of changes, each a (description, callable, kwargs) tuple, in parallel.
+    Failures are logged and do not stop the other changes
+
+    Returns:
+        [dict]: the number of changes applied and the descriptions of the failed ones
+    """
+
+    failed = []
+
+    with futures.ThreadPoolExecutor(max_workers=CONNECTION_WORKERS) as executor:
+        submitted = {
+            executor.submit(fn, **kwargs): description
+            for description, fn, kwargs in changes
+        }
+        for f in futures.as_completed(submitted):
+            try:
+                f.result()
+                logger.info(f"Applied: {submitted[f]}")
+            except Exception:
+                logger.exception(f"Failed: {submitted[f]}")
+                failed.append(submitted[f])
+
+    return {"applied": len(changes) - len(failed), "failed": failed}
+
+
+def plan_permissions(accounts, prune):
+    """Computes the changes to the bus policy needed to allow event puts from accounts
+
+    Args:
+        accounts (set): the accounts that must be allowed
+        prune (bool): if True, also revoke accounts not in accounts
+
+    Returns:
+        [tuple]: the additions and the removals, see apply_concurrently
+    """
+
+    existing = existing_permissions()
+
+    additions = [
+        (f"allow event puts from {a}", allow_event_puts, {"account_id": a})
+        for a in sorted(accounts - existing)
+    ]
+
+    removals = []
+    if prune:
+        removals = [
+            (f"revoke event puts from {a}", revoke_event_puts, {"account_id": a})
+            for a in sorted(existing - accounts)
+        ]
+
+    return additions, removals
+
+
+def pack_accounts(current, accounts):
+    """Assigns accounts to packed rules. Accounts stay in the rule they are in, departed accounts
+    leave a free slot, and new accounts fill the free slots of the existing rules before new
+    rules are created: a change in the accounts touches as few rules as possible.
+
+    Args:
+        current (dict): {rule index: set of accounts} as currently configured
+        accounts (set): the accounts that must be targeted
+
+    Returns:
+        [dict]: {rule index: set of accounts}. Rules left without accounts map to an empty set
+    """
+
+    assignment = {}
+    placed = set()
+
+    for index in sorted(current):
+        keep = {a for a in current[index] if a in accounts and a not in placed}
+        keep = set(sorted(keep)[:MAX_TARGETS_PER_RULE])
+        assignment[index] = keep
+        placed |= keep
+
+    unplaced = sorted(accounts - placed)
+
+    for index in sorted(assignment):
+        free = MAX_TARGETS_PER_RULE - len(assignment[index])
+        assignment[index] |= set(unplaced[:free])
+        unplaced = unplaced[free:]
+
+    index = 0
+    while unplaced:
+        if index not in assignment:
+            assignment[index] = set(unplaced[:MAX_TARGETS_PER_RULE])
+            unplaced = unplaced[MAX_TARGETS_PER_RULE:]
+        index += 1
+
+    return assignment
+
+
+def plan_rules(desired, prune):
+    """Computes the changes to the forwarding rules. The targets forwarding the same events
+    are packed in as few rules as possible (see pack_accounts), and the per-account rules
+    created by previous versions of this function are replaced
+
+    Args:
+        desired (dict): {name tag: (pattern, set of accounts)} for each kind of events to forward.
+        The pattern can also be a function of the accounts of a rule, returning its pattern
+        prune (bool): if True, also delete the forwarding rules unrelated to desired
+
+    Returns:
+        [tuple]: the additions and the removals, see apply_concurrently
+    """
+
+    existing = existing_rules()
+    additions = []
+    removals = []
+    handled = set()
+
+    for name_tag, (pattern, accounts) in sorted(desired.items()):
+
+        current = {}
+        for name, rule in existing.items():
+            match = PACKED_RULE.match(name)
+            if match and match["tag"] == name_tag:
+                current[int(match["index"])] = {
+                    t[: -len("-bus")] for t in rule["targets"] if t.endswith("-bus")
+                }
+                handled.add(name)
+
+        for index, members in sorted(pack_accounts(current, accounts).items()):
+            name = packed_rule_name(name_tag, index)
+            rule = existing.get(name)
+            current_targets = rule["targets"] if rule else {}
+
+            if not members:
+                removals.append(
+                    (
+                        f"delete empty rule {name}",
+                        delete_rule,
+                        {"rule_name": name, "target_ids": list(current_targets)},
+                    )
+                )
+                continue
+
+            wanted = {f"{a}-bus": bus_arn(a) for a in members}
+            targets = [
+                {"Id": i, "Arn": arn}
+                for i, arn in sorted(wanted.items())
+                if current_targets.get(i) != arn
+            ]
+            rule_pattern = pattern(members) if callable(pattern) else pattern
+            new_pattern = (
+                rule_pattern if rule is None or rule["pattern"] != rule_pattern else None
+            )
+
+            departed = sorted(set(current_targets) - set(wanted))
+
+            if targets or departed or new_pattern is not None:
+                additions.append(
+                    (
+                        f"forward {name_tag} events to {sorted(members)} with {name}",
+                        update_forward_rule,
+                        {
+                            "rule_name": name,
+                            "pattern": new_pattern,
+                            "targets": targets,
+                            "removed_target_ids": departed,
+                        },
+                    )
+                )
+
+        # per-account rules are superseded by the packed ones
+        for name, rule in existing.items():
+            match = LEGACY_RULE.match(name)
+            if match and match["tag"] == name_tag and match["account"] in accounts:
+                removals.append(
+                    (
+                        f"delete per-account rule {name}",
+                        delete_rule,
+                        {"rule_name": name, "target_ids": list(rule["targets"])},
+                    )
+                )
+                handled.add(name)
+
+    if prune:
+        removals += [
+            (
+                f"delete rule {name}",
+                delete_rule,
+                {"rule_name": name, "target_ids": list(rule["targets"])},
+            )
+            for name, rule in sorted(existing.items())
+            if name not in handled
+        ]
+
+    return additions, removals
+
+
+def fetch_pattern(accounts):
+    """Returns the pattern of a rule forwarding fetch requests to some accounts: requests
+    without Targets go to all the spokes, the others to the rules listing one of their
+    accounts (see fetch_metric_values). A rule has up to MAX_TARGETS_PER_RULE targets, and
+    forwards a request to all of them: the fetch rule of each spoke (see
+    fetch_selector.spoke_pattern) then discards the requests not listing its account"""
+
+    return {
+        "source": ["metric_fetch"],
+        "detail-type": ["metric_fetch"],
+        "detail": {
+            "$or": [{"Targets": [{"exists": False}]}, {"Targets": sorted(accounts)}]
+        },
+    }
+
+
+@instrumented("dashboard_connection")
 def lambda_handler(event, context):
     """This is the main handler. It will be called with a payload
-    specifying if it needs to configure the eventbus resource policy
-    or if it has to create rolues to forward events
+    specifying if it needs to configure the eventbus resource policy (EBPut),
+    the rules to forward events (EBRule), or both (Reconcile)
 
     Its task is to properly configure the source/destination of metrics-related
-    events, using info in the parameter store.
+    events, using info in the parameter store. It reads the current configuration
+    of the event bus first, and only applies the changes needed, in parallel: a run
+    with nothing to change issues no writes. With "prune": true in the payload,
+    permissions and forwarding rules of accounts no longer in the parameter store
+    are removed as well. Any other action raises a ValueError rather than silently
+    changing nothing.
 
     Example structure of the parameter store
 
@@ -108,53 +493,51 @@ def lambda_handler(event, context):
         context: the execution context
     """
 
-    logger.info("Starting invocation with payload:")
-    logger.info(json.dumps(event))
-
-    eb_put = event["action"] == "EBPut"
+    log_payload(logger, event)
 
-    monitors = ssm_client.get_parameters_by_path(Path="/monitors/", Recursive=True)[
-        "Parameters"
-    ]
-    monitored_projects = ssm_client.get_parameters_by_path(
-        Path="/monitored_projects/", Recursive=True
-    )["Parameters"]
-
-    monitors = flatten_parameters(monitors)
-    monitored_projects = flatten_parameters(monitored_projects)
+    action = event["action"]
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown action {action!r}, expected one of {ACTIONS}")
+    prune = bool(event.get("prune", False))
 
-    # this means we are serving as monitored_project
-    for account_id, project_name in monitors.items():
+    monitors = flatten_parameters(get_parameters("/monitors/"))
+    monitored_projects = flatten_parameters(get_parameters("/monitored_projects/"))
 
-        logger.info(f"Connecting to monitor {project_name} in account {account_id}")
+    logger.info(
+        f"Found {len(monitors)} monitors and {len(monitored_projects)} monitored projects"
+    )
 
-        event_pattern = {
-            "source": ["metric_extractor"],
-            "detail-type": ["metric_extractor"],
+    additions = []
+    removals = []
+
+    if action in ["EBPut", "Reconcile"]:
+        # allow monitors and monitored_projects to send us events
+        a, r = plan_permissions(set(monitors) | set(monitored_projects), prune)
+        additions += a
+        removals += r
+
+    if action in ["EBRule", "Reconcile"]:
+        desired = {
+            # this means we are serving as monitored_project: forward our metrics to monitors
+            "MetricValues": (
+                {"source": ["metric_extractor"], "detail-type": ["metric_extractor"]},
+                set(monitors),
+            ),
+            # this means we are serving as monitor: send requests to fetch new data to monitored_projects
+            "FetchData": (fetch_pattern, set(monitored_projects)),
         }
 
-        if eb_put:
-            # allow monitor to send us events
-            allow_event_puts(account_id)
-        else:
-            # forward our metrics to monitor
-            forward_events(account_id, event_pattern, "MetricValues")
+        a, r = plan_rules(desired, prune)
+        additions += a
+        removals += r
 
-    # this means we are serving as monitor
-    for account_id, project_name in monitored_projects.items():
+    logger.info(f"{len(additions)} additions and {len(removals)} removals to apply")
 
-        logger.info(
-            f"Connecting to monitored project {project_name} in account {account_id}"
-        )
-
-        event_pattern = {
-            "source": ["metric_fetch"],
-            "detail-type": ["metric_fetch"],
-        }
+    # new targets are in place before the old ones are removed
+    result = apply_concurrently(additions)
+    removed = apply_concurrently(removals)
 
-        if eb_put:
-            # allow monitored_project to send us events
-            allow_event_puts(account_id)
-        else:
-            # send requests to fetch new data to monitored_projects
-            forward_events(account_id, event_pattern, "FetchData")
+    return {
+        "applied": result["applied"] + removed["applied"],
+        "failed": result["failed"] + removed["failed"],
+    }
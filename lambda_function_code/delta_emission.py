@@ -0,0 +1,138 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import json
+import time
+import hashlib
+import threading
+import logging
+from object_store import get_state_store, load_json, save_json
+
+logging.basicConfig()
+
+logger = logging.getLogger("lambda:delta_emission")
+logger.setLevel(os.getenv("LOGLEVEL", "INFO"))
+
+# a metric whose value did not change is emitted again after this many seconds.
+# 0 disables change-only emission: every value is emitted at every fetch
+HEARTBEAT_SECONDS = float(os.getenv("HEARTBEAT_SECONDS", "0"))
+
+STATE_KEY = "last_emitted.json"
+
+# the fields that make a value different from the previous one
+COMPARED_FIELDS = ("MetricValue", "Metadata")
+
+
+def state_key(payload):
+    return "#".join(
+        str(payload.get(f))
+        for f in ("ProjectName", "Environment", "MetricName", "Region")
+        if payload.get(f) is not None
+    )
+
+
+def fingerprint(payload):
+    """Returns a short digest of the fields of a payload compared between emissions"""
+
+    body = json.dumps(
+        {f: payload.get(f) for f in COMPARED_FIELDS}, sort_keys=True, default=str
+    )
+
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()[:16]
+
+
+class EmissionState:
+    """The fingerprint and time of the last value emitted for each metric"""
+
+    def __init__(self, entries=None):
+        # state_key -> [fingerprint, emitted_at (epoch seconds)]
+        self.entries = entries or {}
+
+    def is_due(self, payload, now, heartbeat_seconds):
+        """A value is due if it changed, or if the last one was emitted a heartbeat ago"""
+
+        entry = self.entries.get(state_key(payload))
+        if entry is None:
+            return True
+
+        last_fingerprint, emitted_at = entry
+
+        return (
+            last_fingerprint != fingerprint(payload)
+            or now - emitted_at >= heartbeat_seconds
+        )
+
+    def record(self, payload, now):
+        self.entries[state_key(payload)] = [fingerprint(payload), now]
+
+
+_state = None
+_state_lock = threading.Lock()
+
+
+def get_emission_state():
+    """Returns the emission state, loaded from the state store when the container is cold"""
+
+    global _state
+
+    with _state_lock:
+        if _state is None:
+            stored = load_json(get_state_store(), STATE_KEY)
+            _state = EmissionState(stored)
+
+        return _state
+
+
+def select_due(payloads, heartbeat_seconds=None, now=None):
+    """Splits the payloads extracted into the ones to emit and the ones left out because their
+    value did not change since the last emission. The payloads to emit carry HeartbeatSeconds
+    and EmittedTimestamp, so that the hub can tell a value that did not change (it was emitted
+    less than a heartbeat ago) from a missing one. A value reused from the value cache keeps
+    its ExtractionTimestamp, its EmittedTimestamp is the current time.
+
+    Args:
+        payloads (list): the payloads extracted
+        heartbeat_seconds (float): defaults to HEARTBEAT_SECONDS. With 0, all are due
+        now (float): the current epoch time, in seconds
+
+    Returns:
+        [tuple]: the payloads to emit and the ones unchanged
+    """
+
+    heartbeat_seconds = HEARTBEAT_SECONDS if heartbeat_seconds is None else heartbeat_seconds
+    if heartbeat_seconds <= 0:
+        return payloads, []
+
+    now = time.time() if now is None else now
+    state = get_emission_state()
+
+    due = []
+    unchanged = []
+    for p in payloads:
+        if state.is_due(p, now, heartbeat_seconds):
+            due.append(
+                {**p, "HeartbeatSeconds": heartbeat_seconds, "EmittedTimestamp": int(now * 1e6)}
+            )
+        else:
+            unchanged.append(p)
+
+    return due, unchanged
+
+
+def record_emitted(payloads, now=None):
+    """Records the payloads successfully emitted in change-only mode (the ones carrying
+    HeartbeatSeconds), and persists the state if any"""
+
+    payloads = [p for p in payloads if "HeartbeatSeconds" in p]
+    if not payloads:
+        return
+
+    now = time.time() if now is None else now
+    state = get_emission_state()
+
+    with _state_lock:
+        for p in payloads:
+            state.record(p, now)
+
+        save_json(get_state_store(), STATE_KEY, state.entries)
@@ -4,14 +4,167 @@
 import os
 import boto3
 import json
+import time
+import random
 import logging
+from decimal import Decimal
+from table_schema import add_keys, expires_at, SERIES_KEY, TIMESTAMP, EXPIRES_AT
+from instrumentation import instrumented, instrument_client, log_payload, count
+from payload_codec import decode_payload, compact_item
 
 logging.basicConfig()
 
 logger = logging.getLogger("lambda:dynamo_write")
 logger.setLevel(os.getenv("LOGLEVEL", "INFO"))
 
+# BatchWriteItem accepts at most 25 items per request
+BATCH_WRITE_MAX_ITEMS = 25
+BATCH_WRITE_MAX_ATTEMPTS = int(os.getenv("BATCH_WRITE_MAX_ATTEMPTS", "5"))
+BATCH_WRITE_BASE_BACKOFF_SECONDS = float(
+    os.getenv("BATCH_WRITE_BASE_BACKOFF_SECONDS", "0.05")
+)
 
+# raw items expire after this many days. 0 keeps them forever
+RAW_RETENTION_DAYS = int(os.getenv("RAW_RETENTION_DAYS", "0"))
+
+# the attributes identifying an item in the table
+KEY_ATTRIBUTES = (SERIES_KEY, TIMESTAMP)
+
+# clients are reused across invocations of the same container
+dynamodb = boto3.resource("dynamodb")
+instrument_client(dynamodb.meta.client)
+ddb_table_name = os.getenv("DDB_TABLE_NAME")
+table = dynamodb.Table(ddb_table_name) if ddb_table_name else None
+
+
+def to_item(detail, account=None):
+    """Converts the detail of an event to a DynamoDB item, adding the key attributes
+    and the TTL. Numbers with decimals must be stored as Decimal. The detail is decoded
+    (see payload_codec), and a large Metadata is stored compressed
+
+    Args:
+        detail (dict): the detail of the event
+        account (str): the account of the event, the spoke whose bucket may hold the Metadata
+
+    Returns:
+        [dict]: the item
+    """
+
+    item = add_keys(decode_payload(detail, account))
+
+    ttl = expires_at(item[TIMESTAMP], RAW_RETENTION_DAYS)
+    if ttl is not None:
+        item[EXPIRES_AT] = ttl
+
+    return compact_item(json.loads(json.dumps(item), parse_float=Decimal))
+
+
+def batch_write(items):
+    """Writes items to the table with BatchWriteItem. Unprocessed items are retried with
+    exponential backoff and jitter, up to BATCH_WRITE_MAX_ATTEMPTS times.
+
+    Args:
+        items (list): pairs of (identifier, item). Items with the same key are written once,
+        the last one wins
+
+    Returns:
+        [set]: the identifiers of the items that could not be written
+    """
+
+    # BatchWriteItem rejects requests with two items with the same key
+    by_key = {}
+    ids_by_key = {}
+    for identifier, item in items:
+        key = tuple(str(item.get(k)) for k in KEY_ATTRIBUTES)
+        by_key[key] = item
+        ids_by_key.setdefault(key, []).append(identifier)
+
+    keys = list(by_key)
+    failed_keys = []
+
+    for start in range(0, len(keys), BATCH_WRITE_MAX_ITEMS):
+        pending = keys[start : start + BATCH_WRITE_MAX_ITEMS]
+
+        for attempt in range(BATCH_WRITE_MAX_ATTEMPTS):
+
+            if attempt > 0:
+                backoff = BATCH_WRITE_BASE_BACKOFF_SECONDS * (2 ** (attempt - 1))
+                count("Retries")
+                time.sleep(random.uniform(0, backoff))
+
+            request = [{"PutRequest": {"Item": by_key[k]}} for k in pending]
+
+            try:
+                response = dynamodb.batch_write_item(
+                    RequestItems={ddb_table_name: request}
+                )
+            except Exception as e:
+                logger.warning(f"BatchWriteItem failed, will retry: {e}")
+                continue
+
+            unprocessed = response.get("UnprocessedItems", {}).get(ddb_table_name, [])
+            pending = [
+                tuple(str(u["PutRequest"]["Item"].get(k)) for k in KEY_ATTRIBUTES)
+                for u in unprocessed
+            ]
+
+            if not pending:
+                break
+
+        failed_keys.extend(pending)
+
+    return {identifier for k in failed_keys for identifier in ids_by_key[k]}
+
+
+@instrumented("dynamo_write")
+def queue_handler(event, context):
+    """This is meant to be triggered by an SQS event source, on the queue buffering the events
+    arriving from the spokes. Each record carries one EventBridge event (see lambda_handler).
+    The whole batch is written with BatchWriteItem, and the records that could not be written
+    are reported as partial batch failures, so that only those are delivered again. Malformed
+    records would fail again at each delivery: they are logged and dropped instead.
+
+    Args:
+        event (dict): The batch of SQS records
+        context : the context
+
+    Returns:
+        [dict]: the partial batch failures
+    """
+
+    logger.info(f"Starting execution with {len(event['Records'])} records")
+
+    items = []
+    failed_ids = set()
+
+    for record in event["Records"]:
+        count("PayloadBytes", len(record["body"]))
+        try:
+            body = json.loads(record["body"])
+            item = to_item(body["detail"], body.get("account"))
+        except (ValueError, KeyError, TypeError):
+            logger.error(
+                f"Dropping malformed record {record['messageId']}: {record['body'][:200]}"
+            )
+            count("MalformedRecords")
+            continue
+        except Exception:
+            # e.g. the object holding its Metadata could not be read: it is delivered again
+            logger.exception(f"Could not decode record {record['messageId']}")
+            failed_ids.add(record["messageId"])
+            continue
+
+        items.append((record["messageId"], item))
+
+    failed_ids |= batch_write(items)
+
+    if failed_ids:
+        logger.error(f"{len(failed_ids)} records could not be written")
+
+    return {"batchItemFailures": [{"itemIdentifier": i} for i in failed_ids]}
+
+
+@instrumented("dynamo_write")
 def lambda_handler(event, context):
     """This is meant to be automatically triggered by an EventBridge Rule
     an example event will be:
@@ -31,6 +184,7 @@ def lambda_handler(event, context):
         "MetricName": metric_name,
         "MetricValue": metric_value,
         "ExtractionDate": extraction_date,
+        "ExtractionTimestamp": extraction_timestamp,
         "Metadata": metadata,
         "Environment": environment,
         "ProjectName": project_name
@@ -42,13 +196,7 @@ def lambda_handler(event, context):
         context : the context
     """
 
-    logger.info("Starting execution with payload:")
-    logger.info(json.dumps(event))
-
-    ddb_table_name = os.getenv("DDB_TABLE_NAME")
-
-    dynamodb = boto3.resource("dynamodb")
-
-    table = dynamodb.Table(ddb_table_name)
+    log_payload(logger, event)
+    count("PayloadBytes", len(json.dumps(event["detail"])))
 
-    return table.put_item(Item=event["detail"])
+    return table.put_item(Item=to_item(event["detail"], event.get("account")))
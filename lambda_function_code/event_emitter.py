@@ -0,0 +1,198 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import json
+import time
+import random
+import logging
+from clients import LazyClient
+from instrumentation import count
+
+logging.basicConfig()
+
+logger = logging.getLogger("lambda:event_emitter")
+logger.setLevel(os.getenv("LOGLEVEL", "INFO"))
+
+events_client = LazyClient("events")
+
+# PutEvents limits, see https://docs.aws.amazon.com/eventbridge/latest/userguide/eb-putevent-size.html
+MAX_ENTRIES_PER_REQUEST = 10
+MAX_REQUEST_BYTES = 256 * 1024
+
+PUT_EVENTS_MAX_ATTEMPTS = int(os.getenv("PUT_EVENTS_MAX_ATTEMPTS", "4"))
+PUT_EVENTS_BASE_BACKOFF_SECONDS = float(os.getenv("PUT_EVENTS_BASE_BACKOFF_SECONDS", "0.1"))
+
+
+def make_entry(payload, source="metric_extractor", detail_type="metric_extractor"):
+    """Builds a PutEvents entry for a given payload
+
+    Args:
+        payload (dict): the payload of the event
+        source (str): the source of the event
+        detail_type (str): the detail-type of the event
+
+    Returns:
+        [dict]: the entry
+    """
+
+    return {
+        "Source": source,
+        "Resources": [],
+        "DetailType": detail_type,
+        "Detail": json.dumps(payload),
+    }
+
+
+def entry_size(entry):
+    """Computes the size of an entry the way EventBridge does
+
+    Args:
+        entry (dict): a PutEvents entry
+
+    Returns:
+        [int]: the size in bytes
+    """
+
+    size = 14 if "Time" in entry else 0
+    for field in ["Source", "DetailType", "Detail"]:
+        size += len(entry.get(field, "").encode("utf-8"))
+    for resource in entry.get("Resources", []):
+        size += len(resource.encode("utf-8"))
+
+    return size
+
+
+def pack_entries(entries):
+    """Splits the entries in batches that respect the PutEvents limits on
+    number of entries and size of the request. The order of the entries is preserved.
+
+    Args:
+        entries (list): the entries to pack. each of them must fit in a request
+
+    Returns:
+        [list]: a list of batches, each a list of entries
+    """
+
+    batches = []
+    batch = []
+    batch_size = 0
+
+    for entry in entries:
+        size = entry_size(entry)
+        if batch and (
+            len(batch) == MAX_ENTRIES_PER_REQUEST
+            or batch_size + size > MAX_REQUEST_BYTES
+        ):
+            batches.append(batch)
+            batch = []
+            batch_size = 0
+
+        batch.append(entry)
+        batch_size += size
+
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+
+def put_entries(entries, client=None):
+    """Sends the entries with as few PutEvents calls as possible. Entries that fail are retried,
+    alone, with exponential backoff and jitter, up to PUT_EVENTS_MAX_ATTEMPTS times.
+
+    Args:
+        entries (list): the PutEvents entries
+        client: the EventBridge client to use, defaults to the one of this module
+
+    Returns:
+        [list]: the entries that could not be delivered, each as a dict with keys
+        Entry, ErrorCode and ErrorMessage
+    """
+
+    client = client or events_client
+    dropped = []
+    to_send = []
+
+    for entry in entries:
+        if entry_size(entry) > MAX_REQUEST_BYTES:
+            dropped.append(
+                {
+                    "Entry": entry,
+                    "ErrorCode": "EntryTooLarge",
+                    "ErrorMessage": f"entry is larger than {MAX_REQUEST_BYTES} bytes",
+                }
+            )
+        else:
+            to_send.append(entry)
+
+    last_errors = {}
+
+    for attempt in range(PUT_EVENTS_MAX_ATTEMPTS):
+
+        if not to_send:
+            break
+
+        if attempt > 0:
+            # full jitter
+            backoff = PUT_EVENTS_BASE_BACKOFF_SECONDS * (2 ** (attempt - 1))
+            count("Retries")
+            time.sleep(random.uniform(0, backoff))
+
+        failed = []
+
+        for batch in pack_entries(to_send):
+            try:
+                response = client.put_events(Entries=batch)
+            except Exception as e:
+                logger.warning(f"PutEvents call failed, will retry: {e}")
+                for entry in batch:
+                    last_errors[id(entry)] = ("RequestFailed", str(e))
+                failed.extend(batch)
+                continue
+
+            if response.get("FailedEntryCount", 0) == 0:
+                continue
+
+            # the response entries are in the same order as the request entries
+            for entry, result in zip(batch, response["Entries"]):
+                if "ErrorCode" in result:
+                    last_errors[id(entry)] = (
+                        result["ErrorCode"],
+                        result.get("ErrorMessage", ""),
+                    )
+                    failed.append(entry)
+
+        to_send = failed
+
+    for entry in to_send:
+        error_code, error_message = last_errors[id(entry)]
+        dropped.append(
+            {"Entry": entry, "ErrorCode": error_code, "ErrorMessage": error_message}
+        )
+
+    for d in dropped:
+        logger.error(
+            f"Dropped event {d['Entry']['Detail'][:200]}: {d['ErrorCode']} {d['ErrorMessage']}"
+        )
+
+    return dropped
+
+
+def emit_payloads(payloads, source="metric_extractor", detail_type="metric_extractor"):
+    """Emits one event per payload, batching the PutEvents calls
+
+    Args:
+        payloads (list): the payloads to emit
+        source (str): the source of the events
+        detail_type (str): the detail-type of the events
+
+    Returns:
+        [list]: the payloads that could not be delivered
+    """
+
+    entries = [make_entry(p, source, detail_type) for p in payloads]
+
+    dropped = put_entries(entries)
+
+    return [json.loads(d["Entry"]["Detail"]) for d in dropped]
@@ -0,0 +1,331 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import io
+import json
+import time
+import uuid
+import datetime
+import logging
+from decimal import Decimal
+from urllib.parse import quote
+import boto3
+from boto3.dynamodb.conditions import Key
+import pyarrow
+import pyarrow.parquet
+from object_store import get_object_store, load_json, save_json
+from table_schema import SERIES_KEY, TIMESTAMP, PROJECT_INDEX, HEARTBEAT
+from payload_codec import expand_item
+
+logging.basicConfig()
+
+logger = logging.getLogger("lambda:export_parquet")
+logger.setLevel(os.getenv("LOGLEVEL", "INFO"))
+
+# where the files are written, s3://bucket/prefix or file:///local/path
+EXPORT_URI = os.getenv("EXPORT_URI")
+# a partition buffer is written out as a file when it reaches this many rows
+EXPORT_ROWS_PER_FILE = int(os.getenv("EXPORT_ROWS_PER_FILE", "50000"))
+# items younger than this are left to the next run, so that late deliveries are not skipped.
+# The watermark follows ExtractionTimestamp: an item written more than this after its
+# extraction (e.g. redriven from the dead-letter queue) is never exported. The default covers
+# the redeliveries of the ingest queue (5 receives, 6 minutes apart) and the retries of
+# EventBridge in the first hour
+EXPORT_SETTLE_SECONDS = float(os.getenv("EXPORT_SETTLE_SECONDS", "3600"))
+# how often the list of projects is refreshed, with a Scan of the project index
+EXPORT_DISCOVERY_SECONDS = float(os.getenv("EXPORT_DISCOVERY_SECONDS", "86400"))
+# files smaller than this are compacted, once a partition holds COMPACT_MIN_FILES of them
+COMPACT_SMALL_FILE_BYTES = int(os.getenv("COMPACT_SMALL_FILE_BYTES", str(16 * 1024**2)))
+COMPACT_MIN_FILES = int(os.getenv("COMPACT_MIN_FILES", "8"))
+# upper bound of the size of the files read at once by a compaction
+COMPACT_TARGET_BYTES = int(os.getenv("COMPACT_TARGET_BYTES", str(128 * 1024**2)))
+# time kept aside at the end of the invocation to compact and save the watermark
+EXPORT_RESERVE_SECONDS = float(os.getenv("EXPORT_RESERVE_SECONDS", "60"))
+
+STATE_KEY = "_state/export_state.json"
+
+SCHEMA = pyarrow.schema(
+    [
+        (SERIES_KEY, pyarrow.string()),
+        ("ProjectName", pyarrow.string()),
+        ("Environment", pyarrow.string()),
+        ("MetricName", pyarrow.string()),
+        (TIMESTAMP, pyarrow.int64()),
+        ("ExtractionDate", pyarrow.string()),
+        # numeric values, and the text (json for sketches) of the other ones
+        ("MetricValue", pyarrow.float64()),
+        ("MetricValueText", pyarrow.string()),
+        ("Metadata", pyarrow.string()),
+        (HEARTBEAT, pyarrow.float64()),
+    ]
+)
+
+table = boto3.resource("dynamodb").Table(
+    os.getenv("DDB_TABLE_NAME", "ds-dashboard-hub-metrics")
+)
+latest_table = (
+    boto3.resource("dynamodb").Table(os.getenv("LATEST_TABLE_NAME"))
+    if os.getenv("LATEST_TABLE_NAME")
+    else None
+)
+
+
+def _json_default(value):
+    # DynamoDB returns numbers as Decimals
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return str(value)
+
+
+def to_row(item):
+    """Converts a hub item to a row of SCHEMA"""
+
+    item = expand_item(item)
+    value = item.get("MetricValue")
+    numeric = isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+    heartbeat = item.get(HEARTBEAT)
+
+    return {
+        SERIES_KEY: item.get(SERIES_KEY),
+        "ProjectName": item.get("ProjectName"),
+        "Environment": item.get("Environment"),
+        "MetricName": item.get("MetricName"),
+        TIMESTAMP: int(item[TIMESTAMP]),
+        "ExtractionDate": item.get("ExtractionDate"),
+        "MetricValue": float(value) if numeric else None,
+        "MetricValueText": None
+        if numeric or value is None
+        else value
+        if isinstance(value, str)
+        else json.dumps(value, default=_json_default, sort_keys=True),
+        "Metadata": json.dumps(
+            item.get("Metadata", {}), default=_json_default, sort_keys=True
+        ),
+        HEARTBEAT: float(heartbeat) if heartbeat is not None else None,
+    }
+
+
+def partition_prefix(project, timestamp):
+    """Returns the folder of the partition of a row: project=<name>/date=<YYYY-MM-DD>/"""
+
+    day = datetime.datetime.fromtimestamp(
+        int(timestamp) / 1e6, tz=datetime.timezone.utc
+    ).strftime("%Y-%m-%d")
+
+    return f"project={quote(str(project), safe='')}/date={day}/"
+
+
+def to_parquet(rows):
+    buffer = io.BytesIO()
+    pyarrow.parquet.write_table(
+        pyarrow.Table.from_pylist(rows, schema=SCHEMA), buffer, compression="snappy"
+    )
+
+    return buffer.getvalue()
+
+
+class PartitionWriter:
+    """Buffers rows by partition, and writes each buffer out as one Parquet file when it is
+    full or flushed. Memory is bounded by the rows of the partitions not flushed yet.
+    """
+
+    def __init__(self, store, run_id):
+        self.store = store
+        self.run_id = run_id
+        self.buffers = {}
+        self.files = 0
+        self.rows = 0
+        self.touched = set()
+
+    def add(self, item):
+        prefix = partition_prefix(item["ProjectName"], item[TIMESTAMP])
+        rows = self.buffers.setdefault(prefix, [])
+        rows.append(to_row(item))
+        if len(rows) >= EXPORT_ROWS_PER_FILE:
+            self.flush(prefix)
+
+    def flush(self, prefix=None):
+        """Writes out one buffer, or all of them"""
+
+        for p in [prefix] if prefix else list(self.buffers):
+            rows = self.buffers.pop(p, None)
+            if not rows:
+                continue
+            self.store.put(f"{p}part-{self.run_id}-{self.files:05d}.parquet", to_parquet(rows))
+            self.files += 1
+            self.rows += len(rows)
+            self.touched.add(p)
+
+
+def discover_projects(source_table, latest_table=None):
+    """Returns the names of all the projects in the table. It runs once every
+    EXPORT_DISCOVERY_SECONDS, the other runs only Query the project index.
+    With the latest-value table, which holds one item per series, it is a Scan of that table,
+    otherwise a Scan of the project index, which grows with the whole history"""
+
+    projects = set()
+    kwargs = {"ProjectionExpression": "ProjectName"}
+    if latest_table is None:
+        latest_table = source_table
+        kwargs["IndexName"] = PROJECT_INDEX
+    while True:
+        response = latest_table.scan(**kwargs)
+        projects.update(i["ProjectName"] for i in response["Items"])
+        if "LastEvaluatedKey" not in response:
+            return projects
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def new_items(source_table, project, after, until):
+    """Yields the items of a project with after < ExtractionTimestamp <= until, oldest
+    first, one page at a time"""
+
+    kwargs = {
+        "IndexName": PROJECT_INDEX,
+        "KeyConditionExpression": Key("ProjectName").eq(project)
+        & Key(TIMESTAMP).between(after + 1, until),
+    }
+    while True:
+        response = source_table.query(**kwargs)
+        yield from response["Items"]
+        if "LastEvaluatedKey" not in response:
+            return
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def compact_partition(store, prefix, run_id):
+    """Merges the small files of a partition into larger ones, reading at most
+    COMPACT_TARGET_BYTES at a time. The merged file is written before the small ones are
+    deleted, so an interrupted compaction can leave duplicates but never loses rows.
+
+    Returns:
+        [int]: the number of files removed
+    """
+
+    small = [
+        (k, size)
+        for k, size in store.list(prefix)
+        if k.endswith(".parquet") and size < COMPACT_SMALL_FILE_BYTES
+    ]
+    if len(small) < COMPACT_MIN_FILES:
+        return 0
+
+    groups = [[]]
+    group_bytes = 0
+    for key, size in small:
+        if groups[-1] and group_bytes + size > COMPACT_TARGET_BYTES:
+            groups.append([])
+            group_bytes = 0
+        groups[-1].append(key)
+        group_bytes += size
+
+    removed = 0
+    for i, keys in enumerate(groups):
+        if len(keys) < 2:
+            continue
+        merged = pyarrow.concat_tables(
+            [pyarrow.parquet.read_table(io.BytesIO(store.get(k))) for k in keys]
+        )
+        buffer = io.BytesIO()
+        pyarrow.parquet.write_table(merged, buffer, compression="snappy")
+        store.put(f"{prefix}compacted-{run_id}-{i:03d}.parquet", buffer.getvalue())
+        for k in keys:
+            store.delete(k)
+        removed += len(keys)
+
+    return removed
+
+
+def run_export(source_table, store, now=None, time_left=None, latest_table=None):
+    """Exports the items written since the last run, project by project. The watermark of each
+    project (its newest timestamp exported) is persisted in the store as soon as its files
+    are written, so an interrupted run never exports the same rows twice.
+
+    Args:
+        source_table: the hub table
+        store: the object store receiving the files
+        now (float): the current epoch time, in seconds
+        time_left (callable): returns the seconds left to run. When it falls under
+        EXPORT_RESERVE_SECONDS, the project being exported stops at its newest timestamp
+        written so far, and the others are left to the next run
+        latest_table: the latest-value table, to discover the projects, if there is one
+
+    Returns:
+        [dict]: counts of projects, rows, files and compacted files
+    """
+
+    now = time.time() if now is None else now
+    until = int((now - EXPORT_SETTLE_SECONDS) * 1e6)
+    run_id = uuid.uuid4().hex[:12]
+
+    state = load_json(store, STATE_KEY) or {}
+    watermarks = state.get("Watermarks", {})
+
+    if not watermarks or now - state.get("DiscoveredAt", 0) >= EXPORT_DISCOVERY_SECONDS:
+        for project in discover_projects(source_table, latest_table):
+            watermarks.setdefault(project, 0)
+        state["DiscoveredAt"] = now
+
+    state["Watermarks"] = watermarks
+    writer = PartitionWriter(store, run_id)
+    exported = 0
+
+    def out_of_time():
+        return time_left is not None and time_left() < EXPORT_RESERVE_SECONDS
+
+    for project, watermark in sorted(watermarks.items()):
+        if out_of_time():
+            logger.warning(f"Out of time, leaving {len(watermarks) - exported} projects")
+            break
+
+        newest = watermark
+        for item in new_items(source_table, project, watermark, until):
+            timestamp = int(item[TIMESTAMP])
+            # a large backlog is exported over several runs. The items are sorted by
+            # timestamp: stopping between two timestamps leaves none of them behind
+            if timestamp > newest > watermark and out_of_time():
+                logger.warning(f"Out of time, project {project} is exported up to {newest}")
+                break
+            writer.add(item)
+            newest = max(newest, timestamp)
+
+        # the files of the project are written before its watermark moves
+        writer.flush()
+        watermarks[project] = newest
+        save_json(store, STATE_KEY, state)
+        exported += 1
+
+    compacted = sum(compact_partition(store, p, run_id) for p in sorted(writer.touched))
+
+    save_json(store, STATE_KEY, state)
+
+    return {
+        "projects": exported,
+        "rows": writer.rows,
+        "files": writer.files,
+        "compacted": compacted,
+    }
+
+
+def lambda_handler(event, context):
+    """Exports the new items of the hub table to EXPORT_URI, as Parquet files partitioned by
+    project and date (project=<name>/date=<YYYY-MM-DD>/), for Athena or QuickSight
+
+    Args:
+        event (dict): the payload. not used
+        context: the execution context
+    """
+
+    result = run_export(
+        table,
+        get_object_store(EXPORT_URI),
+        time_left=(lambda: context.get_remaining_time_in_millis() / 1000.0)
+        if context
+        else None,
+        latest_table=latest_table,
+    )
+
+    logger.info(f"Export done: {result}")
+
+    return result
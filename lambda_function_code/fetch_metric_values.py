@@ -2,36 +2,332 @@
 # SPDX-License-Identifier: MIT-0
 
 import os
-import boto3
-import json
+import math
+import time
+import random
+import hashlib
+import datetime
 import logging
+from clients import LazyClient
+from event_emitter import emit_payloads
+from fetch_selector import parse_selector, matches, PROJECTS, ENVIRONMENTS
+from instrumentation import log_payload
 
 logging.basicConfig()
 
 logger = logging.getLogger("lambda:fetch_metric_values")
 logger.setLevel(os.getenv("LOGLEVEL", "INFO"))
 
-events_client = boto3.client("events")
+ssm_client = LazyClient("ssm")
+events_client = LazyClient("events")
+
+# maximum number of spokes a single fetch request is sent to
+FETCH_SHARD_SIZE = int(os.getenv("FETCH_SHARD_SIZE", "10"))
+# period of the schedule invoking this function. 0 means it is only invoked on demand
+FETCH_TICK_SECONDS = float(os.getenv("FETCH_TICK_SECONDS", "0"))
+# refresh interval of the spokes without their own /fetch_intervals/ProjectName parameter
+DEFAULT_FETCH_INTERVAL_SECONDS = float(os.getenv("DEFAULT_FETCH_INTERVAL_SECONDS", "3600"))
+# an on-demand fetch of all the spokes spreads its shards over this window, with jitter
+FETCH_WINDOW_SECONDS = float(os.getenv("FETCH_WINDOW_SECONDS", "0"))
+# the rules forwarding the fetch requests, each to a pack of spokes (see
+# dashboard_connection.packed_rule_name). Their targets are named <account>-bus
+FETCH_RULE_PREFIX = "forwardToFetchData-"
+# the packs are read again when they are older than this
+FETCH_PACKS_MAX_AGE_SECONDS = float(os.getenv("FETCH_PACKS_MAX_AGE_SECONDS", "300"))
+
+
+def get_parameters(path):
+    """Returns all the parameters under a path of the parameter store"""
+
+    parameters = []
+    paginator = ssm_client.get_paginator("get_parameters_by_path")
+    for page in paginator.paginate(Path=path, Recursive=True):
+        parameters.extend(page["Parameters"])
+
+    return parameters
+
+
+def get_monitored_projects():
+    """Returns the spokes registered as /monitored_projects/ProjectName/CustomTag, where
+    CustomTag is usually the environment of the account
+
+    Returns:
+        [list]: (project name, custom tag, account id) tuples
+    """
+
+    return [
+        (p["Name"].split("/")[2], "/".join(p["Name"].split("/")[3:]), p["Value"])
+        for p in get_parameters("/monitored_projects/")
+    ]
+
+
+def get_spokes(monitored_projects=None):
+    """Returns the spokes to fetch from, with their refresh interval
+
+    Args:
+        monitored_projects (list): the spokes, as returned by get_monitored_projects
+
+    Returns:
+        [dict]: {account id: interval in seconds}
+    """
+
+    if monitored_projects is None:
+        monitored_projects = get_monitored_projects()
+
+    intervals = {
+        p["Name"].split("/")[2]: parse_interval(p["Name"], p["Value"])
+        for p in get_parameters("/fetch_intervals/")
+    }
+
+    return {
+        account: intervals.get(project, DEFAULT_FETCH_INTERVAL_SECONDS)
+        for project, _, account in monitored_projects
+    }
+
+
+def parse_interval(name, value):
+    """Reads the value of a /fetch_intervals/ProjectName parameter. A value that is not a
+    positive number of seconds is logged, and replaced by DEFAULT_FETCH_INTERVAL_SECONDS, so
+    that it does not stop the fetches of the other spokes"""
+
+    try:
+        interval = float(value)
+    except ValueError:
+        interval = None
+
+    if interval is None or not math.isfinite(interval) or interval <= 0:
+        logger.warning(
+            f"Ignoring {name}={value!r}, not a positive number of seconds: "
+            f"using {DEFAULT_FETCH_INTERVAL_SECONDS}"
+        )
+        return DEFAULT_FETCH_INTERVAL_SECONDS
+
+    return interval
+
+
+def select_accounts(monitored_projects, selector):
+    """Returns the accounts of the spokes whose project and custom tag are selected by the
+    Projects and Environments of a fetch request
+
+    Args:
+        monitored_projects (list): the spokes, as returned by get_monitored_projects
+        selector (dict): the selector of the request, see fetch_selector
+
+    Returns:
+        [set]: the account ids
+    """
+
+    return {
+        account
+        for project, tag, account in monitored_projects
+        if matches(selector, PROJECTS, project) and matches(selector, ENVIRONMENTS, tag)
+    }
+
+
+def phase(account_id, interval):
+    """The offset of the fetches of a spoke within its interval: stable, and spread
+    uniformly across the spokes, so that their fetches do not line up"""
+
+    digest = int(hashlib.sha256(str(account_id).encode("utf-8")).hexdigest(), 16)
+
+    return digest % max(int(interval), 1)
+
+
+def due_spokes(spokes, now, tick):
+    """Returns the spokes due for a fetch in the tick ending at now: the ones whose next
+    fetch time (a multiple of their interval, shifted by their phase) is in (now - tick, now]
+
+    Args:
+        spokes (dict): {account id: interval in seconds}
+        now (float): the end of the tick, epoch seconds
+        tick (float): the length of the tick, in seconds
+
+    Returns:
+        [list]: the account ids due
+    """
+
+    due = []
+    for account, interval in sorted(spokes.items()):
+        offset = phase(account, interval)
+        if (now - offset) // interval != (now - tick - offset) // interval:
+            due.append(account)
+
+    return due
+
+
+# the packs read by get_packs, and when they were read
+_packs = None
+_packs_read_at = None
+
+
+def get_packs():
+    """Returns the packs of spokes of the rules forwarding the fetch requests: a rule forwards
+    a request to all its targets as soon as it lists one of them. The packs are kept for
+    FETCH_PACKS_MAX_AGE_SECONDS, an outdated pack only costs extra forwarded requests
+
+    Returns:
+        [list]: the packs, sets of account ids
+    """
+
+    global _packs, _packs_read_at
+
+    if _packs is not None and time.time() - _packs_read_at < FETCH_PACKS_MAX_AGE_SECONDS:
+        return _packs
+
+    packs = []
+    paginator = events_client.get_paginator("list_rules")
+    for page in paginator.paginate(NamePrefix=FETCH_RULE_PREFIX, EventBusName="default"):
+        for rule in page["Rules"]:
+            targets = events_client.get_paginator("list_targets_by_rule")
+            packs.append(
+                {
+                    t["Id"][: -len("-bus")]
+                    for p in targets.paginate(Rule=rule["Name"], EventBusName="default")
+                    for t in p["Targets"]
+                    if t["Id"].endswith("-bus")
+                }
+            )
+
+    _packs, _packs_read_at = packs, time.time()
+
+    return packs
+
+
+def shards(accounts, packs=None, size=None):
+    """Splits the accounts in shards of at most size (FETCH_SHARD_SIZE by default). The
+    accounts of a same pack (see get_packs) go in the same shard, so that each forwarding
+    rule is matched by a single request: a pack split across shards would forward each of
+    them to all its spokes. A shard only exceeds size if a single pack does
+
+    Args:
+        accounts (list): the account ids
+        packs (list): the packs, sets of account ids. None shards the accounts in their order
+        size (int): the maximum number of accounts of a shard
+
+    Returns:
+        [list]: the shards, lists of account ids
+    """
+
+    size = size or FETCH_SHARD_SIZE
+
+    if packs is None:
+        return [accounts[i : i + size] for i in range(0, len(accounts), size)]
+
+    pack_of = {a: i for i, pack in enumerate(packs) for a in pack}
+    groups = {}
+    for account in accounts:
+        # accounts in no pack (not connected yet) are not forwarded: one group each
+        groups.setdefault(pack_of.get(account, account), []).append(account)
+
+    result = []
+    for group in groups.values():
+        if result and len(result[-1]) + len(group) <= size:
+            result[-1].extend(group)
+        else:
+            result.append(list(group))
+
+    return result
+
+
+def send_requests(account_shards, window_seconds=0, time_left=None, selector=None):
+    """Emits one fetch request per shard. With a window, the requests are spread over it,
+    each at a random time within its own slot
+
+    Args:
+        account_shards (list): the shards, lists of account ids
+        window_seconds (float): the window to spread the requests over
+        time_left (callable): returns the seconds left to run, the window is capped by it
+        selector (dict): added to each request, see fetch_selector
+
+    Returns:
+        [list]: the requests that could not be emitted
+    """
+
+    selector = selector or {}
+
+    if time_left is not None:
+        window_seconds = min(window_seconds, max(time_left() - 5, 0))
+
+    if window_seconds <= 0 or len(account_shards) < 2:
+        return emit_payloads(
+            [{**selector, "Targets": s} for s in account_shards],
+            source="metric_fetch",
+            detail_type="metric_fetch",
+        )
+
+    start = time.monotonic()
+    slot = window_seconds / len(account_shards)
+    dropped = []
+    for i, s in enumerate(account_shards):
+        wait = start + (i + random.random()) * slot - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        dropped += emit_payloads(
+            [{**selector, "Targets": s}], source="metric_fetch", detail_type="metric_fetch"
+        )
+
+    return dropped
 
 
 def lambda_handler(event, context):
     """
-    This will just emit an event to the default bus
+    This emits the fetch requests of the spokes, to the default bus. The spokes are split in
+    shards of FETCH_SHARD_SIZE accounts, one request each, listing them in Targets. The
+    spokes forwarded by a same rule are in the same shard (see shards).
+
+    * invoked by the schedule (every FETCH_TICK_SECONDS), only the spokes due are requested:
+      each spoke is fetched once per interval (/fetch_intervals/ProjectName, in seconds, or
+      DEFAULT_FETCH_INTERVAL_SECONDS), at its own offset, so that the load reaching the hub
+      is a steady stream rather than a burst
+    * invoked on demand, all the spokes are requested, spread over FETCH_WINDOW_SECONDS
+    * invoked on demand with a selector (Projects, Environments, MetricNames and
+      OlderThanSeconds, see fetch_selector), only the spokes of the projects and custom tags
+      selected are requested, at once, and the requests carry the selector so that the spokes
+      only compute the metrics selected
+
     Args:
-        event (dict): The event from EventBridge
+        event (dict): The event from EventBridge, or the selector of an on-demand fetch
         context : the context
     """
 
-    logger.info("Starting execution with payload:")
-    logger.info(json.dumps(event))
+    log_payload(logger, event)
+
+    monitored_projects = get_monitored_projects()
+    spokes = get_spokes(monitored_projects)
+    selector = {}
+
+    if event.get("detail-type") == "Scheduled Event" and FETCH_TICK_SECONDS > 0:
+        # the time of the schedule, not of the invocation: ticks neither overlap nor leave gaps
+        now = datetime.datetime.fromisoformat(event["time"].replace("Z", "+00:00"))
+        accounts = due_spokes(spokes, now.timestamp(), FETCH_TICK_SECONDS)
+        window_seconds = 0
+    else:
+        selector = parse_selector(event)
+        accounts = sorted(select_accounts(monitored_projects, selector))
+        # a targeted refresh is interactive, and small: it is not spread
+        window_seconds = 0 if selector else FETCH_WINDOW_SECONDS
 
-    return events_client.put_events(
-        Entries=[
-            {
-                "Source": "metric_fetch",
-                "Resources": [],
-                "DetailType": "metric_fetch",
-                "Detail": "{}",
-            }
-        ]
+    account_shards = shards(accounts, get_packs() if accounts else None)
+
+    logger.info(
+        f"Requesting a fetch from {len(accounts)} of {len(spokes)} spokes, in {len(account_shards)} shards"
+    )
+
+    dropped = send_requests(
+        account_shards,
+        window_seconds,
+        time_left=(lambda: context.get_remaining_time_in_millis() / 1000.0)
+        if context
+        else None,
+        selector=selector,
     )
+
+    if dropped:
+        logger.error(f"{len(dropped)} fetch requests could not be emitted")
+
+    return {
+        "requested": len(accounts),
+        "shards": len(account_shards),
+        "selector": selector,
+        "dropped": [d["Targets"] for d in dropped],
+    }
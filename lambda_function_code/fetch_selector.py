@@ -0,0 +1,91 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import itertools
+
+# the fields of a fetch request (see fetch_metric_values) restricting what is extracted.
+# A request without them is for every metric of every spoke
+PROJECTS = "Projects"
+ENVIRONMENTS = "Environments"
+METRIC_NAMES = "MetricNames"
+# only the values older than this many seconds are computed again, the others are reused
+OLDER_THAN_SECONDS = "OlderThanSeconds"
+
+LIST_FIELDS = (PROJECTS, ENVIRONMENTS, METRIC_NAMES)
+
+
+def parse_selector(detail):
+    """Reads the selector of a fetch request. Single names are accepted for the list fields,
+    and the other fields of the request are ignored. Raises ValueError if a field is invalid
+
+    Args:
+        detail (dict): the detail of the fetch request, or the payload of an on-demand fetch
+
+    Returns:
+        [dict]: the selector, with only the fields set
+    """
+
+    selector = {}
+
+    for field in LIST_FIELDS:
+        value = detail.get(field)
+        if value is None:
+            continue
+        if isinstance(value, str):
+            value = [value]
+        if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+            raise ValueError(f"{field} must be a list of names, got {value!r}")
+        if value:
+            selector[field] = sorted(set(value))
+
+    age = detail.get(OLDER_THAN_SECONDS)
+    if age is not None:
+        if isinstance(age, bool) or not isinstance(age, (int, float)) or age < 0:
+            raise ValueError(f"{OLDER_THAN_SECONDS} must be a number of seconds, got {age!r}")
+        selector[OLDER_THAN_SECONDS] = age
+
+    return selector
+
+
+def matches(selector, field, value):
+    """Tells if a project, environment or metric name is selected"""
+
+    return field not in selector or value in selector[field]
+
+
+def spoke_pattern(account_id, project_name, environment, metric_names):
+    """Returns the pattern of the rule of a spoke triggering its extraction: a fetch request
+    gets through if each of Targets, Projects, Environments and MetricNames is either absent,
+    or lists this spoke, its project, its environment or one of its metrics
+
+    Args:
+        account_id (str): the account of the spoke
+        project_name (str): the project of the spoke
+        environment (str): the environment of the spoke
+        metric_names (list): the metrics extracted by the spoke
+
+    Returns:
+        [dict]: the event pattern
+    """
+
+    accepted = [
+        ("Targets", [account_id]),
+        (PROJECTS, [project_name]),
+        (ENVIRONMENTS, [environment]),
+        (METRIC_NAMES, sorted(metric_names)),
+    ]
+
+    # EventBridge has no "absent or equal to" matcher: one alternative per combination
+    alternatives = [
+        {
+            field: values if present else [{"exists": False}]
+            for (field, values), present in zip(accepted, combination)
+        }
+        for combination in itertools.product([False, True], repeat=len(accepted))
+    ]
+
+    return {
+        "source": ["metric_fetch"],
+        "detail-type": ["metric_fetch"],
+        "detail": {"$or": alternatives},
+    }
@@ -0,0 +1,186 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import json
+import time
+import random
+import functools
+import threading
+import contextlib
+import logging
+
+logging.basicConfig()
+
+logger = logging.getLogger("lambda:instrumentation")
+logger.setLevel(os.getenv("LOGLEVEL", "INFO"))
+
+# CloudWatch namespace of the metrics in the embedded metric format (EMF) lines
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "DsDashboard")
+# share of the invocations logging their full payload (all of them at DEBUG level)
+PAYLOAD_LOG_SAMPLE_RATE = float(os.getenv("PAYLOAD_LOG_SAMPLE_RATE", "0.01"))
+# set to false to turn off the EMF lines
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+UNITS = {
+    "Duration": "Milliseconds",
+    "ApiCalls": "Count",
+    "Retries": "Count",
+    "Throttles": "Count",
+    "PayloadBytes": "Bytes",
+    "ColdStart": "Count",
+}
+
+# True until the first invocation of this container completes
+_cold_start = True
+
+
+class Recorder:
+    """Accumulates the measures of one invocation, in total and per metric"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = {}
+        self.metrics = {}
+
+    def add(self, name, value, metric_name=None):
+        with self._lock:
+            self.totals[name] = self.totals.get(name, 0) + value
+            if metric_name is not None:
+                measures = self.metrics.setdefault(metric_name, {})
+                measures[name] = measures.get(name, 0) + value
+
+
+_current = None
+# the metric computed by the current thread, API calls issued are charged to it
+_thread = threading.local()
+
+
+def count(name, value=1, metric_name=None):
+    """Adds value to a measure of the current invocation, and of a metric: the one given, or
+    the one computed by the calling thread, if any. Outside an instrumented invocation,
+    it does nothing"""
+
+    recorder = _current
+    if recorder is not None:
+        recorder.add(name, value, metric_name or getattr(_thread, "metric_name", None))
+
+
+@contextlib.contextmanager
+def metric_scope(metric_name):
+    """Charges the API calls of the calling thread to a metric, and times its computation"""
+
+    _thread.metric_name = metric_name
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        count("Duration", (time.perf_counter() - start) * 1000)
+        _thread.metric_name = None
+
+
+def _after_call(parsed=None, **kwargs):
+    count("ApiCalls")
+    retries = (parsed or {}).get("ResponseMetadata", {}).get("RetryAttempts", 0)
+    if retries:
+        count("Retries", retries)
+
+
+def instrument_client(client):
+    """Counts the calls issued by a boto3 client, and their retries. Returns the client"""
+
+    client.meta.events.register("after-call", _after_call)
+
+    return client
+
+
+def emit_metrics(dimensions, measures, properties=None):
+    """Writes one line in the CloudWatch embedded metric format: CloudWatch extracts the
+    metrics from the log, no API call is needed
+
+    Args:
+        dimensions (dict): the dimensions, e.g. {"Function": "retrieve_values"}
+        measures (dict): the values, by name (see UNITS)
+        properties (dict): other fields, searchable in the logs but not metrics
+    """
+
+    if not METRICS_ENABLED or not measures:
+        return
+
+    record = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [list(dimensions)],
+                    "Metrics": [
+                        {"Name": n, "Unit": UNITS.get(n, "None")} for n in measures
+                    ],
+                }
+            ],
+        },
+        **(properties or {}),
+        **dimensions,
+        **{n: round(v, 3) for n, v in measures.items()},
+    }
+
+    # printed, not logged: the line must be a bare json object
+    print(json.dumps(record, default=str), flush=True)
+
+
+def instrumented(function_name):
+    """Decorates a lambda handler: its invocations write one EMF line with their duration,
+    API calls, retries, throttles, payload bytes and cold start flag, and one line per metric
+    computed
+    """
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            global _current, _cold_start
+
+            recorder = Recorder()
+            _current = recorder
+            cold_start = _cold_start
+            start = time.perf_counter()
+            try:
+                return handler(event, context)
+            finally:
+                _current = None
+                _cold_start = False
+                duration = (time.perf_counter() - start) * 1000
+
+                for metric_name, measures in sorted(recorder.metrics.items()):
+                    emit_metrics(
+                        {"Function": function_name, "MetricName": metric_name}, measures
+                    )
+
+                emit_metrics(
+                    {"Function": function_name},
+                    {
+                        "Duration": duration,
+                        "ApiCalls": recorder.totals.get("ApiCalls", 0),
+                        "Retries": recorder.totals.get("Retries", 0),
+                        "Throttles": recorder.totals.get("Throttles", 0),
+                        "PayloadBytes": recorder.totals.get("PayloadBytes", 0),
+                        "ColdStart": int(cold_start),
+                    },
+                    {
+                        "RequestId": getattr(context, "aws_request_id", None),
+                        "Metrics": len(recorder.metrics),
+                    },
+                )
+
+        return wrapper
+
+    return decorator
+
+
+def log_payload(handler_logger, payload):
+    """Logs the payload of an invocation: always at DEBUG level, otherwise only for a sample
+    (PAYLOAD_LOG_SAMPLE_RATE) of the invocations"""
+
+    if handler_logger.isEnabledFor(logging.DEBUG) or random.random() < PAYLOAD_LOG_SAMPLE_RATE:
+        handler_logger.info("Starting execution with payload:")
+        handler_logger.info(json.dumps(payload, default=str))
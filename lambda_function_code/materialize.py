@@ -0,0 +1,256 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import json
+import boto3
+import logging
+from decimal import Decimal
+from boto3.dynamodb.conditions import Key, Attr
+from boto3.dynamodb.types import TypeDeserializer
+from table_schema import (
+    SERIES_KEY,
+    TIMESTAMP,
+    EXPIRES_AT,
+    EMITTED_AT,
+    METRIC_DAY,
+    ROLLUP_KEY,
+    BUCKET_START,
+    RESOLUTIONS,
+    rollup_key,
+    bucket_start,
+    expires_at,
+)
+from sketch import merge_all
+
+logging.basicConfig()
+
+logger = logging.getLogger("lambda:materialize")
+logger.setLevel(os.getenv("LOGLEVEL", "INFO"))
+
+# hourly rollups expire after this many days. 0 keeps them forever. Daily rollups are kept forever
+HOURLY_RETENTION_DAYS = int(os.getenv("HOURLY_RETENTION_DAYS", "0"))
+
+dynamodb = boto3.resource("dynamodb")
+table = dynamodb.Table(os.getenv("DDB_TABLE_NAME", "ds-dashboard-hub-metrics"))
+rollup_table = dynamodb.Table(os.getenv("ROLLUP_TABLE_NAME", "ds-dashboard-hub-rollups"))
+latest_table = dynamodb.Table(os.getenv("LATEST_TABLE_NAME", "ds-dashboard-hub-latest"))
+
+deserializer = TypeDeserializer()
+
+
+def query_all(target_table, **kwargs):
+    """Returns all the items of a query, following the pagination"""
+
+    items = []
+    while True:
+        page = target_table.query(**kwargs)
+        items.extend(page["Items"])
+        if "LastEvaluatedKey" not in page:
+            return items
+        kwargs["ExclusiveStartKey"] = page["LastEvaluatedKey"]
+
+
+def to_dynamodb(value):
+    """Converts the floats of a value to Decimals, as DynamoDB requires"""
+
+    return json.loads(json.dumps(value), parse_float=Decimal)
+
+
+def summarize(items):
+    """Aggregates raw items in a rollup: Count and Last for every metric,
+    NumericCount, Sum, Min, Max for the numeric values, and the merge of the sketches
+    of distribution metrics in Sketch
+
+    Args:
+        items (list): raw items with MetricValue and ExtractionTimestamp
+
+    Returns:
+        [dict]: the aggregates
+    """
+
+    summary = {"Count": len(items)}
+
+    last = max(items, key=lambda i: i[TIMESTAMP])
+    summary["Last"] = last.get("MetricValue")
+    summary["LastTimestamp"] = last[TIMESTAMP]
+
+    numbers = [
+        i["MetricValue"]
+        for i in items
+        if isinstance(i.get("MetricValue"), (int, Decimal))
+        and not isinstance(i.get("MetricValue"), bool)
+    ]
+    if numbers:
+        summary["NumericCount"] = len(numbers)
+        summary["Sum"] = sum(numbers)
+        summary["Min"] = min(numbers)
+        summary["Max"] = max(numbers)
+
+    sketch = merge_all(i.get("MetricValue") for i in items)
+    if sketch is not None:
+        summary["Sketch"] = to_dynamodb(sketch.to_dict())
+
+    return summary
+
+
+def merge(summaries):
+    """Merges rollups of the same series into the rollup of a wider bucket"""
+
+    merged = {"Count": sum(s["Count"] for s in summaries)}
+
+    last = max(summaries, key=lambda s: s["LastTimestamp"])
+    merged["Last"] = last.get("Last")
+    merged["LastTimestamp"] = last["LastTimestamp"]
+
+    numeric = [s for s in summaries if s.get("NumericCount")]
+    if numeric:
+        merged["NumericCount"] = sum(s["NumericCount"] for s in numeric)
+        merged["Sum"] = sum(s["Sum"] for s in numeric)
+        merged["Min"] = min(s["Min"] for s in numeric)
+        merged["Max"] = max(s["Max"] for s in numeric)
+
+    sketch = merge_all(s.get("Sketch") for s in summaries)
+    if sketch is not None:
+        merged["Sketch"] = to_dynamodb(sketch.to_dict())
+
+    return merged
+
+
+def write_rollup(series, resolution, start, summary, sample, retention_days):
+    item = {
+        ROLLUP_KEY: rollup_key(resolution, series),
+        BUCKET_START: start,
+        SERIES_KEY: series,
+        "Resolution": resolution,
+        "ProjectName": sample.get("ProjectName"),
+        "Environment": sample.get("Environment"),
+        "MetricName": sample.get("MetricName"),
+        **summary,
+    }
+
+    ttl = expires_at(start, retention_days)
+    if ttl is not None:
+        item[EXPIRES_AT] = ttl
+
+    rollup_table.put_item(Item=item)
+
+
+def update_hour(series, start):
+    """Recomputes the hourly rollup of a series from the raw items of that hour.
+    Rollups are recomputed, not incremented, so that events delivered twice or
+    out of order cannot skew them
+    """
+
+    items = query_all(
+        table,
+        KeyConditionExpression=Key(SERIES_KEY).eq(series)
+        & Key(TIMESTAMP).between(start, start + RESOLUTIONS["hour"] - 1),
+        ProjectionExpression="#v, #t, #p, #e, #m",
+        ExpressionAttributeNames={
+            "#v": "MetricValue",
+            "#t": TIMESTAMP,
+            "#p": "ProjectName",
+            "#e": "Environment",
+            "#m": "MetricName",
+        },
+    )
+
+    if not items:
+        return
+
+    write_rollup(series, "hour", start, summarize(items), items[0], HOURLY_RETENTION_DAYS)
+
+
+def update_day(series, start):
+    """Recomputes the daily rollup of a series from its hourly rollups"""
+
+    hours = query_all(
+        rollup_table,
+        KeyConditionExpression=Key(ROLLUP_KEY).eq(rollup_key("hour", series))
+        & Key(BUCKET_START).between(start, start + RESOLUTIONS["day"] - 1),
+    )
+
+    if not hours:
+        return
+
+    write_rollup(series, "day", start, merge(hours), hours[0], 0)
+
+
+def update_latest(item):
+    """Copies a raw item, as read from the stream, to the latest-value table. The write is
+    conditional: an item older than the one already there (e.g. delivered late) is ignored,
+    so the view never goes back in time. The same item emitted again later (a heartbeat of a
+    cached value, with a newer EmittedTimestamp) replaces it
+
+    Returns:
+        [bool]: whether the view was updated
+    """
+
+    item = {k: v for k, v in item.items() if k not in (EXPIRES_AT, METRIC_DAY)}
+    timestamp = item[TIMESTAMP]
+
+    condition = Attr(TIMESTAMP).not_exists() | Attr(TIMESTAMP).lt(timestamp)
+    if EMITTED_AT in item:
+        condition = condition | (
+            Attr(TIMESTAMP).eq(timestamp)
+            & (Attr(EMITTED_AT).not_exists() | Attr(EMITTED_AT).lt(item[EMITTED_AT]))
+        )
+
+    try:
+        latest_table.put_item(Item=item, ConditionExpression=condition)
+    except latest_table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+
+    return True
+
+
+def recency(item):
+    """Orders the items of a series: by extraction time, then by emission time"""
+
+    return item[TIMESTAMP], item.get(EMITTED_AT, item[TIMESTAMP])
+
+
+def lambda_handler(event, context):
+    """This is triggered by the stream of the hub table. For each time series and hour
+    touched by the new items it recomputes the hourly rollup, then the daily one.
+    The newest item of each series touched is copied to the latest-value table, from the
+    new image carried by the stream record (the stream is NEW_IMAGE), without reading it back.
+    Deletions (e.g. raw items expired by their TTL) do not change the rollups nor the view.
+
+    Args:
+        event (dict): a batch of DynamoDB stream records
+        context : the context
+    """
+
+    touched = set()
+    newest = {}
+
+    for record in event["Records"]:
+        if record["eventName"] not in ["INSERT", "MODIFY"]:
+            continue
+
+        item = {
+            k: deserializer.deserialize(v)
+            for k, v in record["dynamodb"]["NewImage"].items()
+        }
+        series = item[SERIES_KEY]
+        timestamp = int(item[TIMESTAMP])
+
+        touched.add((series, bucket_start(timestamp, "hour")))
+        if series not in newest or recency(item) > recency(newest[series]):
+            newest[series] = item
+
+    # only the newest item of each series in the batch can be the latest value
+    updated = sum(update_latest(item) for item in newest.values())
+    logger.info(f"Updated the latest value of {updated} of {len(newest)} series")
+
+    logger.info(f"Updating {len(touched)} hourly rollups")
+
+    days = set()
+    for series, start in sorted(touched):
+        update_hour(series, start)
+        days.add((series, bucket_start(start, "day")))
+
+    for series, start in sorted(days):
+        update_day(series, start)
@@ -2,12 +2,37 @@
 # SPDX-License-Identifier: MIT-0
 
 import datetime
-import boto3
-import json
+from training_job_index import get_training_job_index, CREATION, END
+from api_cache import CachedClient
+from clients import LazyClient, region_scope
+from metric_registry import register
+from instrumentation import metric_scope
+from sketch import QuantileSketch, merge_all
+from metric_windows import next_window, window_key
+
+# the clients are only created when a metric first uses them. Within a retrieve_values run,
+# metrics issuing the same read calls share their results
+sagemaker_client = CachedClient(LazyClient("sagemaker"))
+ssm_client = CachedClient(LazyClient("ssm"))
+
+
+def replace_placeholders(value, replacements):
+    """Returns a copy of value (a policy statement, or any part of it) where each key of
+    replacements is replaced by its value, in every string, dict key included"""
+
+    if isinstance(value, str):
+        for placeholder, replacement in replacements.items():
+            value = value.replace(placeholder, replacement)
+        return value
+    if isinstance(value, dict):
+        return {
+            replace_placeholders(k, replacements): replace_placeholders(v, replacements)
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [replace_placeholders(v, replacements) for v in value]
 
-events_client = boto3.client("events")
-sagemaker_client = boto3.client("sagemaker")
-ssm_client = boto3.client("ssm")
+    return value
 
 
 class Metric:
@@ -19,79 +44,152 @@ class Metric:
         }
     ]
 
-    def __init__(self, metric_name, project_name, metadata, environment):
+    # deadline for the computation of this metric. None means the default set in retrieve_values
+    _timeout_seconds = None
+
+    # how long a value stays fresh: within it, retrieve_values emits the last value again
+    # (with its original timestamp) instead of computing a new one. None recomputes every time
+    _ttl_seconds = None
+
+    # the regions this metric is extracted from, concurrently, with an aggregated value on top
+    # (see aggregate). None means the regions set in retrieve_values (METRIC_REGIONS), by
+    # default only the region of the lambda
+    _regions = None
+
+    def __init_subclass__(cls, **kwargs):
+        """Registers every metric class by name, see metric_registry.get_metric_class"""
+        super().__init_subclass__(**kwargs)
+        register(cls)
+
+    def __init__(self, metric_name, project_name, metadata, environment, region=None):
         """Class constructor. child classes should not need to implement this.
 
         Args:
             metric_name (str): the name of this metric
             project_name (str): the project the metric belongs to
             metadata (dict): the metadata
+            region (str): the region to extract the metric from, None for the region of the lambda
         """
         self.metric_name = metric_name
         self.project_name = project_name
         self.metadata = metadata
         self.environment = environment
+        self.region = region
 
-    def get_iam_permissions(self, region, account_id):
+    @classmethod
+    def get_iam_permissions(cls, region, account_id):
+        """Returns the IAM statements this metric needs, read from the class (no instance is
+        needed), with the placeholders **REGION** and **ACCOUNT_ID** replaced at any depth
 
-        replaced_list = []
-        for p in self._iam_permissions:
-            p = (
-                str(p)
-                .replace("**REGION**", region)
-                .replace("**ACCOUNT_ID**", account_id)
-            )
+        Args:
+            region (str): the region of the spoke
+            account_id (str): the account of the spoke
+
+        Returns:
+            [list]: the statements
+        """
+
+        replacements = {"**REGION**": region, "**ACCOUNT_ID**": account_id}
 
-            replaced_list.append(eval(p))
-        return replaced_list
+        return [replace_placeholders(p, replacements) for p in cls._iam_permissions]
 
     def extract(self):
         """The method that calculates the value of the metric and formats the output. child classes should not need to implement this."""
-        return {
+        # the clients used by _compute_value are the ones of the region of this instance
+        with metric_scope(self.metric_name), region_scope(self.region):
+            value = self._compute_value()
+        now = datetime.datetime.now(datetime.timezone.utc)
+        payload = {
             "MetricName": self.metric_name,
-            "MetricValue": self._compute_value(),
-            "ExtractionDate": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f"),
+            "MetricValue": value,
+            "ExtractionDate": now.strftime("%Y-%m-%d %H:%M:%S.%f"),
+            "ExtractionTimestamp": int(round(now.timestamp() * 1e6)),
             "Metadata": self.metadata,
             "Environment": self.environment,
             "ProjectName": self.project_name,
         }
+        if self.region is not None:
+            payload["Region"] = self.region
+        return payload
 
-    def emit_event(self, payload):
-        """emit an event with a given payload. child classes should not need to implement this.
+    @classmethod
+    def aggregate(cls, values):
+        """Combines the values of the regions of a multi-region metric into its aggregated
+        value: numbers are summed. Child classes can override it (e.g. for an average).
 
         Args:
-            payload (dict): the payload of the event to be emitted
+            values (list): the values, one per region
+
+        Returns:
+            the aggregated value, None if the values cannot be combined (no aggregate is emitted)
         """
 
-        response = events_client.put_events(
-            Entries=[
-                {
-                    "Source": "metric_extractor",
-                    "Resources": [],
-                    "DetailType": "metric_extractor",
-                    "Detail": json.dumps(payload),
-                }
-            ]
-        )
+        if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+            return sum(values)
+
+        return None
 
     def _compute_value(self):
         """This is where the actual calculation happens. Child classes MUST implement this"""
         raise NotImplementedError
 
 
+class DistributionMetric(Metric):
+    """A metric whose value is the distribution of many observations (e.g. the durations of
+    the training jobs), shipped as a quantile sketch of fixed size (see sketch.py). Each
+    extraction observes a window starting where the previous one ended, so the hub can merge
+    the sketches of any time range, environments and projects to answer percentile queries.
+    """
+
+    # length of the first window, when the metric was never extracted before
+    _initial_window_seconds = 24 * 3600
+    # the quantiles are estimated within this relative error
+    _relative_accuracy = 0.02
+
+    def _compute_value(self):
+        """Builds the sketch of the observations of the window. child classes should not need to implement this."""
+
+        key = window_key(self.project_name, self.environment, self.metric_name, self.region)
+        start, end = next_window(key, self._initial_window_seconds)
+
+        sketch = QuantileSketch(self._relative_accuracy)
+        for value in self._compute_values(
+            datetime.datetime.fromtimestamp(start, tz=datetime.timezone.utc),
+            datetime.datetime.fromtimestamp(end, tz=datetime.timezone.utc),
+        ):
+            sketch.add(value)
+
+        self.metadata = {**(self.metadata or {}), "WindowStart": start, "WindowEnd": end}
+
+        return sketch.to_dict()
+
+    @classmethod
+    def aggregate(cls, values):
+        """The sketches of the regions are merged"""
+
+        merged = merge_all(values)
+
+        return merged.to_dict() if merged is not None else None
+
+    def _compute_values(self, start, end):
+        """Returns the observations between start and end (UTC datetimes). Child classes MUST implement this"""
+        raise NotImplementedError
+
+
 class TotalCompletedTrainingJobs(Metric):
 
     _iam_permissions = Metric._iam_permissions + [
         {"Action": ["sagemaker:ListTrainingJobs"], "Resource": "*"}
     ]
 
+    # a count over the whole history, which moves slowly: each refresh lists the jobs
+    _ttl_seconds = 900
+
     def _compute_value(self):
 
-        jobs = sagemaker_client.list_training_jobs(
-            StatusEquals="Completed",
-        )["TrainingJobSummaries"]
+        index = get_training_job_index(sagemaker_client)
 
-        return len(jobs)
+        return index.count(status="Completed")
 
 
 class CompletedTrainingJobs24h(Metric):
@@ -100,18 +198,17 @@ class CompletedTrainingJobs24h(Metric):
         {"Action": ["sagemaker:ListTrainingJobs"], "Resource": "*"}
     ]
 
+    # with the same TTL as TotalCompletedTrainingJobs, the index is only refreshed for both
+    _ttl_seconds = 900
+
     def _compute_value(self):
 
-        today = datetime.datetime.now()
+        today = datetime.datetime.now(datetime.timezone.utc)
         yesterday = today - datetime.timedelta(days=1)
 
-        jobs = sagemaker_client.list_training_jobs(
-            StatusEquals="Completed",
-            LastModifiedTimeAfter=yesterday,
-            LastModifiedTimeBefore=today,
-        )["TrainingJobSummaries"]
+        index = get_training_job_index(sagemaker_client)
 
-        return len(jobs)
+        return index.count(status="Completed", after=yesterday, before=today)
 
 
 class NumberEndPointsInService(Metric):
@@ -120,9 +217,13 @@ class NumberEndPointsInService(Metric):
         {"Action": "sagemaker:ListEndpoints", "Resource": "*"}
     ]
 
+    # the full listing of the endpoints, which change rarely
+    _ttl_seconds = 300
+
     def _compute_value(self):
 
-        eps = sagemaker_client.list_endpoints(
+        eps = sagemaker_client.list_all(
+            "list_endpoints",
             StatusEquals="InService",
         )["Endpoints"]
 
@@ -140,3 +241,23 @@ class SSMParamStoreValueMyName(Metric):
     def _compute_value(self):
 
         return ssm_client.get_parameter(Name="MyName")["Parameter"]["Value"]
+
+
+class TrainingJobDurations(DistributionMetric):
+
+    _iam_permissions = Metric._iam_permissions + [
+        {"Action": ["sagemaker:ListTrainingJobs"], "Resource": "*"}
+    ]
+
+    def _compute_values(self, start, end):
+
+        index = get_training_job_index(sagemaker_client)
+
+        # creation to end of the jobs completed in the window, in seconds
+        return [
+            job[END] - job[CREATION]
+            for _, job in index.jobs_with(
+                status="Completed", after=start, before=end, field="TrainingEndTime"
+            )
+            if job[CREATION] is not None and job[END] is not None
+        ]
@@ -0,0 +1,41 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import importlib
+
+# the modules defining metrics, imported only when a metric is first looked up
+METRIC_MODULES = os.getenv("METRIC_MODULES", "metric").split(",")
+
+_registry = {}
+
+
+def register(metric_class):
+    """Registers a metric class under its name. Subclasses of Metric register themselves"""
+
+    _registry[metric_class.__name__] = metric_class
+
+    return metric_class
+
+
+def get_metric_class(name):
+    """Returns the metric class with a given name. The metric modules are imported
+    one at a time, until the class is found
+
+    Args:
+        name (str): the name of the class, e.g. TotalCompletedTrainingJobs
+
+    Returns:
+        [type]: the class
+    """
+
+    if name not in _registry:
+        for module in METRIC_MODULES:
+            importlib.import_module(module)
+            if name in _registry:
+                break
+
+    if name not in _registry:
+        raise KeyError(f"Unknown metric {name}, not defined in {METRIC_MODULES}")
+
+    return _registry[name]
@@ -0,0 +1,84 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import time
+import threading
+import logging
+from object_store import get_state_store, load_json, save_json
+
+logging.basicConfig()
+
+logger = logging.getLogger("lambda:metric_windows")
+logger.setLevel(os.getenv("LOGLEVEL", "INFO"))
+
+STATE_KEY = "metric_windows.json"
+
+_window_ends = None
+_lock = threading.Lock()
+
+
+def window_key(project_name, environment, metric_name, region=None):
+    parts = [str(project_name), str(environment), str(metric_name)]
+    if region is not None:
+        parts.append(str(region))
+
+    return "#".join(parts)
+
+
+def _get_window_ends():
+    global _window_ends
+
+    if _window_ends is None:
+        _window_ends = load_json(get_state_store(), STATE_KEY) or {}
+
+    return _window_ends
+
+
+def next_window(key, initial_seconds, now=None):
+    """Returns the observation window of a distribution metric: from the end of its last
+    emitted window to now. Consecutive windows never overlap, so the hub can merge all the
+    sketches of a series over any time range. The end of the window is only persisted by
+    commit_windows, once the value is emitted: a value that times out, fails or is dropped
+    leaves its window to the next extraction.
+
+    Args:
+        key (str): identifies the metric, see window_key
+        initial_seconds (float): length of the first window, when there is no previous one
+        now (float): the current epoch time, in seconds
+
+    Returns:
+        [tuple]: start and end of the window, epoch seconds
+    """
+
+    now = time.time() if now is None else now
+
+    with _lock:
+        start = _get_window_ends().get(key, now - initial_seconds)
+
+    return min(start, now), now
+
+
+def commit_windows(payloads):
+    """Persists the end of the windows of the values emitted, so that the next windows
+    start there. Payloads without a window (the other metrics) are ignored
+
+    Args:
+        payloads (list): the payloads emitted
+    """
+
+    ends = {}
+    for p in payloads:
+        end = (p.get("Metadata") or {}).get("WindowEnd")
+        if end is not None:
+            key = window_key(p["ProjectName"], p["Environment"], p["MetricName"], p.get("Region"))
+            ends[key] = max(end, ends.get(key, end))
+
+    if not ends:
+        return
+
+    with _lock:
+        window_ends = _get_window_ends()
+        for key, end in ends.items():
+            window_ends[key] = max(end, window_ends.get(key, end))
+        save_json(get_state_store(), STATE_KEY, window_ends)
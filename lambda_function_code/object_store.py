@@ -0,0 +1,193 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import json
+import logging
+from urllib.parse import urlparse
+
+logging.basicConfig()
+
+logger = logging.getLogger("lambda:object_store")
+logger.setLevel(os.getenv("LOGLEVEL", "INFO"))
+
+
+class S3ObjectStore:
+    """Stores objects under a prefix of an S3 bucket. With expected_owner (an account id),
+    the requests fail unless the bucket belongs to that account"""
+
+    def __init__(self, bucket, prefix="", expected_owner=None):
+        import boto3
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.s3_client = boto3.client("s3")
+        self._owner = {"ExpectedBucketOwner": expected_owner} if expected_owner else {}
+
+    def _key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def get(self, key):
+        """Returns the content of an object, or None if it does not exist
+
+        Args:
+            key (str): the key of the object, relative to the store
+
+        Returns:
+            [bytes]: the content of the object
+        """
+
+        try:
+            return self.s3_client.get_object(
+                Bucket=self.bucket, Key=self._key(key), **self._owner
+            )["Body"].read()
+        except self.s3_client.exceptions.NoSuchKey:
+            return None
+
+    def put(self, key, body):
+        """Writes an object
+
+        Args:
+            key (str): the key of the object, relative to the store
+            body (bytes): the content of the object
+        """
+
+        self.s3_client.put_object(
+            Bucket=self.bucket, Key=self._key(key), Body=body, **self._owner
+        )
+
+    def list(self, prefix=""):
+        """Lists the objects under a prefix
+
+        Args:
+            prefix (str): the prefix, relative to the store
+
+        Returns:
+            [list]: (key, size in bytes) of each object, keys relative to the store
+        """
+
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        skip = len(self._key(""))
+        objects = []
+        for page in paginator.paginate(
+            Bucket=self.bucket, Prefix=self._key(prefix), **self._owner
+        ):
+            objects.extend((o["Key"][skip:], o["Size"]) for o in page.get("Contents", []))
+
+        return objects
+
+    def delete(self, key):
+        self.s3_client.delete_object(Bucket=self.bucket, Key=self._key(key), **self._owner)
+
+    def uri(self, key):
+        return f"s3://{self.bucket}/{self._key(key)}"
+
+
+class LocalObjectStore:
+    """Stores objects as files under a local directory. Meant for tests and local runs"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, body):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write and rename, so that readers never see a partial object
+        with open(path + ".tmp", "wb") as f:
+            f.write(body)
+        os.replace(path + ".tmp", path)
+
+    def list(self, prefix=""):
+        objects = []
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(directory, name)
+                key = os.path.relpath(path, self.root).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    objects.append((key, os.path.getsize(path)))
+
+        return sorted(objects)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def uri(self, key):
+        return f"file://{self._path(key)}"
+
+
+def get_object_store(uri):
+    """Returns the object store for a given uri. Supported schemes are s3://bucket/prefix and
+    file:///local/path
+
+    Args:
+        uri (str): the location of the store
+
+    Returns:
+        the object store
+    """
+
+    parsed = urlparse(uri)
+
+    if parsed.scheme == "s3":
+        return S3ObjectStore(parsed.netloc, parsed.path)
+    if parsed.scheme == "file":
+        return LocalObjectStore(parsed.netloc + parsed.path)
+
+    raise ValueError(f"Unsupported object store uri {uri}")
+
+
+_state_store = None
+
+
+def get_state_store():
+    """Returns the store where the spoke persists its state between invocations,
+    as configured in STATE_STORE_URI. Returns None if no store is configured.
+    """
+
+    global _state_store
+
+    if _state_store is None and os.getenv("STATE_STORE_URI"):
+        _state_store = get_object_store(os.getenv("STATE_STORE_URI"))
+
+    return _state_store
+
+
+def load_json(store, key):
+    """Reads a json object from a store. Missing or corrupted objects are returned as None"""
+
+    if store is None:
+        return None
+
+    body = store.get(key)
+    if body is None:
+        return None
+
+    try:
+        return json.loads(body)
+    except ValueError:
+        logger.warning(f"Ignoring corrupted state object {key}")
+        return None
+
+
+def save_json(store, key, value):
+    """Writes a json object to a store. It does nothing if the store is None"""
+
+    if store is None:
+        return
+
+    store.put(key, json.dumps(value, separators=(",", ":")).encode("utf-8"))
@@ -0,0 +1,231 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import json
+import zlib
+import base64
+import hashlib
+import logging
+import threading
+from decimal import Decimal
+from urllib.parse import urlparse
+from object_store import get_object_store, S3ObjectStore
+
+logging.basicConfig()
+
+logger = logging.getLogger("lambda:payload_codec")
+logger.setLevel(os.getenv("LOGLEVEL", "INFO"))
+
+# version of the encoding of the payloads, stored under this key. Payloads without it
+# (version 1) carry their Metadata as is
+VERSION_FIELD = "PayloadVersion"
+PAYLOAD_VERSION = 2
+
+# the encoded Metadata: compressed, base64 encoded in the events and binary in the items
+COMPRESSED_METADATA = "CompressedMetadata"
+# or the uri of the object holding it (claim check), with its size once compressed
+METADATA_REF = "MetadataRef"
+METADATA_BYTES = "MetadataBytes"
+
+# Metadata larger than this (as json) is compressed
+PAYLOAD_COMPRESS_BYTES = int(os.getenv("PAYLOAD_COMPRESS_BYTES", "1024"))
+# compressed Metadata larger than this is offloaded to the payload store, when there is one
+PAYLOAD_OFFLOAD_BYTES = int(os.getenv("PAYLOAD_OFFLOAD_BYTES", str(32 * 1024)))
+# where the spoke offloads the large Metadata, s3://bucket/prefix or file:///local/path (to
+# try the encoding locally). The hub only reads the objects from the state bucket of the
+# sender (see read_reference): without a store, all the Metadata stays inline
+PAYLOAD_STORE_URI = os.getenv("PAYLOAD_STORE_URI")
+# the spokes offload to their state bucket, named after their account and region (see
+# ds_dashboard/spoke.py): the hub only follows references to the bucket of the sender
+SPOKE_STATE_BUCKET_PREFIX = "ds-dashboard-spoke-state-"
+# in the hub table, Metadata larger than this (as json) is stored compressed
+ITEM_METADATA_MAX_BYTES = int(os.getenv("ITEM_METADATA_MAX_BYTES", "4096"))
+
+
+def _default(value):
+    # the items read from DynamoDB hold Decimals
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return str(value)
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(",", ":"), sort_keys=True, default=_default)
+
+
+def compress(value):
+    """Returns a json serializable value as compressed bytes"""
+
+    return zlib.compress(_dumps(value).encode("utf-8"), 6)
+
+
+def decompress(body):
+    """Reads a value written by compress. Numbers with decimals are read as floats"""
+
+    return json.loads(zlib.decompress(bytes(body)).decode("utf-8"))
+
+
+# the stores, by uri of their folder (and account of the sender, for the references)
+_stores = {}
+_lock = threading.Lock()
+
+
+def _store(uri):
+    with _lock:
+        if uri not in _stores:
+            _stores[uri] = get_object_store(uri)
+        return _stores[uri]
+
+
+def get_payload_store():
+    """Returns the store configured in PAYLOAD_STORE_URI, None if there is none"""
+
+    return _store(PAYLOAD_STORE_URI) if PAYLOAD_STORE_URI else None
+
+
+def offload(store, body):
+    """Writes compressed bytes to a store, under their digest, and returns their uri.
+    Identical Metadata emitted again is written to the same object"""
+
+    key = hashlib.sha256(body).hexdigest() + ".json.zz"
+    store.put(key, body)
+
+    return store.uri(key)
+
+
+def _reference_store(folder, account):
+    """Returns the store of the folder of a reference, which must be in the state bucket
+    of account, and owned by it"""
+
+    parsed = urlparse(folder)
+    if parsed.scheme != "s3":
+        raise ValueError(f"Only s3:// payload references are accepted, got {folder}")
+    if not parsed.netloc.startswith(f"{SPOKE_STATE_BUCKET_PREFIX}{account}-"):
+        raise ValueError(f"The payload reference {folder} is not in the bucket of {account}")
+
+    with _lock:
+        key = (folder, account)
+        if key not in _stores:
+            _stores[key] = S3ObjectStore(parsed.netloc, parsed.path, expected_owner=account)
+        return _stores[key]
+
+
+def read_reference(uri, account):
+    """Returns the compressed bytes a reference points to, checked against their digest.
+    The reference must point to the state bucket of account, the sender of the event
+
+    Args:
+        uri (str): the reference, s3://bucket/prefix/digest.json.zz
+        account (str): the account of the spoke that sent the event
+
+    Returns:
+        [bytes]: the compressed Metadata
+    """
+
+    folder, key = uri.rsplit("/", 1)
+    body = _reference_store(folder, account).get(key)
+
+    if body is None:
+        raise LookupError(f"The payload object {uri} does not exist")
+    if hashlib.sha256(body).hexdigest() != key.split(".", 1)[0]:
+        raise ValueError(f"The payload object {uri} does not match its digest")
+
+    return body
+
+
+def encode_payload(payload, store=None):
+    """Encodes a payload for its event: a Metadata larger than PAYLOAD_COMPRESS_BYTES is
+    compressed, and when compressed it is still larger than PAYLOAD_OFFLOAD_BYTES, it is written
+    to store and only its reference is sent. All the other fields are left as they are, so the
+    rules of the hub can still match them.
+
+    Args:
+        payload (dict): the payload, as built by Metric.extract
+        store: where large Metadata is offloaded, defaults to get_payload_store()
+
+    Returns:
+        [dict]: the encoded payload, with its PayloadVersion
+    """
+
+    encoded = {**payload, VERSION_FIELD: PAYLOAD_VERSION}
+
+    metadata = payload.get("Metadata")
+    if metadata is None or len(_dumps(metadata)) <= PAYLOAD_COMPRESS_BYTES:
+        return encoded
+
+    del encoded["Metadata"]
+    body = compress(metadata)
+    store = store or get_payload_store()
+
+    if len(body) > PAYLOAD_OFFLOAD_BYTES and store is not None:
+        encoded[METADATA_REF] = offload(store, body)
+        encoded[METADATA_BYTES] = len(body)
+    else:
+        encoded[COMPRESSED_METADATA] = base64.b64encode(body).decode("ascii")
+
+    return encoded
+
+
+def decode_payload(payload, account=None):
+    """Decodes a payload written by encode_payload, or by a spoke predating it: the Metadata
+    is decompressed, and read from the state bucket of the spoke if it was offloaded. Raises
+    ValueError if the payload is from a newer version, or if its reference is not allowed
+
+    Args:
+        payload (dict): the detail of the event
+        account (str): the account of the event, needed to follow a reference
+
+    Returns:
+        [dict]: the payload, as built by Metric.extract
+    """
+
+    version = payload.get(VERSION_FIELD, 1)
+    if version > PAYLOAD_VERSION:
+        raise ValueError(f"Unsupported payload version {version}")
+
+    decoded = {
+        k: v
+        for k, v in payload.items()
+        if k not in (VERSION_FIELD, COMPRESSED_METADATA, METADATA_REF, METADATA_BYTES)
+    }
+
+    if COMPRESSED_METADATA in payload:
+        decoded["Metadata"] = decompress(base64.b64decode(payload[COMPRESSED_METADATA]))
+    elif METADATA_REF in payload:
+        if account is None:
+            raise ValueError("A payload reference can only be read knowing its sender")
+        decoded["Metadata"] = decompress(read_reference(payload[METADATA_REF], account))
+
+    return decoded
+
+
+def compact_item(item):
+    """Stores the Metadata of a hub item compressed, in binary, when it is larger than
+    ITEM_METADATA_MAX_BYTES, so that it costs fewer write units. See expand_item"""
+
+    metadata = item.get("Metadata")
+    if metadata is None or len(_dumps(metadata)) <= ITEM_METADATA_MAX_BYTES:
+        return item
+
+    # only the hub needs boto3 here, the spokes import it on first use (see clients.py)
+    from boto3.dynamodb.types import Binary
+
+    compacted = {k: v for k, v in item.items() if k != "Metadata"}
+    compacted[COMPRESSED_METADATA] = Binary(compress(metadata))
+
+    return compacted
+
+
+def expand_item(item):
+    """Returns a hub item with its Metadata as written by compact_item decompressed"""
+
+    if COMPRESSED_METADATA not in item:
+        return item
+
+    expanded = {k: v for k, v in item.items() if k != COMPRESSED_METADATA}
+    value = item[COMPRESSED_METADATA]
+    # DynamoDB returns binary attributes as boto3 Binary objects
+    expanded["Metadata"] = decompress(getattr(value, "value", value))
+
+    return expanded
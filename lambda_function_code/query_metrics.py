@@ -0,0 +1,452 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import json
+import base64
+import datetime
+import time
+import logging
+import threading
+from collections import OrderedDict
+from decimal import Decimal
+import boto3
+from boto3.dynamodb.conditions import Key, Attr
+from table_schema import (
+    SERIES_KEY,
+    TIMESTAMP,
+    METRIC_DAY,
+    PROJECT_INDEX,
+    METRIC_DAY_INDEX,
+    LATEST_METRIC_INDEX,
+    ROLLUP_KEY,
+    BUCKET_START,
+    RESOLUTIONS,
+    SEPARATOR,
+    HEARTBEAT,
+    EMITTED_AT,
+    series_key,
+    rollup_key,
+    to_timestamp,
+    value_status,
+)
+from sketch import merge_all
+from payload_codec import expand_item, COMPRESSED_METADATA
+from instrumentation import log_payload
+
+logging.basicConfig()
+
+logger = logging.getLogger("lambda:query_metrics")
+logger.setLevel(os.getenv("LOGLEVEL", "INFO"))
+
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "256"))
+# cached results are served for at most this long: a late item, older than the newest one of
+# its partition, leaves the marker unchanged (see newest_marker)
+QUERY_CACHE_MAX_AGE_SECONDS = float(os.getenv("QUERY_CACHE_MAX_AGE_SECONDS", "60"))
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = 1000
+# delay tolerated between fetches, on top of the heartbeat of values emitted in change-only mode
+STATUS_GRACE_SECONDS = float(os.getenv("STATUS_GRACE_SECONDS", "900"))
+
+dynamodb = boto3.resource("dynamodb")
+table = dynamodb.Table(os.getenv("DDB_TABLE_NAME", "ds-dashboard-hub-metrics"))
+rollup_table = dynamodb.Table(os.getenv("ROLLUP_TABLE_NAME", "ds-dashboard-hub-rollups"))
+latest_table = dynamodb.Table(os.getenv("LATEST_TABLE_NAME", "ds-dashboard-hub-latest"))
+
+
+class LRUCache:
+    """A least-recently-used cache of query results. Each entry carries a marker of the newest
+    data it was computed from (see newest_marker), and is only served while the marker is unchanged
+    and for at most max_age seconds
+    """
+
+    def __init__(self, maxsize, max_age=QUERY_CACHE_MAX_AGE_SECONDS):
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, newest):
+        with self._lock:
+            entry = self._entries.get(key)
+            if (
+                entry is None
+                or entry[0] != newest
+                or time.monotonic() - entry[2] > self.max_age
+            ):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, newest, value):
+        with self._lock:
+            self._entries[key] = (newest, value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+cache = LRUCache(QUERY_CACHE_SIZE)
+
+
+def to_json_compatible(value):
+    """Converts the Decimals returned by DynamoDB to int or float, recursively"""
+
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, dict):
+        return {k: to_json_compatible(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [to_json_compatible(v) for v in value]
+    return value
+
+
+def with_compressed(attributes):
+    """The large Metadata of the items is stored compressed (see payload_codec.compact_item):
+    projecting Metadata projects it too"""
+
+    if "Metadata" in attributes:
+        return list(attributes) + [COMPRESSED_METADATA]
+    return list(attributes)
+
+
+def encode_token(last_evaluated_key):
+    if last_evaluated_key is None:
+        return None
+    return base64.urlsafe_b64encode(
+        json.dumps(to_json_compatible(last_evaluated_key)).encode("utf-8")
+    ).decode("ascii")
+
+
+def decode_token(token):
+    return json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+
+
+def parse_time(value):
+    """Accepts epoch microseconds or ISO 8601 strings (taken as UTC if naive)"""
+
+    if value is None or isinstance(value, (int, float)):
+        return value
+    return to_timestamp(datetime.datetime.fromisoformat(value))
+
+
+def build_query(query):
+    """Translates a query into the target table and the arguments of a DynamoDB Query.
+    Supported queries, by the fields they set:
+
+    * ProjectName, Environment, MetricName: one time series. With Resolution hour or day,
+      the rollups of the series instead of the raw items. For a multi-region metric, this is
+      its aggregate, and Region selects the series of one region
+    * ProjectName: all the metrics of a project (project-time-index). With MetricName too,
+      only that metric, in all the environments of the project
+    * MetricName and Day (YYYY-MM-DD): all the projects for a metric on a day (metric-day-index)
+
+    On the indexes, multi-region metrics are returned as their aggregates, or with Region as
+    the items of that region only.
+
+    Start and End (epoch microseconds or ISO 8601) restrict the time range, in all cases.
+
+    Args:
+        query (dict): the query
+
+    Returns:
+        [tuple]: the table, extra arguments of the Query (the index), the partition key
+        condition and the name of the sort key
+    """
+
+    resolution = query.get("Resolution", "raw")
+    project = query.get("ProjectName")
+    environment = query.get("Environment")
+    metric = query.get("MetricName")
+
+    if project and environment and metric:
+        series = series_key(project, environment, metric, query.get("Region"))
+        if resolution in RESOLUTIONS:
+            return (
+                rollup_table,
+                {},
+                Key(ROLLUP_KEY).eq(rollup_key(resolution, series)),
+                BUCKET_START,
+            )
+        return table, {}, Key(SERIES_KEY).eq(series), TIMESTAMP
+
+    # the indexes hold the items of each region of a multi-region metric next to its
+    # aggregate: only the aggregates are returned, or the items of the Region queried
+    region = query.get("Region")
+    region_filter = Attr("Region").eq(region) if region else Attr("Region").not_exists()
+
+    if project:
+        extra = {"IndexName": PROJECT_INDEX, "FilterExpression": region_filter}
+        if metric:
+            extra["FilterExpression"] = Attr("MetricName").eq(metric) & region_filter
+        return table, extra, Key("ProjectName").eq(project), TIMESTAMP
+
+    if metric and query.get("Day"):
+        return (
+            table,
+            {"IndexName": METRIC_DAY_INDEX, "FilterExpression": region_filter},
+            Key(METRIC_DAY).eq(f"{metric}{SEPARATOR}{query['Day']}"),
+            TIMESTAMP,
+        )
+
+    raise ValueError(
+        "A query needs ProjectName, Environment and MetricName, or ProjectName, or MetricName and Day"
+    )
+
+
+def newest_marker(target_table, extra, partition_condition, sort_key):
+    """Returns a marker of the newest data in a partition, with a single item read: the newest
+    sort key and, for rollups (which are updated in place), the timestamp of their last value.
+    A raw item emitted again (a heartbeat of a cached value) changes its EmittedTimestamp
+    """
+
+    names = {"#s": sort_key}
+    if target_table is rollup_table:
+        names["#l"] = "LastTimestamp"
+    else:
+        names["#e"] = EMITTED_AT
+
+    # the newest item of the whole partition: a filter would hide it from a Limit=1 query
+    response = target_table.query(
+        KeyConditionExpression=partition_condition,
+        ScanIndexForward=False,
+        Limit=1,
+        ProjectionExpression=", ".join(names),
+        ExpressionAttributeNames=names,
+        **{k: v for k, v in extra.items() if k != "FilterExpression"},
+    )
+
+    if not response["Items"]:
+        return None
+
+    return json.dumps(to_json_compatible(response["Items"][0]), sort_keys=True)
+
+
+def run_query(query):
+    """Runs a query (see build_query), one page at a time. Results are cached and served
+    again as long as no newer item was written to the partition queried, for at most
+    QUERY_CACHE_MAX_AGE_SECONDS
+
+    Args:
+        query (dict): the query. Optional fields: Start, End, Attributes (the list of
+        attributes to return), Limit (the page size), NextToken (from a previous page),
+        Ascending (defaults to True), Latest (only the newest item, with its Status, see
+        table_schema.value_status), Quantiles (see run_quantile_query), View (see
+        run_latest_query)
+
+    Returns:
+        [dict]: Items, and NextToken if there are more pages
+    """
+
+    if query.get("View") == "latest":
+        return run_latest_query(query)
+
+    if query.get("Latest"):
+        query = {**query, "Ascending": False, "Limit": 1}
+        query.pop("NextToken", None)
+        result = run_query({k: v for k, v in query.items() if k != "Latest"})
+        now = to_timestamp(datetime.datetime.now(datetime.timezone.utc))
+        return {
+            "Items": [
+                {**item, "Status": value_status(item, now, STATUS_GRACE_SECONDS)}
+                for item in result["Items"]
+            ]
+        }
+
+    if query.get("Quantiles"):
+        return run_quantile_query(query)
+
+    target_table, extra, partition_condition, sort_key = build_query(query)
+
+    condition = partition_condition
+    start = parse_time(query.get("Start"))
+    end = parse_time(query.get("End"))
+    if start is not None and end is not None:
+        condition = condition & Key(sort_key).between(start, end)
+    elif start is not None:
+        condition = condition & Key(sort_key).gte(start)
+    elif end is not None:
+        condition = condition & Key(sort_key).lte(end)
+
+    cache_key = json.dumps(query, sort_keys=True, default=str)
+    newest = newest_marker(target_table, extra, partition_condition, sort_key)
+
+    cached = cache.get(cache_key, newest)
+    if cached is not None:
+        return cached
+
+    kwargs = {
+        "KeyConditionExpression": condition,
+        "ScanIndexForward": query.get("Ascending", True),
+        "Limit": min(int(query.get("Limit", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE),
+        **extra,
+    }
+
+    if query.get("Attributes"):
+        names = {f"#a{i}": a for i, a in enumerate(with_compressed(query["Attributes"]))}
+        kwargs["ProjectionExpression"] = ", ".join(names)
+        kwargs["ExpressionAttributeNames"] = names
+
+    if query.get("NextToken"):
+        kwargs["ExclusiveStartKey"] = decode_token(query["NextToken"])
+
+    response = target_table.query(**kwargs)
+
+    result = {"Items": to_json_compatible([expand_item(i) for i in response["Items"]])}
+    token = encode_token(response.get("LastEvaluatedKey"))
+    if token:
+        result["NextToken"] = token
+
+    cache.put(cache_key, newest, result)
+
+    return result
+
+
+def run_latest_query(query):
+    """Reads the current value of the metrics in the latest-value table, which holds the newest
+    item of each series (see materialize.update_latest), with a Query: of one project
+    (ProjectName, and optionally Environment), or of one metric in all the projects
+    (MetricName, on the metric-series-index). MetricName also keeps only one metric of a
+    project. The table is never scanned. Each item comes with its Status (see
+    table_schema.value_status)
+
+    Args:
+        query (dict): the query, with View set to latest. Optional fields: ProjectName,
+        Environment, MetricName, Attributes, Limit, NextToken
+
+    Returns:
+        [dict]: Items, and NextToken if there are more pages
+    """
+
+    project = query.get("ProjectName")
+    environment = query.get("Environment")
+    metric = query.get("MetricName")
+
+    if not project and not metric:
+        raise ValueError("A latest query needs ProjectName, or MetricName")
+
+    kwargs = {"Limit": min(int(query.get("Limit", MAX_PAGE_SIZE)), MAX_PAGE_SIZE)}
+
+    if query.get("Attributes"):
+        # the Status needs the timestamps and the heartbeat
+        attributes = list(
+            dict.fromkeys(
+                with_compressed(query["Attributes"]) + [TIMESTAMP, HEARTBEAT, EMITTED_AT]
+            )
+        )
+        names = {f"#a{i}": a for i, a in enumerate(attributes)}
+        kwargs["ProjectionExpression"] = ", ".join(names)
+        kwargs["ExpressionAttributeNames"] = names
+
+    if query.get("NextToken"):
+        kwargs["ExclusiveStartKey"] = decode_token(query["NextToken"])
+
+    if project:
+        condition = Key("ProjectName").eq(project)
+        if environment:
+            prefix = SEPARATOR.join([project, environment, ""])
+            condition = condition & Key(SERIES_KEY).begins_with(prefix)
+        if metric:
+            kwargs["FilterExpression"] = Attr("MetricName").eq(metric)
+    else:
+        condition = Key("MetricName").eq(metric)
+        kwargs["IndexName"] = LATEST_METRIC_INDEX
+        if environment:
+            kwargs["FilterExpression"] = Attr("Environment").eq(environment)
+
+    response = latest_table.query(KeyConditionExpression=condition, **kwargs)
+
+    now = to_timestamp(datetime.datetime.now(datetime.timezone.utc))
+    result = {
+        "Items": [
+            {**item, "Status": value_status(item, now, STATUS_GRACE_SECONDS)}
+            for item in to_json_compatible([expand_item(i) for i in response["Items"]])
+        ]
+    }
+    token = encode_token(response.get("LastEvaluatedKey"))
+    if token:
+        result["NextToken"] = token
+
+    return result
+
+
+def run_quantile_query(query):
+    """Estimates quantiles of a distribution metric, merging the sketches of all the items
+    matched by a query (see build_query): one series over a time range (raw, or from its
+    hourly or daily rollups), a metric in all the environments of a project (ProjectName and
+    MetricName), or a metric in all the projects on a day (MetricName and Day)
+
+    Args:
+        query (dict): the query, with Quantiles, e.g. [0.5, 0.9, 0.99]
+
+    Returns:
+        [dict]: Quantiles (estimate by quantile), Count (the number of observations) and
+        Items (the number of sketches merged)
+    """
+
+    attribute = "Sketch" if query.get("Resolution", "raw") in RESOLUTIONS else "MetricValue"
+
+    page_query = {k: v for k, v in query.items() if k not in ("Quantiles", "NextToken")}
+    page_query.update(Attributes=[attribute], Limit=MAX_PAGE_SIZE)
+
+    merged = None
+    items = 0
+    while True:
+        page = run_query(page_query)
+        values = [i.get(attribute) for i in page["Items"]]
+        items += len(values)
+        sketch = merge_all(values)
+        if sketch is not None:
+            merged = sketch if merged is None else merged.merge(sketch)
+        if "NextToken" not in page:
+            break
+        page_query["NextToken"] = page["NextToken"]
+
+    return {
+        "Quantiles": {
+            str(q): merged.quantile(float(q)) if merged else None
+            for q in query["Quantiles"]
+        },
+        "Count": merged.count if merged else 0,
+        "Items": items,
+    }
+
+
+def lambda_handler(event, context):
+    """Answers time-series queries on the hub tables. The payload is the query, e.g.
+
+    ~~~python
+    {
+        "ProjectName": "Project1",
+        "Environment": "dev",
+        "MetricName": "TotalCompletedTrainingJobs",
+        "Start": "2022-01-01T00:00:00",
+        "Resolution": "day",
+        "Attributes": ["BucketStart", "Max"],
+        "Limit": 100
+    }
+    ~~~
+
+    See build_query and run_query for all the supported fields.
+
+    Args:
+        event (dict): the query
+        context : the context
+
+    Returns:
+        [dict]: Items, and NextToken if there are more pages
+    """
+
+    log_payload(logger, event)
+
+    result = run_query(event)
+
+    logger.info(
+        f"Returning {len(result['Items'])} items, cache: {cache.hits} hits, {cache.misses} misses"
+    )
+
+    return result
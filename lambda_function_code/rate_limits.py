@@ -0,0 +1,215 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import time
+import random
+import threading
+import contextlib
+import logging
+from instrumentation import count
+
+logging.basicConfig()
+
+logger = logging.getLogger("lambda:rate_limits")
+logger.setLevel(os.getenv("LOGLEVEL", "INFO"))
+
+# calls per second allowed to each API (operation), in each region
+API_CALLS_PER_SECOND = float(os.getenv("API_CALLS_PER_SECOND", "10"))
+# overrides, comma separated, by service or operation,
+# e.g. "sagemaker=5,sagemaker.ListTrainingJobs=1"
+API_RATE_LIMITS = os.getenv("API_RATE_LIMITS", "")
+# attempts of a call, throttled or failing with a transient error, before giving up
+API_MAX_ATTEMPTS = int(os.getenv("API_MAX_ATTEMPTS", "8"))
+API_BASE_BACKOFF_SECONDS = float(os.getenv("API_BASE_BACKOFF_SECONDS", "0.1"))
+API_MAX_BACKOFF_SECONDS = float(os.getenv("API_MAX_BACKOFF_SECONDS", "5"))
+
+# a throttled API gets its rate multiplied by this, and it grows back by this share of
+# its configured rate at each success
+THROTTLE_DECREASE = 0.5
+SUCCESS_INCREASE = 0.05
+MIN_CALLS_PER_SECOND = 0.2
+
+THROTTLING_ERRORS = {
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestThrottled",
+    "RequestThrottledException",
+    "TooManyRequestsException",
+    "RequestLimitExceeded",
+    "ProvisionedThroughputExceededException",
+    "SlowDown",
+}
+
+
+class DeadlineExceeded(Exception):
+    """A call was given up, because it could not complete before the deadline of the caller"""
+
+
+# the deadline of the calling thread, see deadline_scope
+_thread = threading.local()
+
+
+def current_deadline():
+    return getattr(_thread, "deadline", None)
+
+
+@contextlib.contextmanager
+def deadline_scope(deadline):
+    """Within it, the API calls of the calling thread that would have to wait (for the rate
+    limit, or to retry) beyond deadline, a time.monotonic() value, are given up"""
+
+    previous = current_deadline()
+    _thread.deadline = deadline
+    try:
+        yield
+    finally:
+        _thread.deadline = previous
+
+
+def check_deadline():
+    """Raises DeadlineExceeded if the deadline of the calling thread has passed. A metric
+    abandoned by retrieve_values, whose thread cannot be stopped, stops at its next API call
+    instead of running into the next invocation"""
+
+    deadline = current_deadline()
+    if deadline is not None and time.monotonic() >= deadline:
+        raise DeadlineExceeded("The deadline of the caller has passed")
+
+
+def configured_rate(service, operation):
+    """Returns the calls per second allowed to an operation, see API_RATE_LIMITS"""
+
+    limits = {}
+    for entry in API_RATE_LIMITS.split(","):
+        if "=" in entry:
+            name, rate = entry.split("=", 1)
+            limits[name.strip().lower()] = float(rate)
+
+    return limits.get(
+        f"{service}.{operation}".lower(), limits.get(service.lower(), API_CALLS_PER_SECOND)
+    )
+
+
+class TokenBucket:
+    """Spaces the calls to one API. Its rate adapts to throttling (AIMD): it is halved when a
+    call is throttled, then grows back slowly with the successes, up to the configured rate.
+    It allows a burst of one second of calls"""
+
+    def __init__(self, rate):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, deadline=None):
+        """Takes a token, waiting for it if needed. Raises DeadlineExceeded rather than
+        waiting beyond deadline"""
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+
+            if deadline is not None and now + wait > deadline:
+                raise DeadlineExceeded("The rate limit allows no call before the deadline")
+            time.sleep(wait)
+
+    def throttled(self):
+        with self._lock:
+            self.rate = max(MIN_CALLS_PER_SECOND, self.rate * THROTTLE_DECREASE)
+            # the calls already waiting are spaced at the new rate
+            self.tokens = min(self.tokens, 0)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * SUCCESS_INCREASE)
+
+
+# the buckets by (service, region, operation), shared by the threads and the warm invocations
+_buckets = {}
+_lock = threading.Lock()
+
+
+def get_bucket(service, region, operation):
+    key = (service, region, operation)
+    with _lock:
+        if key not in _buckets:
+            _buckets[key] = TokenBucket(configured_rate(service, operation))
+        return _buckets[key]
+
+
+def backoff_delay(attempts):
+    """Exponential backoff with full jitter, attempts being the number of attempts made"""
+
+    return random.uniform(
+        0, min(API_MAX_BACKOFF_SECONDS, API_BASE_BACKOFF_SECONDS * 2 ** (attempts - 1))
+    )
+
+
+def _error_code(response):
+    if not response:
+        return None
+    return (response[1] or {}).get("Error", {}).get("Code")
+
+
+def limit_client(client):
+    """Makes a boto3 client wait for the rate limit of each API before each attempt, and retry
+    the calls throttled or failing with transient errors with adaptive backoff and jitter,
+    as long as the deadline of the calling thread (see deadline_scope) allows. The client must
+    be created with botocore's own retries turned off. Returns the client"""
+
+    service = client.meta.service_model.service_name
+    region = client.meta.region_name
+
+    def bucket(event_name):
+        return get_bucket(service, region, event_name.rsplit(".", 1)[-1])
+
+    def before_send(event_name=None, **kwargs):
+        check_deadline()
+        bucket(event_name).acquire(current_deadline())
+
+    def needs_retry(
+        event_name=None, response=None, attempts=1, caught_exception=None, **kwargs
+    ):
+        if isinstance(caught_exception, DeadlineExceeded):
+            return None
+
+        code = _error_code(response)
+        server_error = response is not None and response[0].status_code >= 500
+
+        if code in THROTTLING_ERRORS:
+            bucket(event_name).throttled()
+            count("Throttles")
+        elif caught_exception is None and not server_error:
+            # a success, or an error that retrying would not fix
+            if code is None:
+                bucket(event_name).succeeded()
+            return None
+
+        if attempts >= API_MAX_ATTEMPTS:
+            return None
+
+        delay = backoff_delay(attempts)
+        deadline = current_deadline()
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            logger.warning(f"Giving up {event_name} after {attempts} attempts: out of time")
+            return None
+
+        return delay
+
+    client.meta.events.register("before-send", before_send)
+    client.meta.events.register("needs-retry", needs_retry)
+
+    return client
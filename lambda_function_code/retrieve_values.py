@@ -1,8 +1,27 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
-from metric import *
+from concurrent import futures
+from metric_registry import get_metric_class
+from event_emitter import emit_payloads
+from delta_emission import select_due, record_emitted, state_key
+from value_cache import split_fresh, store_values
+from metric_windows import commit_windows
+from api_cache import request_scope, cache_scope, current_cache
+from rate_limits import deadline_scope
+from payload_codec import encode_payload
+from fetch_selector import (
+    parse_selector,
+    matches,
+    PROJECTS,
+    ENVIRONMENTS,
+    METRIC_NAMES,
+    OLDER_THAN_SECONDS,
+)
+from instrumentation import instrumented, log_payload, count
 import os
+import json
+import time
 import logging
 
 logging.basicConfig()
@@ -10,18 +29,188 @@ logging.basicConfig()
 logger = logging.getLogger("lambda:retrieve_values")
 logger.setLevel(os.getenv("LOGLEVEL", "INFO"))
 
+# size of the worker pool used to compute the metrics
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", "8"))
+# deadline for metrics that do not declare their own _timeout_seconds
+METRIC_TIMEOUT_SECONDS = float(os.getenv("METRIC_TIMEOUT_SECONDS", "30"))
+# time kept aside at the end of the invocation to emit the events
+EMIT_RESERVE_SECONDS = float(os.getenv("EMIT_RESERVE_SECONDS", "5"))
+# budget used when no lambda context is available (e.g. local runs)
+DEFAULT_BUDGET_SECONDS = float(os.getenv("DEFAULT_BUDGET_SECONDS", "55"))
+# regions the metrics are extracted from, comma separated, for the metrics that do not declare
+# their own _regions. Empty means only the region of the lambda
+METRIC_REGIONS = list(
+    dict.fromkeys(r for r in os.getenv("METRIC_REGIONS", "").split(",") if r)
+)
 
+
+def label(metric_instance):
+    """Name of a metric instance in the logs and the response: MetricName@Region"""
+
+    if metric_instance.region is None:
+        return metric_instance.metric_name
+    return f"{metric_instance.metric_name}@{metric_instance.region}"
+
+
+def get_time_budget(context):
+    """Returns how many seconds the extraction can take, keeping EMIT_RESERVE_SECONDS
+    for the emission of the events
+
+    Args:
+        context: the execution context, can be None
+
+    Returns:
+        [float]: the time budget in seconds
+    """
+
+    if context is None:
+        return DEFAULT_BUDGET_SECONDS
+
+    remaining = context.get_remaining_time_in_millis() / 1000.0
+
+    return max(remaining - EMIT_RESERVE_SECONDS, 0)
+
+
+def extract_concurrently(metric_instances, budget_seconds):
+    """Computes the metrics in a bounded pool of workers. Each metric has its own deadline,
+    counted from the moment its computation starts, and no metric can run beyond the overall budget.
+    Metrics that miss their deadline are abandoned, all the others are returned.
+
+    Args:
+        metric_instances (list): the Metric instances to extract
+        budget_seconds (float): the overall time budget
+
+    Returns:
+        [tuple]: the payloads extracted (in the order of metric_instances), the names of the
+        metrics that timed out and the names of the metrics that failed
+    """
+
+    start = time.monotonic()
+    overall_deadline = start + budget_seconds
+    started = {}
+    # the workers share the API cache of the request: a worker abandoned here keeps this one,
+    # never the cache of a later invocation
+    cache = current_cache()
+
+    # by instance: the instances of a multi-region metric share its name
+    def timed_extract(metric_instance):
+        started[metric_instance] = time.monotonic()
+        # API calls that could not complete before the deadline are given up early
+        with cache_scope(cache), deadline_scope(deadline(metric_instance)):
+            return metric_instance.extract()
+
+    def deadline(metric_instance):
+        if metric_instance not in started:
+            return overall_deadline
+
+        timeout = metric_instance._timeout_seconds
+        if timeout is None:
+            timeout = METRIC_TIMEOUT_SECONDS
+
+        return min(started[metric_instance] + timeout, overall_deadline)
+
+    executor = futures.ThreadPoolExecutor(max_workers=EXTRACTION_WORKERS)
+
+    pending = {executor.submit(timed_extract, m): m for m in metric_instances}
+    results = {}
+    timed_out = []
+    failed = []
+
+    while pending:
+        now = time.monotonic()
+
+        for f, m in list(pending.items()):
+            if now >= deadline(m):
+                logger.warning(f"Metric {label(m)} missed its deadline, skipping it")
+                f.cancel()
+                del pending[f]
+                timed_out.append(label(m))
+
+        if not pending:
+            break
+
+        # wake up at the closest deadline, or earlier to notice metrics that just started
+        wait_for = min(deadline(m) for m in pending.values()) - now
+        done, _ = futures.wait(
+            pending, timeout=min(max(wait_for, 0), 1.0), return_when=futures.FIRST_COMPLETED
+        )
+
+        for f in done:
+            m = pending.pop(f)
+            try:
+                results[m] = f.result()
+            except Exception:
+                logger.exception(f"Extraction of metric {label(m)} failed")
+                failed.append(label(m))
+
+    # do not wait for abandoned metrics, their result is discarded. A running thread cannot be
+    # cancelled: it raises DeadlineExceeded at its next API call (see rate_limits.check_deadline)
+    executor.shutdown(wait=False)
+
+    payloads = [results[m] for m in metric_instances if m in results]
+
+    return payloads, timed_out, failed
+
+
+def aggregate_regions(metric_instances, payloads):
+    """Builds the aggregated value of each multi-region metric, from the values of its regions
+    (see Metric.aggregate). A metric missing the value of one of its regions (it timed out or
+    failed) gets no aggregate, rather than a partial one.
+
+    Args:
+        metric_instances (list): the Metric instances, one per metric and region
+        payloads (list): the payloads of the instances, computed or reused
+
+    Returns:
+        [list]: the aggregated payloads, without Region and with the newest timestamp of the
+        regions, so that an aggregate of reused values is identical to the previous one
+    """
+
+    regions = {}
+    classes = {}
+    for m in metric_instances:
+        if m.region is not None:
+            regions.setdefault(m.metric_name, set()).add(m.region)
+            classes[m.metric_name] = type(m)
+
+    by_metric = {}
+    for p in payloads:
+        if p.get("Region") is not None:
+            by_metric.setdefault(p["MetricName"], []).append(p)
+
+    aggregated = []
+    for metric_name, expected in regions.items():
+        region_payloads = by_metric.get(metric_name, [])
+        if {p["Region"] for p in region_payloads} != expected:
+            logger.warning(f"Metric {metric_name} is missing regions, not aggregating it")
+            continue
+
+        value = classes[metric_name].aggregate([p["MetricValue"] for p in region_payloads])
+        if value is None:
+            continue
+
+        newest = max(region_payloads, key=lambda p: p["ExtractionTimestamp"])
+        aggregate = {k: v for k, v in newest.items() if k != "Region"}
+        aggregate["MetricValue"] = value
+        aggregate["Metadata"] = {"Regions": sorted(expected)}
+        aggregated.append(aggregate)
+
+    return aggregated
+
+
+@instrumented("retrieve_values")
 def lambda_handler(event, context):
-    """This loops on the metrics defined and calculates their values
+    """This computes the values of the metrics defined, concurrently, and emits them in batches
     It requires PROJECT_NAME and ENVIRONMENT (dev/preprod/prod) in the environment
 
     Args:
-        event (dict): the payload. not used
+        event (dict): the fetch request. Its selector (see fetch_selector) restricts the
+        metrics computed: only the MetricNames listed, only if Projects and Environments
+        list this spoke, and only the values older than OlderThanSeconds
         context: the execution context
     """
 
-    logger.info("Starting execution with payload:")
-    logger.info(json.dumps(event))
+    log_payload(logger, event)
 
     project_name = os.getenv("PROJECT_NAME")
     environment = os.getenv("ENVIRONMENT")
@@ -30,11 +219,19 @@ def lambda_handler(event, context):
     if metrics is None:
         return
 
-    metrics = metrics.split(",")
+    # the rule of the spoke already filters the requests, this also covers direct invocations
+    selector = parse_selector(event.get("detail") or {})
+    if not (
+        matches(selector, PROJECTS, project_name)
+        and matches(selector, ENVIRONMENTS, environment)
+    ):
+        logger.info(f"The request is not for this spoke: {selector}")
+        return {"emitted": 0, "selector": selector}
 
-    for m in metrics:
+    metrics = [m for m in metrics.split(",") if matches(selector, METRIC_NAMES, m)]
 
-        logger.info(f"Extracting value for metric {m}")
+    metric_instances = []
+    for m in metrics:
 
         args = {
             "project_name": project_name,
@@ -43,10 +240,60 @@ def lambda_handler(event, context):
             "environment": environment,
         }
 
-        metric_class = eval(f"{m}")
+        metric_class = get_metric_class(m)
+
+        # multi-region metrics get one instance per region, all extracted concurrently
+        for region in metric_class._regions or METRIC_REGIONS or [None]:
+            metric_instances.append(metric_class(**args, region=region))
+
+    logger.info(f"Extracting values for metrics {metrics}")
+
+    # metrics whose last value is younger than their _ttl_seconds (or the OlderThanSeconds of
+    # the request) are not computed again
+    fresh, stale = split_fresh(
+        metric_instances, max_age_seconds=selector.get(OLDER_THAN_SECONDS)
+    )
+    if fresh:
+        logger.info(f"Reusing the fresh values of {[p['MetricName'] for p in fresh]}")
+
+    # metrics calling the same APIs share the results within this invocation
+    with request_scope():
+        payloads, timed_out, failed = extract_concurrently(
+            stale, get_time_budget(context)
+        )
+
+    store_values(stale, payloads)
+    payloads = fresh + payloads
+    # the aggregates of the multi-region metrics are emitted in the same batch
+    payloads = payloads + aggregate_regions(metric_instances, payloads)
+
+    # in change-only mode, values identical to the last ones emitted are left out
+    payloads, unchanged = select_due(payloads)
+
+    # large Metadata is compressed, or offloaded to the payload store
+    encoded = [encode_payload(p) for p in payloads]
+
+    for p in encoded:
+        count("PayloadBytes", len(json.dumps(p)), metric_name=p["MetricName"])
+
+    dropped = emit_payloads(encoded)
 
-        metric_instance = metric_class(**args)
+    if dropped:
+        names = [d["MetricName"] for d in dropped]
+        logger.error(f"{len(dropped)} metric values could not be emitted: {names}")
 
-        metric_value = metric_instance.extract()
+    # dropped values stay due, and are emitted again at the next fetch
+    dropped_keys = {state_key(d) for d in dropped}
+    emitted = [p for p in payloads if state_key(p) not in dropped_keys]
+    record_emitted(emitted)
+    # the next windows of the distribution metrics start at the end of the ones emitted
+    commit_windows(emitted)
 
-        metric_instance.emit_event(metric_value)
+    return {
+        "emitted": len(payloads) - len(dropped),
+        "reused": [p["MetricName"] for p in fresh],
+        "unchanged": [u["MetricName"] for u in unchanged],
+        "dropped": [d["MetricName"] for d in dropped],
+        "timed_out": timed_out,
+        "failed": failed,
+    }
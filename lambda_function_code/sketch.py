@@ -0,0 +1,161 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import math
+
+# version of the serialized format, stored under this key: a MetricValue holding it is a sketch
+SKETCH_FORMAT = "Sketch"
+FORMAT_VERSION = 1
+
+# with these, values across 17 orders of magnitude fit in the bins, and a sketch never
+# takes more than a few KB
+DEFAULT_RELATIVE_ACCURACY = 0.02
+DEFAULT_MAX_BINS = 1024
+# values below this are counted as zeros
+MIN_VALUE = 1e-9
+
+
+def is_sketch(value):
+    return isinstance(value, dict) and SKETCH_FORMAT in value
+
+
+class QuantileSketch:
+    """A mergeable quantile sketch of non-negative values, with logarithmic bins (as DDSketch):
+    any quantile is estimated within relative_accuracy of a value of the data, and merging the
+    sketches of two data sets gives the sketch of their union. It holds at most max_bins bins,
+    whatever the number of values: past that, the lowest bins are folded together, which only
+    degrades the lowest quantiles.
+    """
+
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY, max_bins=DEFAULT_MAX_BINS):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zeros = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        return int(math.ceil(math.log(value) / self._log_gamma))
+
+    def _value(self, index):
+        return 2 * self.gamma**index / (self.gamma + 1)
+
+    def add(self, value, count=1):
+        value = float(value)
+        if value < 0:
+            raise ValueError(f"Quantile sketches only hold non-negative values, got {value}")
+
+        if value < MIN_VALUE:
+            self.zeros += count
+        else:
+            index = self._index(value)
+            self.bins[index] = self.bins.get(index, 0) + count
+            self._collapse()
+
+        self.count += count
+        self.sum += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def _collapse(self):
+        if len(self.bins) <= self.max_bins:
+            return
+
+        indexes = sorted(self.bins)
+        folded = indexes[: len(indexes) - self.max_bins + 1]
+        target = folded[-1]
+        self.bins[target] = sum(self.bins.pop(i) for i in folded[:-1]) + self.bins[target]
+
+    def merge(self, other):
+        """Adds the values of another sketch, with the same relative accuracy"""
+
+        if not math.isclose(other.relative_accuracy, self.relative_accuracy):
+            raise ValueError("Only sketches with the same relative accuracy can be merged")
+
+        for index, c in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + c
+        self._collapse()
+
+        self.zeros += other.zeros
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+        return self
+
+    def quantile(self, q):
+        """Returns the estimate of the q-quantile (0 <= q <= 1), None if the sketch is empty"""
+
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        if rank < self.zeros:
+            return 0.0
+
+        seen = self.zeros
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return min(max(self._value(index), self.min), self.max)
+
+        return self.max
+
+    def to_dict(self):
+        """Returns the sketch in a compact, json serializable form. The bins are stored as the
+        counts of consecutive indexes, starting at BinOffset"""
+
+        offset = min(self.bins) if self.bins else 0
+        counts = [0] * (max(self.bins) - offset + 1 if self.bins else 0)
+        for index, c in self.bins.items():
+            counts[index - offset] = c
+
+        return {
+            SKETCH_FORMAT: FORMAT_VERSION,
+            "RelativeAccuracy": self.relative_accuracy,
+            "MaxBins": self.max_bins,
+            "Count": self.count,
+            "Zeros": self.zeros,
+            "Sum": self.sum,
+            "Min": self.min,
+            "Max": self.max,
+            "BinOffset": offset,
+            "BinCounts": counts,
+        }
+
+    @classmethod
+    def from_dict(cls, value):
+        """Reads a sketch written by to_dict. Numbers can be Decimals, as read from DynamoDB"""
+
+        sketch = cls(float(value["RelativeAccuracy"]), int(value["MaxBins"]))
+        offset = int(value["BinOffset"])
+        sketch.bins = {
+            offset + i: int(c) for i, c in enumerate(value["BinCounts"]) if c
+        }
+        sketch.zeros = int(value["Zeros"])
+        sketch.count = int(value["Count"])
+        sketch.sum = float(value["Sum"])
+        sketch.min = None if value.get("Min") is None else float(value["Min"])
+        sketch.max = None if value.get("Max") is None else float(value["Max"])
+
+        return sketch
+
+
+def merge_all(values):
+    """Merges the sketches among values (serialized), returns None if there are none"""
+
+    merged = None
+    for v in values:
+        if not is_sketch(v):
+            continue
+        sketch = QuantileSketch.from_dict(v)
+        merged = sketch if merged is None else merged.merge(sketch)
+
+    return merged
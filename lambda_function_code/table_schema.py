@@ -0,0 +1,156 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import datetime
+
+# partition key of the hub table: ProjectName#Environment#MetricName, followed by #Region for
+# the per-region values of multi-region metrics
+SERIES_KEY = "SeriesKey"
+# sort key of the hub table: UTC epoch of the extraction, in microseconds
+TIMESTAMP = "ExtractionTimestamp"
+# partition key of the index answering "all projects for a metric on a given day": MetricName#YYYY-MM-DD
+METRIC_DAY = "MetricDay"
+
+# "all metrics for a project in a time range": ProjectName / ExtractionTimestamp
+PROJECT_INDEX = "project-time-index"
+# "all projects for a metric on a given day": MetricDay / ExtractionTimestamp
+METRIC_DAY_INDEX = "metric-day-index"
+
+# the latest-value table holds the newest item of each time series, keyed by
+# ProjectName / SeriesKey
+# "the current value of a metric in all the projects": MetricName / SeriesKey
+LATEST_METRIC_INDEX = "metric-series-index"
+
+# TTL attribute of the hub tables, epoch seconds
+EXPIRES_AT = "ExpiresAt"
+
+# keys of the rollup table: Resolution#SeriesKey / start of the bucket (same unit as TIMESTAMP)
+ROLLUP_KEY = "RollupKey"
+BUCKET_START = "BucketStart"
+
+# widths of the rollup buckets, in the unit of TIMESTAMP
+RESOLUTIONS = {"hour": 3600 * 10**6, "day": 24 * 3600 * 10**6}
+
+# the interval, in seconds, after which a spoke in change-only mode emits an unchanged value again
+HEARTBEAT = "HeartbeatSeconds"
+# when a spoke in change-only mode emitted the value, in the unit of TIMESTAMP: a value reused
+# from its cache (see value_cache) is emitted again with its original timestamp
+EMITTED_AT = "EmittedTimestamp"
+
+SEPARATOR = "#"
+
+# format of ExtractionDate in the payloads emitted by the spokes (UTC)
+EXTRACTION_DATE_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def series_key(project_name, environment, metric_name, region=None):
+    """Returns the partition key of a time series. region is only set for the per-region
+    values of multi-region metrics, their aggregate has none"""
+
+    parts = [str(project_name), str(environment), str(metric_name)]
+    if region is not None:
+        parts.append(str(region))
+
+    return SEPARATOR.join(parts)
+
+
+def metric_day(metric_name, timestamp):
+    """Returns the key of the metric-day index for a metric, on the day of a timestamp"""
+
+    day = datetime.datetime.fromtimestamp(
+        int(timestamp) / 1e6, tz=datetime.timezone.utc
+    ).strftime("%Y-%m-%d")
+
+    return f"{metric_name}{SEPARATOR}{day}"
+
+
+def to_timestamp(dt):
+    """Converts a datetime to the sort key format. Naive datetimes are taken as UTC"""
+
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+
+    return int(round(dt.timestamp() * 1e6))
+
+
+def extraction_timestamp(payload):
+    """Returns the timestamp of a payload. Spokes deployed before the timestamp was added
+    only send ExtractionDate, which is parsed (as UTC, the timezone of the lambdas).
+    """
+
+    if payload.get(TIMESTAMP) is not None:
+        return int(payload[TIMESTAMP])
+
+    return to_timestamp(
+        datetime.datetime.strptime(payload["ExtractionDate"], EXTRACTION_DATE_FORMAT)
+    )
+
+
+def add_keys(payload):
+    """Adds to a payload the key attributes of the hub table and of its indexes
+
+    Args:
+        payload (dict): the payload, as emitted by the spoke
+
+    Returns:
+        [dict]: the item to write
+    """
+
+    item = dict(payload)
+    item[TIMESTAMP] = extraction_timestamp(payload)
+    item[SERIES_KEY] = series_key(
+        payload["ProjectName"],
+        payload["Environment"],
+        payload["MetricName"],
+        payload.get("Region"),
+    )
+    item[METRIC_DAY] = metric_day(payload["MetricName"], item[TIMESTAMP])
+
+    return item
+
+
+def expires_at(timestamp, retention_days):
+    """Returns the TTL of an item, retention_days after timestamp. None if retention_days is 0"""
+
+    if not retention_days:
+        return None
+
+    return int(timestamp) // 10**6 + int(retention_days) * 24 * 3600
+
+
+def rollup_key(resolution, series):
+    """Returns the partition key of the rollups of a series at a resolution (hour or day)"""
+
+    return f"{resolution}{SEPARATOR}{series}"
+
+
+def bucket_start(timestamp, resolution):
+    """Returns the start of the rollup bucket containing timestamp"""
+
+    width = RESOLUTIONS[resolution]
+
+    return int(timestamp) - int(timestamp) % width
+
+
+def value_status(item, now, grace_seconds=0):
+    """Tells whether the newest item of a series still holds the current value. Spokes in
+    change-only mode emit a value again at least every HeartbeatSeconds, even if unchanged:
+    if none came since, the value is missing rather than unchanged. The age of the value is
+    counted from its last emission, which is later than its extraction for a cached value.
+
+    Args:
+        item (dict): the newest item of the series
+        now (int): the current time, in the unit of TIMESTAMP
+        grace_seconds (float): tolerance for the delay between fetches
+
+    Returns:
+        [str]: current or missing. None for items emitted without a heartbeat
+    """
+
+    heartbeat = item.get(HEARTBEAT)
+    if heartbeat is None:
+        return None
+
+    age_seconds = (int(now) - int(item.get(EMITTED_AT, item[TIMESTAMP]))) / 1e6
+
+    return "current" if age_seconds <= float(heartbeat) + grace_seconds else "missing"
@@ -0,0 +1,187 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import time
+import datetime
+import threading
+import logging
+from object_store import get_state_store, load_json, save_json
+from clients import current_region
+
+logging.basicConfig()
+
+logger = logging.getLogger("lambda:training_job_index")
+logger.setLevel(os.getenv("LOGLEVEL", "INFO"))
+
+# key of the index in the state store. the indexes of other regions than the one of the lambda
+# are stored as training_job_index.<region>.json
+INDEX_KEY = "training_job_index.json"
+# jobs modified this long before the watermark are listed again, to cope with eventual consistency
+JOB_INDEX_OVERLAP_SECONDS = float(os.getenv("JOB_INDEX_OVERLAP_SECONDS", "300"))
+# an index synced more recently than this is used as it is
+JOB_INDEX_MAX_AGE_SECONDS = float(os.getenv("JOB_INDEX_MAX_AGE_SECONDS", "10"))
+
+# positions of the fields in the compact representation of a job
+STATUS, LAST_MODIFIED, CREATION, END = range(4)
+FIELDS = {"LastModifiedTime": LAST_MODIFIED, "CreationTime": CREATION, "TrainingEndTime": END}
+
+
+def _epoch(value):
+    return value.timestamp() if value is not None else None
+
+
+class TrainingJobIndex:
+    """An index of all the SageMaker training jobs of the account. It is updated incrementally,
+    listing only the jobs modified after the newest modification already seen (the watermark),
+    so the cost of a refresh grows with the number of new jobs, not with the whole history.
+
+    Each job is stored as [status, last modified, creation, end] with times in epoch seconds
+    """
+
+    def __init__(self, jobs=None, watermark=None):
+        self.jobs = jobs or {}
+        self.watermark = watermark
+        self.synced_at = None
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(jobs=d.get("jobs", {}), watermark=d.get("watermark"))
+
+    def to_dict(self):
+        return {"version": 1, "watermark": self.watermark, "jobs": self.jobs}
+
+    def update(self, sagemaker_client):
+        """Lists the jobs modified since the watermark and merges them in the index. The index
+        only changes once the listing is complete: the listing is newest first, so a listing
+        interrupted part way (e.g. by the deadline) must not move the watermark past the jobs
+        of the pages not read
+
+        Args:
+            sagemaker_client: the SageMaker client to use
+
+        Returns:
+            [int]: the number of jobs added or changed
+        """
+
+        kwargs = {}
+        if self.watermark is not None:
+            kwargs["LastModifiedTimeAfter"] = datetime.datetime.fromtimestamp(
+                self.watermark - JOB_INDEX_OVERLAP_SECONDS, tz=datetime.timezone.utc
+            )
+
+        listed = {}
+        watermark = self.watermark
+        paginator = sagemaker_client.get_paginator("list_training_jobs")
+
+        for page in paginator.paginate(**kwargs):
+            for summary in page["TrainingJobSummaries"]:
+                job = [
+                    summary["TrainingJobStatus"],
+                    _epoch(summary.get("LastModifiedTime")),
+                    _epoch(summary.get("CreationTime")),
+                    _epoch(summary.get("TrainingEndTime")),
+                ]
+                if self.jobs.get(summary["TrainingJobName"]) != job:
+                    listed[summary["TrainingJobName"]] = job
+
+                if job[LAST_MODIFIED] is not None and (
+                    watermark is None or job[LAST_MODIFIED] > watermark
+                ):
+                    watermark = job[LAST_MODIFIED]
+
+        # a new dict, as jobs_with may be iterating over the current one
+        self.jobs = {**self.jobs, **listed}
+        self.watermark = watermark
+        self.synced_at = time.time()
+
+        return len(listed)
+
+    def jobs_with(self, status=None, after=None, before=None, field="LastModifiedTime"):
+        """Yields the jobs with a given status, and with field within a time window
+
+        Args:
+            status (str): the status of the jobs, e.g. Completed. None means any status
+            after (datetime): only jobs with field strictly after this time
+            before (datetime): only jobs with field strictly before this time
+            field (str): the time field for the window: LastModifiedTime, CreationTime or TrainingEndTime
+
+        Returns:
+            [generator]: pairs of job name and compact job
+        """
+
+        position = FIELDS[field]
+        after = _epoch(after)
+        before = _epoch(before)
+
+        # a snapshot: a refresh may update the index meanwhile, e.g. from the thread of a
+        # metric abandoned by a previous invocation
+        for name, job in list(self.jobs.items()):
+            if status is not None and job[STATUS] != status:
+                continue
+            if after is not None and (job[position] is None or job[position] <= after):
+                continue
+            if before is not None and (job[position] is None or job[position] >= before):
+                continue
+            yield name, job
+
+    def count(self, status=None, after=None, before=None, field="LastModifiedTime"):
+        """Counts the jobs with a given status, and with field within a time window.
+        See jobs_with for the arguments"""
+
+        return sum(1 for _ in self.jobs_with(status, after, before, field))
+
+
+# the indexes by region (None for the region of the lambda), each refreshed under its own lock
+# so that the regions are refreshed concurrently
+_indexes = {}
+_index_locks = {}
+_lock = threading.Lock()
+
+
+def index_key(region_name):
+    if region_name is None:
+        return INDEX_KEY
+    return INDEX_KEY.replace(".json", f".{region_name}.json")
+
+
+def get_training_job_index(sagemaker_client):
+    """Returns the training job index of the region the calling thread works on (see
+    clients.region_scope), up to date. The index is kept in memory while the container stays
+    warm, and persisted in the state store between invocations. Concurrent callers share a
+    single refresh.
+
+    Args:
+        sagemaker_client: the SageMaker client to use for the refresh
+
+    Returns:
+        [TrainingJobIndex]: the index
+    """
+
+    region_name = current_region()
+
+    with _lock:
+        index_lock = _index_locks.setdefault(region_name, threading.Lock())
+
+    with index_lock:
+
+        index = _indexes.get(region_name)
+        if index is None:
+            stored = load_json(get_state_store(), index_key(region_name))
+            index = TrainingJobIndex.from_dict(stored) if stored else TrainingJobIndex()
+            _indexes[region_name] = index
+            logger.info(f"Loaded training job index with {len(index.jobs)} jobs")
+
+        if (
+            index.synced_at is not None
+            and time.time() - index.synced_at < JOB_INDEX_MAX_AGE_SECONDS
+        ):
+            return index
+
+        changed = index.update(sagemaker_client)
+        logger.info(f"Training job index refreshed, {changed} jobs added or changed")
+
+        if changed:
+            save_json(get_state_store(), index_key(region_name), index.to_dict())
+
+        return index
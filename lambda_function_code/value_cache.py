@@ -0,0 +1,105 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import time
+import threading
+import logging
+from object_store import get_state_store, load_json, save_json
+
+logging.basicConfig()
+
+logger = logging.getLogger("lambda:value_cache")
+logger.setLevel(os.getenv("LOGLEVEL", "INFO"))
+
+STATE_KEY = "metric_values.json"
+
+_values = None
+_values_lock = threading.Lock()
+
+
+def value_key(project_name, environment, metric_name, region=None):
+    parts = [str(project_name), str(environment), str(metric_name)]
+    if region is not None:
+        parts.append(str(region))
+
+    return "#".join(parts)
+
+
+def instance_key(metric_instance):
+    return value_key(
+        metric_instance.project_name,
+        metric_instance.environment,
+        metric_instance.metric_name,
+        metric_instance.region,
+    )
+
+
+def payload_key(payload):
+    return value_key(
+        payload["ProjectName"],
+        payload["Environment"],
+        payload["MetricName"],
+        payload.get("Region"),
+    )
+
+
+def _get_values():
+    """Returns the cached payloads, loaded from the state store when the container is cold"""
+
+    global _values
+
+    if _values is None:
+        _values = load_json(get_state_store(), STATE_KEY) or {}
+
+    return _values
+
+
+def split_fresh(metric_instances, now=None, max_age_seconds=None):
+    """Separates the metrics whose last value is still fresh, i.e. younger than the
+    _ttl_seconds they declare, from the ones to compute
+
+    Args:
+        metric_instances (list): the Metric instances to extract
+        now (float): the current epoch time, in seconds
+        max_age_seconds (float): when set, replaces the _ttl_seconds of all the metrics,
+        e.g. the OlderThanSeconds of a fetch request. 0 computes them all
+
+    Returns:
+        [tuple]: the cached payloads of the fresh metrics (with their original
+        ExtractionTimestamp) and the metric instances to compute
+    """
+
+    now = time.time() if now is None else now
+
+    with _values_lock:
+        values = _get_values()
+
+    fresh = []
+    stale = []
+    for m in metric_instances:
+        ttl = m._ttl_seconds if max_age_seconds is None else max_age_seconds
+        cached = values.get(instance_key(m)) if ttl else None
+        if cached is not None and now - cached["ExtractionTimestamp"] / 1e6 < ttl:
+            fresh.append(cached)
+        else:
+            stale.append(m)
+
+    return fresh, stale
+
+
+def store_values(metric_instances, payloads):
+    """Caches the payloads just computed, with their ExtractionTimestamp, and persists them.
+    All of them are kept, whether or not their metric declares a _ttl_seconds: a fetch
+    request with OlderThanSeconds can reuse any of them (see split_fresh)"""
+
+    keys = {instance_key(m) for m in metric_instances}
+    computed = {payload_key(p): p for p in payloads if payload_key(p) in keys}
+    if not computed:
+        return
+
+    with _values_lock:
+        values = _get_values()
+        values.update(computed)
+        save_json(get_state_store(), STATE_KEY, values)
+
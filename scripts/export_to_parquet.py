@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""Runs the incremental Parquet export of the hub table (see lambda_function_code/export_parquet.py)
+from a workstation. The output can be a local folder, and the table can be served by DynamoDB
+Local, to try the export without touching the deployed resources. It needs the packages of
+requirements-export.txt.
+
+Example:
+
+    pip install -r requirements-export.txt
+    python3 scripts/export_to_parquet.py \\
+        --table ds-dashboard-hub-metrics \\
+        --output file:///tmp/ds-dashboard-export \\
+        --endpoint-url http://localhost:8000
+"""
+
+import os
+import sys
+import json
+import argparse
+import logging
+
+import boto3
+
+# the lambda code imports its modules as top-level ones, as in the lambda runtime
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "lambda_function_code",
+    )
+)
+
+from object_store import get_object_store
+import export_parquet
+
+logging.basicConfig()
+
+logger = logging.getLogger("script:export_to_parquet")
+logger.setLevel(os.getenv("LOGLEVEL", "INFO"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--table", default="ds-dashboard-hub-metrics")
+    parser.add_argument(
+        "--output", required=True, help="s3://bucket/prefix or file:///local/path"
+    )
+    parser.add_argument(
+        "--latest-table", help="the latest-value table, to discover the projects cheaply"
+    )
+    parser.add_argument("--endpoint-url", help="e.g. the address of DynamoDB Local")
+    args = parser.parse_args()
+
+    dynamodb = boto3.resource("dynamodb", endpoint_url=args.endpoint_url)
+    source = dynamodb.Table(args.table)
+    latest = dynamodb.Table(args.latest_table) if args.latest_table else None
+
+    result = export_parquet.run_export(
+        source, get_object_store(args.output), latest_table=latest
+    )
+
+    logger.info(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""Copies the items of the hub table written by the first version of this solution
+(MetricName / ExtractionDate keys) to the current hub table, adding the new key attributes.
+The source table is read with a parallel Scan, each segment written by its own worker.
+
+The copy is idempotent: it can be interrupted and run again.
+
+Example:
+
+    python3 scripts/migrate_table.py \\
+        --source ds-dashboard-hub-table \\
+        --target ds-dashboard-hub-metrics \\
+        --segments 8
+"""
+
+import os
+import sys
+import argparse
+import logging
+from concurrent import futures
+
+import boto3
+
+# the lambda code imports its modules as top-level ones, as in the lambda runtime
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "lambda_function_code",
+    )
+)
+
+from table_schema import add_keys, SERIES_KEY, TIMESTAMP
+
+logging.basicConfig()
+
+logger = logging.getLogger("script:migrate_table")
+logger.setLevel(os.getenv("LOGLEVEL", "INFO"))
+
+
+def migrate_segment(source, target, segment, total_segments, dry_run=False):
+    """Copies one segment of the source table to the target table
+
+    Args:
+        source: the source Table
+        target: the target Table
+        segment (int): the segment to copy
+        total_segments (int): the number of segments of the scan
+        dry_run (bool): if True, items are converted but not written
+
+    Returns:
+        [tuple]: the number of items copied and the number of items skipped
+    """
+
+    copied = 0
+    skipped = 0
+    kwargs = {"Segment": segment, "TotalSegments": total_segments}
+
+    with target.batch_writer(overwrite_by_pkeys=[SERIES_KEY, TIMESTAMP]) as writer:
+        while True:
+            page = source.scan(**kwargs)
+
+            for item in page["Items"]:
+                try:
+                    new_item = add_keys(item)
+                except (KeyError, ValueError) as e:
+                    logger.warning(
+                        f"Skipping item {item.get('MetricName')}/{item.get('ExtractionDate')}: {e}"
+                    )
+                    skipped += 1
+                    continue
+
+                if not dry_run:
+                    writer.put_item(Item=new_item)
+                copied += 1
+
+            if "LastEvaluatedKey" not in page:
+                break
+            kwargs["ExclusiveStartKey"] = page["LastEvaluatedKey"]
+
+    logger.info(f"Segment {segment}: {copied} items copied, {skipped} skipped")
+
+    return copied, skipped
+
+
+def migrate(source_name, target_name, total_segments, dry_run=False):
+    """Copies all the items of the source table to the target table, in parallel"""
+
+    dynamodb = boto3.resource("dynamodb")
+
+    # resources are not thread safe: each worker gets its own
+    def worker(segment):
+        session = boto3.session.Session()
+        resource = session.resource(
+            "dynamodb", region_name=dynamodb.meta.client.meta.region_name
+        )
+        return migrate_segment(
+            resource.Table(source_name),
+            resource.Table(target_name),
+            segment,
+            total_segments,
+            dry_run,
+        )
+
+    with futures.ThreadPoolExecutor(max_workers=total_segments) as executor:
+        results = list(executor.map(worker, range(total_segments)))
+
+    copied = sum(r[0] for r in results)
+    skipped = sum(r[1] for r in results)
+
+    logger.info(f"Migration done: {copied} items copied, {skipped} skipped")
+
+    return copied, skipped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--source", default="ds-dashboard-hub-table")
+    parser.add_argument("--target", default="ds-dashboard-hub-metrics")
+    parser.add_argument("--segments", type=int, default=8)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    migrate(args.source, args.target, args.segments, args.dry_run)
@@ -0,0 +1,55 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""Fixtures of the tests: the lambda code runs in process, against the stand-ins of the AWS
+clients of benchmarks/fakes.py"""
+
+import os
+import sys
+
+# the clients are created at import time: they need a region, never credentials
+os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "test")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "test")
+os.environ.setdefault("METRICS_ENABLED", "false")
+os.environ.setdefault("DDB_TABLE_NAME", "ds-dashboard-hub-metrics")
+os.environ.pop("STATE_STORE_URI", None)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the stack helpers that do not need CDK (e.g. ds_dashboard.iam_policy)
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "lambda_function_code"))
+sys.path.append(os.path.join(ROOT, "benchmarks"))
+
+import pytest
+import metric
+import clients
+import event_emitter
+import value_cache
+import delta_emission
+import training_job_index
+from api_cache import CachedClient
+from fakes import FakeSageMaker, FakeSSM, FakeEvents
+
+
+@pytest.fixture
+def spoke(monkeypatch):
+    """A spoke with an empty state, whose clients are stand-ins. Returns the stand-ins"""
+
+    fakes = {
+        "sagemaker": FakeSageMaker(n_jobs=50, n_endpoints=3),
+        "ssm": FakeSSM(),
+        "events": FakeEvents(),
+    }
+
+    monkeypatch.setattr(metric, "sagemaker_client", CachedClient(fakes["sagemaker"]))
+    monkeypatch.setattr(metric, "ssm_client", CachedClient(fakes["ssm"]))
+    monkeypatch.setattr(event_emitter, "events_client", fakes["events"])
+    monkeypatch.setattr(value_cache, "_values", {})
+    monkeypatch.setattr(delta_emission, "_state", delta_emission.EmissionState())
+    monkeypatch.setattr(training_job_index, "_indexes", {})
+    monkeypatch.setattr(clients, "_clients", {})
+    monkeypatch.setenv("PROJECT_NAME", "TestProject")
+    monkeypatch.setenv("ENVIRONMENT", "test")
+
+    return fakes
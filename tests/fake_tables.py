@@ -0,0 +1,131 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""Stand-ins of a DynamoDB table: Query and Scan, evaluating the boto3 condition objects of
+the key condition and the filter, and for the write paths GetItem and conditional PutItem"""
+
+import operator
+from types import SimpleNamespace
+from boto3.dynamodb.conditions import AttributeBase
+
+
+def _value(operand, item):
+    return item.get(operand.name) if isinstance(operand, AttributeBase) else operand
+
+
+def evaluate(condition, item):
+    """Evaluates a boto3 condition (Key or Attr) on an item"""
+
+    name = type(condition).__name__
+    values = condition.get_expression()["values"]
+
+    if name == "And":
+        return all(evaluate(v, item) for v in values)
+    if name == "Or":
+        return any(evaluate(v, item) for v in values)
+    if name == "Not":
+        return not evaluate(values[0], item)
+    if name == "AttributeExists":
+        return values[0].name in item
+    if name == "AttributeNotExists":
+        return values[0].name not in item
+
+    operands = [_value(v, item) for v in values]
+    if operands[0] is None:
+        return False
+    if name == "Between":
+        return operands[1] <= operands[0] <= operands[2]
+    if name == "BeginsWith":
+        return str(operands[0]).startswith(operands[1])
+
+    compare = {
+        "Equals": operator.eq,
+        "NotEquals": operator.ne,
+        "LessThan": operator.lt,
+        "LessThanEquals": operator.le,
+        "GreaterThan": operator.gt,
+        "GreaterThanEquals": operator.ge,
+    }[name]
+
+    return compare(operands[0], operands[1])
+
+
+class FakeReadTable:
+    """Holds items in memory, answers Query and Scan in a single page"""
+
+    def __init__(self, items, sort_key):
+        self.items = list(items)
+        self.sort_key = sort_key
+
+    def _read(self, items, kwargs):
+        if "FilterExpression" in kwargs:
+            items = [i for i in items if evaluate(kwargs["FilterExpression"], i)]
+        items = sorted(
+            items,
+            key=lambda i: i.get(self.sort_key, 0),
+            reverse=not kwargs.get("ScanIndexForward", True),
+        )
+        if "ProjectionExpression" in kwargs:
+            aliases = kwargs.get("ExpressionAttributeNames", {})
+            names = [
+                aliases.get(n.strip(), n.strip())
+                for n in kwargs["ProjectionExpression"].split(",")
+            ]
+            items = [{n: i[n] for n in names if n in i} for i in items]
+
+        return {"Items": items[: kwargs.get("Limit", len(items))]}
+
+    def query(self, KeyConditionExpression, **kwargs):
+        return self._read(
+            [i for i in self.items if evaluate(KeyConditionExpression, i)], kwargs
+        )
+
+    def scan(self, **kwargs):
+        return self._read(self.items, kwargs)
+
+
+class ConditionalCheckFailedException(Exception):
+    pass
+
+
+class FakeTable(FakeReadTable):
+    """A FakeReadTable keyed by partition key and sort key, which can also be written"""
+
+    meta = SimpleNamespace(
+        client=SimpleNamespace(
+            exceptions=SimpleNamespace(
+                ConditionalCheckFailedException=ConditionalCheckFailedException
+            )
+        )
+    )
+
+    def __init__(self, partition_key, sort_key, items=()):
+        super().__init__([], sort_key)
+        self.partition_key = partition_key
+        self.puts = 0
+        for item in items:
+            self.put_item(Item=item)
+
+    def _index(self, key):
+        for i, item in enumerate(self.items):
+            if all(item.get(k) == v for k, v in key.items()):
+                return i
+        return None
+
+    def get_item(self, Key):
+        index = self._index(Key)
+        return {"Item": self.items[index]} if index is not None else {}
+
+    def put_item(self, Item, ConditionExpression=None):
+        key = {k: Item[k] for k in (self.partition_key, self.sort_key)}
+        index = self._index(key)
+        current = self.items[index] if index is not None else {}
+        if ConditionExpression is not None and not evaluate(ConditionExpression, current):
+            raise ConditionalCheckFailedException()
+
+        self.puts += 1
+        if index is None:
+            self.items.append(dict(Item))
+        else:
+            self.items[index] = dict(Item)
+        return {}
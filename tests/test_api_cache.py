@@ -0,0 +1,49 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import datetime
+import threading
+from api_cache import CachedClient, request_scope, cache_scope, current_cache
+from fakes import FakeSageMaker
+
+
+def hours_ago(hours):
+    return datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=hours)
+
+
+def test_windows_share_one_listing_in_any_order():
+    fake = FakeSageMaker(n_jobs=250)
+    client = CachedClient(fake)
+
+    with request_scope():
+        # the narrow window first: the broader listing is still fetched once
+        narrow = client.list_all("list_training_jobs", LastModifiedTimeAfter=hours_ago(5))
+        wide = client.list_all("list_training_jobs", LastModifiedTimeAfter=hours_ago(20))
+        full = client.list_all("list_training_jobs")
+
+    assert fake.calls["list_training_jobs"] == 3  # the pages of the one listing
+    assert len(narrow["TrainingJobSummaries"]) == 30
+    assert len(wide["TrainingJobSummaries"]) == 120
+    assert len(full["TrainingJobSummaries"]) == 250
+
+
+def test_the_cache_is_per_thread():
+    fake = FakeSageMaker(n_endpoints=1)
+    client = CachedClient(fake)
+    seen = {}
+
+    def work(cache):
+        seen["outside"] = current_cache()
+        with cache_scope(cache):
+            client.list_all("list_endpoints")
+
+    with request_scope() as cache:
+        client.list_all("list_endpoints")
+        # a thread only uses the cache of the request once it enters its scope
+        worker = threading.Thread(target=work, args=(cache,))
+        worker.start()
+        worker.join()
+
+    assert seen["outside"] is None
+    assert fake.calls["list_endpoints"] == 1
+    assert current_cache() is None
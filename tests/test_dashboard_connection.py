@@ -0,0 +1,120 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import pytest
+import dashboard_connection
+from dashboard_connection import (
+    pack_accounts,
+    plan_rules,
+    packed_rule_name,
+    bus_arn,
+    MAX_TARGETS_PER_RULE,
+)
+
+
+def test_unknown_action_is_rejected(monkeypatch):
+    def get_parameters(path):
+        raise AssertionError("an unknown action must not read the parameter store")
+
+    monkeypatch.setattr(dashboard_connection, "get_parameters", get_parameters)
+
+    with pytest.raises(ValueError):
+        dashboard_connection.lambda_handler({"action": "EBRules"}, None)
+
+
+def accounts(*numbers):
+    return {f"{n:012d}" for n in numbers}
+
+
+def test_packing_is_stable_and_fills_the_gaps():
+    packs = pack_accounts({}, accounts(*range(12)))
+    assert sorted(packs) == [0, 1, 2]
+    assert [len(packs[i]) for i in range(3)] == [5, 5, 2]
+
+    # the accounts that stay keep their rule, and the new ones fill the free slots first
+    remaining = accounts(*range(12)) - accounts(1, 6) | accounts(20, 21, 22, 23)
+    repacked = pack_accounts(packs, remaining)
+    for index, members in packs.items():
+        assert members & remaining <= repacked[index]
+    assert set().union(*repacked.values()) == remaining
+    assert sorted(repacked) == [0, 1, 2]
+    assert all(len(m) <= MAX_TARGETS_PER_RULE for m in repacked.values())
+
+    # a pack left without accounts is kept, empty, to be deleted
+    assert pack_accounts(packs, packs[0] | packs[1])[2] == set()
+
+
+def test_packing_reuses_the_free_indexes():
+    current = {0: accounts(0, 1, 2, 3, 4), 2: accounts(5)}
+    packs = pack_accounts(current, accounts(*range(16)))
+
+    assert packs[0] == current[0]
+    assert current[2] <= packs[2]
+    assert sorted(packs) == [0, 1, 2, 3]
+    assert set().union(*packs.values()) == accounts(*range(16))
+
+
+def rule(pattern, *accounts):
+    return {
+        "pattern": pattern,
+        "targets": {f"{a}-bus": bus_arn(a) for a in accounts},
+    }
+
+
+PATTERN = {"source": ["metric_extractor"], "detail-type": ["metric_extractor"]}
+
+
+def plan(monkeypatch, existing, members, prune=False):
+    monkeypatch.setattr(dashboard_connection, "existing_rules", lambda: existing)
+    additions, removals = plan_rules({"MetricValues": (PATTERN, members)}, prune)
+    return (
+        {kwargs["rule_name"]: kwargs for _, fn, kwargs in additions},
+        {kwargs["rule_name"]: kwargs for _, fn, kwargs in removals},
+    )
+
+
+def test_legacy_rules_are_replaced_by_packs(monkeypatch):
+    members = accounts(1, 2, 3)
+    legacy = {
+        f"forwardTo{a}MetricValues": rule(PATTERN, a) for a in sorted(members)
+    }
+    # the rule of an account that is no longer monitored is only deleted when pruning
+    legacy["forwardTo000000000009MetricValues"] = rule(PATTERN, "000000000009")
+
+    additions, removals = plan(monkeypatch, legacy, members)
+
+    assert list(additions) == ["forwardToMetricValues-000"]
+    assert additions["forwardToMetricValues-000"]["pattern"] == PATTERN
+    assert {t["Id"] for t in additions["forwardToMetricValues-000"]["targets"]} == {
+        f"{a}-bus" for a in members
+    }
+    assert set(removals) == {f"forwardTo{a}MetricValues" for a in members}
+    assert removals["forwardTo000000000001MetricValues"]["target_ids"] == [
+        "000000000001-bus"
+    ]
+
+    additions, removals = plan(monkeypatch, legacy, members, prune=True)
+    assert "forwardTo000000000009MetricValues" in removals
+
+
+def test_unchanged_packs_issue_no_writes(monkeypatch):
+    members = accounts(*range(7))
+    packs = pack_accounts({}, members)
+    existing = {
+        packed_rule_name("MetricValues", i): rule(PATTERN, *sorted(m))
+        for i, m in packs.items()
+    }
+
+    assert plan(monkeypatch, existing, members) == ({}, {})
+
+    # a departed account only changes its own rule
+    departed = sorted(packs[1])[0]
+    additions, removals = plan(monkeypatch, existing, members - {departed})
+    assert list(additions) == ["forwardToMetricValues-001"]
+    assert additions["forwardToMetricValues-001"] == {
+        "rule_name": "forwardToMetricValues-001",
+        "pattern": None,
+        "targets": [],
+        "removed_target_ids": [f"{departed}-bus"],
+    }
+    assert removals == {}
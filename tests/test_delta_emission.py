@@ -0,0 +1,86 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import retrieve_values
+import delta_emission
+from delta_emission import select_due, record_emitted
+from table_schema import value_status
+
+NOW = 1646136000.0
+
+
+def payload(metric_name, value):
+    return {
+        "MetricName": metric_name,
+        "MetricValue": value,
+        "Metadata": {},
+        "Environment": "test",
+        "ProjectName": "TestProject",
+    }
+
+
+def emit(payloads, now):
+    """Selects the payloads due and records them as emitted. Returns the names of the due ones"""
+
+    due, _ = select_due(payloads, heartbeat_seconds=60, now=now)
+    record_emitted(due, now=now)
+    return [p["MetricName"] for p in due]
+
+
+def test_unchanged_values_wait_for_the_heartbeat(spoke):
+    assert emit([payload("A", 1), payload("B", 1)], NOW) == ["A", "B"]
+    # B changed, A did not
+    assert emit([payload("A", 1), payload("B", 2)], NOW + 10) == ["B"]
+    assert emit([payload("A", 1), payload("B", 2)], NOW + 20) == []
+    # A is emitted again a heartbeat after its last emission, B a heartbeat after its change
+    assert emit([payload("A", 1), payload("B", 2)], NOW + 60) == ["A"]
+    assert emit([payload("A", 1), payload("B", 2)], NOW + 70) == ["B"]
+
+
+def test_due_values_carry_the_heartbeat(spoke):
+    due, unchanged = select_due([payload("A", 1)], heartbeat_seconds=60, now=NOW)
+
+    assert due == [
+        {**payload("A", 1), "HeartbeatSeconds": 60, "EmittedTimestamp": NOW * 10**6}
+    ]
+    assert unchanged == []
+
+
+def test_the_heartbeat_of_a_cached_value_is_current(spoke):
+    # a value extracted 10 minutes ago, reused from the value cache
+    cached = {**payload("A", 1), "ExtractionTimestamp": int((NOW - 600) * 1e6)}
+    emit([cached], NOW - 3600)
+
+    due, _ = select_due([cached], heartbeat_seconds=3600, now=NOW)
+
+    assert due[0]["ExtractionTimestamp"] == cached["ExtractionTimestamp"]
+    assert due[0]["EmittedTimestamp"] == NOW * 10**6
+    # 50 minutes later, the hub still sees the value as current
+    assert value_status(due[0], (NOW + 3000) * 10**6) == "current"
+
+
+def test_values_not_emitted_stay_due(spoke):
+    due, _ = select_due([payload("A", 1)], heartbeat_seconds=60, now=NOW)
+    # the emission failed: nothing is recorded
+    assert emit([payload("A", 1)], NOW + 10) == ["A"]
+    assert len(due) == 1
+
+
+def test_without_heartbeat_every_value_is_emitted(spoke):
+    assert emit([payload("A", 1)], NOW) == ["A"]
+    due, unchanged = select_due([payload("A", 1)], heartbeat_seconds=0, now=NOW + 1)
+    assert due == [payload("A", 1)]
+    assert unchanged == []
+
+
+def test_the_handler_only_emits_the_changes(spoke, monkeypatch):
+    monkeypatch.setattr(delta_emission, "HEARTBEAT_SECONDS", 3600)
+    monkeypatch.setenv("METRIC_NAMES", "NumberEndPointsInService,SSMParamStoreValueMyName")
+
+    assert retrieve_values.lambda_handler({}, None)["emitted"] == 2
+    assert retrieve_values.lambda_handler({}, None)["emitted"] == 0
+    assert all(
+        json.loads(e["Detail"])["HeartbeatSeconds"] == 3600
+        for e in spoke["events"].entries
+    )
@@ -0,0 +1,117 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import pytest
+import dynamo_write
+from table_schema import SERIES_KEY, TIMESTAMP
+from fakes import FakeDynamoDB
+
+
+def event(metric_name, timestamp, value=1):
+    return {
+        "source": "metric_extractor",
+        "detail-type": "metric_extractor",
+        "account": "111111111111",
+        "detail": {
+            "MetricName": metric_name,
+            "MetricValue": value,
+            "ExtractionDate": "2022-03-01 12:00:00.000000",
+            "ExtractionTimestamp": timestamp,
+            "Metadata": {},
+            "Environment": "test",
+            "ProjectName": "TestProject",
+        },
+    }
+
+
+def record(message_id, body):
+    if not isinstance(body, str):
+        body = json.dumps(body)
+    return {"messageId": message_id, "body": body}
+
+
+@pytest.fixture
+def hub(monkeypatch):
+    """The hub table, as a stand-in. Returns the stand-in of the DynamoDB resource"""
+
+    dynamodb = FakeDynamoDB()
+    monkeypatch.setattr(dynamo_write, "dynamodb", dynamodb)
+    table = dynamodb.add_table(dynamo_write.ddb_table_name, SERIES_KEY, TIMESTAMP)
+    monkeypatch.setattr(dynamo_write, "table", table)
+    monkeypatch.setattr(dynamo_write, "BATCH_WRITE_BASE_BACKOFF_SECONDS", 0)
+
+    return dynamodb
+
+
+def test_malformed_records_are_dropped_not_redelivered(hub):
+    records = [
+        record("good", event("M", 1646136000000000)),
+        record("not-json", "{"),
+        record("no-detail", {"source": "metric_extractor"}),
+        record("newer-version", {"detail": {"PayloadVersion": 99}}),
+    ]
+
+    response = dynamo_write.queue_handler({"Records": records}, None)
+
+    assert response == {"batchItemFailures": []}
+    assert len(hub.tables[dynamo_write.ddb_table_name].items) == 1
+
+
+def test_unprocessed_items_are_retried(hub):
+    hub.unprocessed_rate = 0.2
+    items = [
+        (str(i), dynamo_write.to_item(event(f"M{i}", 1646136000000000)["detail"]))
+        for i in range(60)
+    ]
+
+    assert dynamo_write.batch_write(items) == set()
+    table = hub.tables[dynamo_write.ddb_table_name]
+    assert len(table.items) == 60
+    # 3 requests of at most 25 items, and at least one retry for each
+    assert hub.calls["batch_write_item"] > 3
+
+
+def test_items_with_the_same_key_are_written_once(hub):
+    first = event("M", 1646136000000000, value=1)
+    again = event("M", 1646136000000000, value=2)
+    records = [record("first", first), record("again", again)]
+
+    assert dynamo_write.queue_handler({"Records": records}, None) == {"batchItemFailures": []}
+    table = hub.tables[dynamo_write.ddb_table_name]
+    assert list(table.writes.values()) == [1]
+    # the last one wins
+    assert [i["MetricValue"] for i in table.items.values()] == [2]
+
+
+def test_only_the_records_not_written_are_reported(hub, monkeypatch):
+    store = hub.batch_write_item
+
+    def batch_write_item(RequestItems):
+        # the items of metric Stuck are never processed
+        stuck = {
+            name: [r for r in requests if r["PutRequest"]["Item"]["MetricName"] == "Stuck"]
+            for name, requests in RequestItems.items()
+        }
+        store(
+            {
+                name: [r for r in requests if r not in stuck[name]]
+                for name, requests in RequestItems.items()
+            }
+        )
+        return {"UnprocessedItems": {name: r for name, r in stuck.items() if r}}
+
+    monkeypatch.setattr(hub, "batch_write_item", batch_write_item)
+    records = [
+        record("a", event("M", 1646136000000000)),
+        record("b", event("Stuck", 1646136000000000)),
+        record("c", event("Stuck", 1646136000000000)),
+        record("d", event("Stuck", 1646139600000000)),
+        record("e", event("N", 1646136000000000)),
+    ]
+
+    response = dynamo_write.queue_handler({"Records": records}, None)
+
+    # b and c have the same key: both are delivered again
+    assert sorted(f["itemIdentifier"] for f in response["batchItemFailures"]) == ["b", "c", "d"]
+    assert hub.calls["batch_write_item"] == dynamo_write.BATCH_WRITE_MAX_ATTEMPTS
@@ -0,0 +1,90 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import pytest
+import event_emitter
+from event_emitter import (
+    make_entry,
+    entry_size,
+    pack_entries,
+    put_entries,
+    MAX_REQUEST_BYTES,
+)
+from fakes import FakeEvents
+
+
+class FlakyEvents(FakeEvents):
+    """Fails the entries of the payloads listed in failing, the given number of times each"""
+
+    def __init__(self, failing):
+        super().__init__()
+        self.failing = dict(failing)
+        self.requests = []
+
+    def put_events(self, Entries):
+        self.requests.append([json.loads(e["Detail"])["n"] for e in Entries])
+        results = []
+        for entry in Entries:
+            n = json.loads(entry["Detail"])["n"]
+            if self.failing.get(n, 0) > 0:
+                self.failing[n] -= 1
+                results.append({"ErrorCode": "ThrottlingException", "ErrorMessage": "fake"})
+            else:
+                self.entries.append(entry)
+                results.append({"EventId": str(n)})
+        failed = sum(1 for r in results if "ErrorCode" in r)
+        return {"FailedEntryCount": failed, "Entries": results}
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(event_emitter, "PUT_EVENTS_BASE_BACKOFF_SECONDS", 0)
+
+
+def entries(n, padding=0):
+    return [make_entry({"n": i, "padding": "x" * padding}) for i in range(n)]
+
+
+def test_batches_hold_at_most_ten_entries():
+    batches = pack_entries(entries(25))
+
+    assert [len(b) for b in batches] == [10, 10, 5]
+    assert [b for batch in batches for b in batch] == entries(25)
+
+
+def test_batches_stay_within_the_request_size():
+    # three entries of 100 KB do not fit in a request of 256 KB
+    batches = pack_entries(entries(5, padding=100 * 1024))
+
+    assert [len(b) for b in batches] == [2, 2, 1]
+    assert all(sum(entry_size(e) for e in b) <= MAX_REQUEST_BYTES for b in batches)
+    assert len(pack_entries(entries(10, padding=1024))) == 1
+
+
+def test_only_the_failed_entries_are_sent_again():
+    client = FlakyEvents({3: 1, 7: 2})
+
+    assert put_entries(entries(12), client) == []
+    assert client.requests == [list(range(10)), [10, 11], [3, 7], [7]]
+    assert sorted(json.loads(e["Detail"])["n"] for e in client.entries) == list(range(12))
+
+
+def test_entries_failing_every_attempt_are_dropped():
+    client = FlakyEvents({5: 100})
+
+    dropped = put_entries(entries(6), client)
+
+    assert [(json.loads(d["Entry"]["Detail"])["n"], d["ErrorCode"]) for d in dropped] == [
+        (5, "ThrottlingException")
+    ]
+    assert len(client.requests) == event_emitter.PUT_EVENTS_MAX_ATTEMPTS
+
+
+def test_entries_too_large_are_dropped_without_a_call():
+    client = FlakyEvents({})
+
+    dropped = put_entries(entries(1, padding=MAX_REQUEST_BYTES), client)
+
+    assert [d["ErrorCode"] for d in dropped] == ["EntryTooLarge"]
+    assert client.requests == []
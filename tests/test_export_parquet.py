@@ -0,0 +1,62 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import io
+import pytest
+
+pyarrow = pytest.importorskip("pyarrow")
+
+import pyarrow.parquet
+import export_parquet
+from object_store import LocalObjectStore, load_json
+from table_schema import TIMESTAMP
+from fake_tables import FakeReadTable
+
+NOW = 1646136000.0
+
+
+def items(project, n):
+    return [
+        {
+            "SeriesKey": f"{project}#test#M{i % 3}",
+            "ProjectName": project,
+            "Environment": "test",
+            "MetricName": f"M{i % 3}",
+            # two items per timestamp
+            TIMESTAMP: int((NOW - 7200) * 1e6) + i // 2,
+            "MetricValue": i,
+        }
+        for i in range(n)
+    ]
+
+
+def exported_rows(store):
+    return sum(
+        pyarrow.parquet.read_table(io.BytesIO(store.get(k))).num_rows
+        for k, _ in store.list()
+        if k.endswith(".parquet")
+    )
+
+
+def test_a_large_backlog_is_exported_over_several_runs(tmp_path):
+    store = LocalObjectStore(str(tmp_path))
+    table = FakeReadTable(items("A", 40) + items("B", 10), TIMESTAMP)
+
+    # the time runs out while the first project is exported
+    calls = iter(range(1000))
+
+    def time_left():
+        return 900 if next(calls) < 6 else 0
+
+    first = export_parquet.run_export(table, store, now=NOW, time_left=time_left)
+    assert first["projects"] == 1
+    watermarks = load_json(store, export_parquet.STATE_KEY)["Watermarks"]
+    assert watermarks["B"] == 0
+    # stopped between two timestamps, with the rows written and the watermark saved
+    rows = exported_rows(store)
+    assert 0 < rows < 40 and rows % 2 == 0
+    assert watermarks["A"] == int((NOW - 7200) * 1e6) + rows // 2 - 1
+
+    second = export_parquet.run_export(table, store, now=NOW)
+    assert second["projects"] == 2
+    assert exported_rows(store) == 50
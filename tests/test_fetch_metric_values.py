@@ -0,0 +1,48 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import time
+import pytest
+import fetch_metric_values
+from fetch_metric_values import get_spokes, due_spokes, shards, DEFAULT_FETCH_INTERVAL_SECONDS
+from dashboard_connection import pack_accounts
+
+ACCOUNTS = [f"{i:012d}" for i in range(1, 48)]
+
+
+def test_invalid_intervals_fall_back_to_the_default(monkeypatch):
+    intervals = {"A": "0", "B": "-60", "C": "hourly", "D": "nan", "E": "600"}
+    monkeypatch.setattr(
+        fetch_metric_values,
+        "get_parameters",
+        lambda path: [
+            {"Name": f"/fetch_intervals/{p}", "Value": v} for p, v in intervals.items()
+        ],
+    )
+    projects = [(p, "prod", f"00000000000{i}") for i, p in enumerate("ABCDEF")]
+
+    spokes = get_spokes(projects)
+
+    assert spokes["000000000004"] == 600
+    assert all(
+        spokes[a] == DEFAULT_FETCH_INTERVAL_SECONDS for a in spokes if a != "000000000004"
+    )
+    # the schedule still works for every spoke
+    due_spokes(spokes, time.time(), 60)
+
+
+@pytest.mark.parametrize("size", [3, 10, 12])
+def test_shards_follow_the_packs(size):
+    # packs as left by the connection function after accounts came and went: not in order
+    current = {0: set(ACCOUNTS[40:43]), 1: set(ACCOUNTS[:5]), 3: {ACCOUNTS[20], ACCOUNTS[7]}}
+    packs = list(pack_accounts(current, set(ACCOUNTS)).values())
+    # a spoke not connected yet
+    accounts = ACCOUNTS + ["999999999999"]
+
+    result = shards(accounts, packs, size)
+
+    assert sorted(a for s in result for a in s) == sorted(accounts)
+    assert all(len(s) <= max(size, 5) for s in result)
+    # each rule is matched by a single request
+    for pack in packs:
+        assert len([s for s in result if pack & set(s)]) == 1
@@ -0,0 +1,100 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import pytest
+import metric
+from ds_dashboard.iam_policy import (
+    merge_statements,
+    build_policy_document,
+    policy_size,
+    ROLE_INLINE_POLICIES_MAX_CHARACTERS,
+)
+
+
+def parameter(name):
+    return f"arn:aws:ssm:eu-west-1:111111111111:parameter/{name}"
+
+
+def test_overlapping_actions_and_resources_are_merged():
+    statements = [
+        {"Effect": "Allow", "Action": "sagemaker:ListTrainingJobs", "Resource": "*"},
+        {"Effect": "Allow", "Action": ["SageMaker:listtrainingjobs"], "Resource": ["*"]},
+        {"Action": ["sagemaker:List*", "ssm:DescribeParameters"], "Resource": "*"},
+        {"Action": "ssm:GetParameter", "Resource": parameter("A")},
+        {"Action": "ssm:GetParameter", "Resource": [parameter("B"), parameter("A")]},
+    ]
+
+    assert merge_statements(statements) == [
+        {
+            "Effect": "Allow",
+            "Action": ["sagemaker:List*", "ssm:DescribeParameters"],
+            "Resource": "*",
+        },
+        {
+            "Effect": "Allow",
+            "Action": "ssm:GetParameter",
+            "Resource": [parameter("A"), parameter("B")],
+        },
+    ]
+
+
+def test_conditions_and_special_statements_are_kept_apart():
+    condition = {"StringEquals": {"aws:RequestedRegion": "eu-west-1"}}
+    deny = {"Effect": "Deny", "NotAction": "s3:*", "Resource": "*"}
+    statements = [
+        {"Action": "s3:GetObject", "Resource": "*"},
+        {"Action": "s3:GetObject", "Resource": "*", "Condition": condition},
+        deny,
+        deny,
+    ]
+
+    merged = merge_statements(statements)
+
+    assert len(merged) == 3
+    assert {"Effect": "Allow", "Action": "s3:GetObject", "Resource": "*"} in merged
+    assert [s for s in merged if "Condition" in s][0]["Condition"] == condition
+    assert merged[-1] == deny
+
+
+def test_the_metrics_of_the_solution_share_statements():
+    document = build_policy_document(
+        [
+            metric.TotalCompletedTrainingJobs,
+            metric.CompletedTrainingJobs24h,
+            metric.NumberEndPointsInService,
+            metric.TrainingJobDurations,
+        ],
+        "eu-west-1",
+        "111111111111",
+    )
+
+    # one statement for the events, one for the SageMaker listings
+    assert len(document["Statement"]) == 2
+    assert policy_size(document) < ROLE_INLINE_POLICIES_MAX_CHARACTERS
+
+
+def many_metrics(n):
+    """Metric classes each reading its own parameter"""
+
+    def permissions(name):
+        return classmethod(
+            lambda cls, region, account_id: [
+                {
+                    "Effect": "Allow",
+                    "Action": "ssm:GetParameter",
+                    "Resource": f"arn:aws:ssm:{region}:{account_id}:parameter/{name}",
+                }
+            ]
+        )
+
+    return [
+        type(f"Parameter{i}", (), {"get_iam_permissions": permissions(f"team/parameter-{i}")})
+        for i in range(n)
+    ]
+
+
+def test_a_policy_too_large_is_refused():
+    assert build_policy_document(many_metrics(10), "eu-west-1", "111111111111")
+
+    with pytest.raises(ValueError, match="characters"):
+        build_policy_document(many_metrics(300), "eu-west-1", "111111111111")
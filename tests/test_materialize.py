@@ -0,0 +1,213 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import pytest
+from boto3.dynamodb.types import TypeSerializer
+import materialize
+from sketch import QuantileSketch
+from table_schema import (
+    SERIES_KEY,
+    TIMESTAMP,
+    EMITTED_AT,
+    EXPIRES_AT,
+    ROLLUP_KEY,
+    BUCKET_START,
+    rollup_key,
+    bucket_start,
+)
+from fake_tables import FakeTable
+
+SERIES = "TestProject#test#M"
+HOUR = 3600 * 10**6
+T0 = 1646136000 * 10**6
+
+
+def raw_item(timestamp, value, emitted_at=None):
+    item = {
+        SERIES_KEY: SERIES,
+        TIMESTAMP: timestamp,
+        "ProjectName": "TestProject",
+        "Environment": "test",
+        "MetricName": "M",
+        "MetricValue": value,
+        "HeartbeatSeconds": 3600,
+    }
+    if emitted_at is not None:
+        item[EMITTED_AT] = emitted_at
+    return item
+
+
+@pytest.fixture
+def hub(monkeypatch):
+    """The hub tables, as stand-ins"""
+
+    tables = {
+        "raw": FakeTable(SERIES_KEY, TIMESTAMP),
+        "rollup": FakeTable(ROLLUP_KEY, BUCKET_START),
+        "latest": FakeTable("ProjectName", SERIES_KEY),
+    }
+    monkeypatch.setattr(materialize, "table", tables["raw"])
+    monkeypatch.setattr(materialize, "rollup_table", tables["rollup"])
+    monkeypatch.setattr(materialize, "latest_table", tables["latest"])
+
+    return tables
+
+
+def stream_record(item):
+    """The record of a new item in the NEW_IMAGE stream of the hub table"""
+
+    serializer = TypeSerializer()
+    image = {k: serializer.serialize(v) for k, v in item.items()}
+    return {
+        "eventName": "INSERT",
+        "dynamodb": {
+            "Keys": {k: image[k] for k in (SERIES_KEY, TIMESTAMP)},
+            "NewImage": image,
+        },
+    }
+
+
+def ingest(hub, *items):
+    """Writes items to the hub table, and passes their stream records to the handler"""
+
+    for item in items:
+        hub["raw"].put_item(Item=item)
+    materialize.lambda_handler({"Records": [stream_record(i) for i in items]}, None)
+
+
+def latest(hub):
+    return [(i[TIMESTAMP], i.get(EMITTED_AT)) for i in hub["latest"].items]
+
+
+def test_a_heartbeat_of_the_same_item_refreshes_the_latest_value(hub):
+    assert materialize.update_latest(raw_item(T0, 1, emitted_at=T0))
+
+    # the value reused from the cache of the spoke, emitted again an hour later
+    assert materialize.update_latest(raw_item(T0, 1, emitted_at=T0 + HOUR))
+    assert latest(hub) == [(T0, T0 + HOUR)]
+
+    # the first emission delivered again, late
+    assert not materialize.update_latest(raw_item(T0, 1, emitted_at=T0))
+    assert latest(hub) == [(T0, T0 + HOUR)]
+
+
+def test_an_older_item_does_not_replace_a_newer_latest_value(hub, monkeypatch):
+    def get_item(Key):
+        raise AssertionError("the item is read from the stream record")
+
+    monkeypatch.setattr(hub["raw"], "get_item", get_item)
+
+    ingest(hub, raw_item(T0 + HOUR, 2))
+    assert latest(hub) == [(T0 + HOUR, None)]
+
+    # delivered late, in a later batch
+    ingest(hub, raw_item(T0, 1))
+    assert latest(hub) == [(T0 + HOUR, None)]
+    assert hub["latest"].items[0]["MetricValue"] == 2
+
+    # in the same batch, out of order: only the newest is written
+    puts = hub["latest"].puts
+    ingest(hub, raw_item(T0 + 3 * HOUR, 4), raw_item(T0 + 2 * HOUR, 3))
+    assert latest(hub) == [(T0 + 3 * HOUR, None)]
+    assert hub["latest"].puts == puts + 1
+
+
+def sketch_of(*values):
+    sketch = QuantileSketch()
+    for v in values:
+        sketch.add(v)
+    return materialize.to_dynamodb(sketch.to_dict())
+
+
+def test_summarize_aggregates_the_numeric_values():
+    items = [
+        raw_item(T0 + 2, 3),
+        raw_item(T0, 1),
+        raw_item(T0 + 1, "n/a"),
+        raw_item(T0 + 3, True),
+    ]
+
+    summary = materialize.summarize(items)
+
+    assert summary == {
+        "Count": 4,
+        "Last": True,
+        "LastTimestamp": T0 + 3,
+        "NumericCount": 2,
+        "Sum": 4,
+        "Min": 1,
+        "Max": 3,
+    }
+    assert materialize.summarize([raw_item(T0, "n/a")]) == {
+        "Count": 1,
+        "Last": "n/a",
+        "LastTimestamp": T0,
+    }
+
+
+def test_merge_equals_the_summary_of_all_the_items():
+    hours = [
+        [raw_item(T0, 5), raw_item(T0 + 1, 2)],
+        [raw_item(T0 + HOUR, "n/a")],
+        [raw_item(T0 + 2 * HOUR, 7), raw_item(T0 + 2 * HOUR + 1, 4)],
+    ]
+
+    merged = materialize.merge([materialize.summarize(items) for items in hours])
+
+    assert merged == materialize.summarize([i for items in hours for i in items])
+    assert merged["Last"] == 4
+    assert (merged["Min"], merged["Max"], merged["Sum"]) == (2, 7, 18)
+
+
+def test_sketches_are_merged_in_the_rollups():
+    first = materialize.summarize(
+        [raw_item(T0, sketch_of(1, 2)), raw_item(T0 + 1, sketch_of(3))]
+    )
+    second = materialize.summarize([raw_item(T0 + HOUR, sketch_of(10, 20))])
+
+    assert QuantileSketch.from_dict(first["Sketch"]).count == 3
+    assert "NumericCount" not in first
+
+    merged = QuantileSketch.from_dict(materialize.merge([first, second])["Sketch"])
+    assert merged.count == 5
+    assert merged.quantile(1) == pytest.approx(20, rel=0.02)
+
+
+def rollup(hub, resolution, start):
+    return hub["rollup"].get_item(
+        Key={ROLLUP_KEY: rollup_key(resolution, SERIES), BUCKET_START: start}
+    ).get("Item")
+
+
+def test_rollups_are_recomputed_not_incremented(hub):
+    day = bucket_start(T0, "day")
+
+    ingest(hub, raw_item(T0, 1), raw_item(T0 + 1, 2), raw_item(T0 + HOUR, 10))
+    assert rollup(hub, "hour", T0)["Count"] == 2
+    assert rollup(hub, "day", day)["Sum"] == 13
+
+    # an item delivered twice counts once
+    ingest(hub, raw_item(T0 + 1, 2))
+    assert rollup(hub, "hour", T0)["Count"] == 2
+    assert rollup(hub, "day", day)["Count"] == 3
+
+    # a late item updates its hour, and the day, but not the last value
+    ingest(hub, raw_item(T0 + 2, 7))
+    hour = rollup(hub, "hour", T0)
+    assert (hour["Count"], hour["Sum"], hour["Max"], hour["Last"]) == (3, 10, 7, 7)
+    daily = rollup(hub, "day", day)
+    assert (daily["Count"], daily["Sum"], daily["Max"], daily["Last"]) == (4, 20, 10, 10)
+    assert rollup(hub, "hour", T0 + HOUR)["Count"] == 1
+
+    assert hour[SERIES_KEY] == SERIES
+    assert (hour["Resolution"], daily["Resolution"]) == ("hour", "day")
+    assert hour["ProjectName"] == "TestProject"
+
+
+def test_hourly_rollups_expire_after_their_retention(hub, monkeypatch):
+    monkeypatch.setattr(materialize, "HOURLY_RETENTION_DAYS", 400)
+
+    ingest(hub, raw_item(T0, 1))
+
+    assert EXPIRES_AT in rollup(hub, "hour", T0)
+    assert EXPIRES_AT not in rollup(hub, "day", bucket_start(T0, "day"))
@@ -0,0 +1,30 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import metric_windows
+import retrieve_values
+
+
+def emitted_window(events):
+    metadata = json.loads(events.entries[-1]["Detail"])["Metadata"]
+    return metadata["WindowStart"], metadata["WindowEnd"]
+
+
+def test_a_dropped_window_is_observed_again(spoke, monkeypatch):
+    monkeypatch.setattr(metric_windows, "_window_ends", {})
+    monkeypatch.setenv("METRIC_NAMES", "TrainingJobDurations")
+    events = spoke["events"]
+
+    retrieve_values.lambda_handler({}, None)
+    _, first_end = emitted_window(events)
+
+    events.failure_rate = 1.0
+    assert retrieve_values.lambda_handler({}, None)["dropped"] == ["TrainingJobDurations"]
+
+    # the window of the dropped value is part of the next one
+    events.failure_rate = 0.0
+    retrieve_values.lambda_handler({}, None)
+    start, end = emitted_window(events)
+    assert start == first_end
+    assert list(metric_windows._window_ends.values()) == [end]
@@ -0,0 +1,66 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import pytest
+import payload_codec
+from object_store import LocalObjectStore
+
+ACCOUNT = "111111111111"
+BUCKET = f"ds-dashboard-spoke-state-{ACCOUNT}-eu-west-1"
+
+
+@pytest.fixture
+def offloaded(tmp_path, monkeypatch):
+    """A payload whose Metadata was offloaded to the state bucket of ACCOUNT, which is a
+    local folder here"""
+
+    opened = []
+
+    def bucket(name, prefix, expected_owner=None):
+        opened.append((name, prefix, expected_owner))
+        return LocalObjectStore(str(tmp_path / name / prefix.strip("/")))
+
+    monkeypatch.setattr(payload_codec, "S3ObjectStore", bucket)
+    monkeypatch.setattr(payload_codec, "_stores", {})
+    monkeypatch.setattr(payload_codec, "PAYLOAD_OFFLOAD_BYTES", 0)
+
+    store = LocalObjectStore(str(tmp_path / BUCKET / "payloads"))
+    metadata = {"Jobs": [f"job-{i}" for i in range(200)]}
+    encoded = payload_codec.encode_payload({"MetricName": "M", "Metadata": metadata}, store)
+    key = encoded[payload_codec.METADATA_REF].rsplit("/", 1)[1]
+    encoded[payload_codec.METADATA_REF] = f"s3://{BUCKET}/payloads/{key}"
+
+    return encoded, metadata, opened
+
+
+def test_reads_the_reference_from_the_bucket_of_the_sender(offloaded):
+    encoded, metadata, opened = offloaded
+
+    assert payload_codec.decode_payload(encoded, ACCOUNT)["Metadata"] == metadata
+    assert opened == [(BUCKET, "/payloads", ACCOUNT)]
+
+
+@pytest.mark.parametrize(
+    "uri",
+    [
+        "file:///tmp/payloads/{key}",
+        "s3://ds-dashboard-spoke-state-222222222222-eu-west-1/payloads/{key}",
+        "s3://any-bucket/payloads/{key}",
+    ],
+)
+def test_rejects_the_other_references(offloaded, uri):
+    encoded, _, opened = offloaded
+    key = encoded[payload_codec.METADATA_REF].rsplit("/", 1)[1]
+    encoded[payload_codec.METADATA_REF] = uri.format(key=key)
+
+    with pytest.raises(ValueError):
+        payload_codec.decode_payload(encoded, ACCOUNT)
+    assert opened == []
+
+
+def test_needs_the_sender_to_follow_a_reference(offloaded):
+    encoded, _, opened = offloaded
+
+    with pytest.raises(ValueError):
+        payload_codec.decode_payload(encoded)
+    assert opened == []
@@ -0,0 +1,187 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+from types import SimpleNamespace
+import pytest
+import metric
+import dynamo_write
+import query_metrics
+import retrieve_values
+from sketch import QuantileSketch
+from table_schema import TIMESTAMP, SERIES_KEY, LATEST_METRIC_INDEX, series_key
+from fake_tables import FakeReadTable
+
+DAY = "2022-03-01"
+TIMESTAMP_US = 1646136000000000
+
+
+def distribution_payload(values, region=None):
+    sketch = QuantileSketch()
+    for v in values:
+        sketch.add(v)
+
+    payload = {
+        "MetricName": "TrainingJobDurations",
+        "MetricValue": sketch.to_dict(),
+        "ExtractionDate": f"{DAY} 12:00:00.000000",
+        "ExtractionTimestamp": TIMESTAMP_US,
+        "Metadata": {},
+        "Environment": "test",
+        "ProjectName": "TestProject",
+    }
+    if region is not None:
+        payload["Region"] = region
+
+    return payload
+
+
+@pytest.fixture
+def two_regions(monkeypatch):
+    """A hub table holding a distribution metric of two regions, and its aggregate"""
+
+    regional = [
+        distribution_payload([1, 2, 3], "eu-west-1"),
+        distribution_payload([10, 20], "us-east-1"),
+    ]
+    instances = [
+        metric.TrainingJobDurations("TrainingJobDurations", "TestProject", {}, "test", region)
+        for region in ("eu-west-1", "us-east-1")
+    ]
+    aggregates = retrieve_values.aggregate_regions(instances, regional)
+    assert len(aggregates) == 1
+
+    items = [dynamo_write.to_item(p) for p in regional + aggregates]
+    monkeypatch.setattr(query_metrics, "table", FakeReadTable(items, TIMESTAMP))
+    monkeypatch.setattr(query_metrics, "cache", query_metrics.LRUCache(16))
+
+
+def test_project_query_returns_the_aggregate_only(two_regions):
+    items = query_metrics.run_query({"ProjectName": "TestProject"})["Items"]
+
+    assert len(items) == 1
+    assert "Region" not in items[0]
+
+
+def test_region_selects_the_items_of_a_region(two_regions):
+    items = query_metrics.run_query({"ProjectName": "TestProject", "Region": "us-east-1"})[
+        "Items"
+    ]
+
+    assert [i["Region"] for i in items] == ["us-east-1"]
+
+
+def test_quantiles_merge_each_observation_once(two_regions):
+    for query in (
+        {"ProjectName": "TestProject", "MetricName": "TrainingJobDurations"},
+        {"MetricName": "TrainingJobDurations", "Day": DAY},
+    ):
+        result = query_metrics.run_query({**query, "Quantiles": [0, 1]})
+
+        assert result["Items"] == 1
+        assert result["Count"] == 5
+        assert result["Quantiles"]["0"] == pytest.approx(1, rel=0.02)
+        assert result["Quantiles"]["1"] == pytest.approx(20, rel=0.02)
+
+
+class LatestTable(FakeReadTable):
+    """The latest-value table, recording the indexes queried. It is never scanned"""
+
+    def __init__(self, items):
+        super().__init__(items, SERIES_KEY)
+        self.indexes = []
+
+    def query(self, KeyConditionExpression, **kwargs):
+        self.indexes.append(kwargs.pop("IndexName", None))
+        return super().query(KeyConditionExpression, **kwargs)
+
+    def scan(self, **kwargs):
+        raise AssertionError("the latest-value table must not be scanned")
+
+
+def latest_item(project, environment, metric_name):
+    return {
+        "ProjectName": project,
+        "Environment": environment,
+        "MetricName": metric_name,
+        SERIES_KEY: "#".join([project, environment, metric_name]),
+        TIMESTAMP: TIMESTAMP_US,
+        "MetricValue": 1,
+    }
+
+
+@pytest.fixture
+def latest_table(monkeypatch):
+    latest = LatestTable(
+        latest_item(project, environment, metric_name)
+        for project in ("P1", "P2")
+        for environment in ("dev", "prod")
+        for metric_name in ("M1", "M2")
+    )
+    monkeypatch.setattr(query_metrics, "latest_table", latest)
+    return latest
+
+
+def series(result):
+    return sorted(i[SERIES_KEY] for i in result["Items"])
+
+
+def test_latest_view_of_a_metric_queries_its_index(latest_table):
+    result = query_metrics.run_query({"View": "latest", "MetricName": "M1"})
+    assert series(result) == ["P1#dev#M1", "P1#prod#M1", "P2#dev#M1", "P2#prod#M1"]
+
+    result = query_metrics.run_query(
+        {"View": "latest", "MetricName": "M1", "Environment": "prod"}
+    )
+    assert series(result) == ["P1#prod#M1", "P2#prod#M1"]
+    assert latest_table.indexes == [LATEST_METRIC_INDEX] * 2
+
+
+def test_latest_view_of_a_project_queries_the_table(latest_table):
+    result = query_metrics.run_query(
+        {"View": "latest", "ProjectName": "P2", "Environment": "dev"}
+    )
+    assert series(result) == ["P2#dev#M1", "P2#dev#M2"]
+
+    result = query_metrics.run_query(
+        {"View": "latest", "ProjectName": "P2", "MetricName": "M2"}
+    )
+    assert series(result) == ["P2#dev#M2", "P2#prod#M2"]
+    assert latest_table.indexes == [None] * 2
+
+
+def test_latest_view_needs_a_project_or_a_metric(latest_table):
+    with pytest.raises(ValueError):
+        query_metrics.run_query({"View": "latest", "Environment": "prod"})
+
+
+def test_cached_results_expire(monkeypatch):
+    def item(timestamp):
+        return {
+            SERIES_KEY: series_key("TestProject", "test", "M"),
+            TIMESTAMP: timestamp,
+            "MetricValue": 1,
+        }
+
+    raw = FakeReadTable([item(TIMESTAMP_US)], TIMESTAMP)
+    monkeypatch.setattr(query_metrics, "table", raw)
+    monkeypatch.setattr(query_metrics, "cache", query_metrics.LRUCache(16, max_age=60))
+    now = [1000.0]
+    monkeypatch.setattr(query_metrics, "time", SimpleNamespace(monotonic=lambda: now[0]))
+
+    query = {"ProjectName": "TestProject", "Environment": "test", "MetricName": "M"}
+
+    def timestamps():
+        return [i[TIMESTAMP] for i in query_metrics.run_query(query)["Items"]]
+
+    assert timestamps() == [TIMESTAMP_US]
+
+    # a newer item changes the marker of the partition
+    raw.items.append(item(TIMESTAMP_US + 2))
+    assert timestamps() == [TIMESTAMP_US, TIMESTAMP_US + 2]
+
+    # a late item does not, and only shows up once the cached result is too old
+    raw.items.append(item(TIMESTAMP_US + 1))
+    now[0] += 30
+    assert timestamps() == [TIMESTAMP_US, TIMESTAMP_US + 2]
+    now[0] += 31
+    assert timestamps() == [TIMESTAMP_US, TIMESTAMP_US + 1, TIMESTAMP_US + 2]
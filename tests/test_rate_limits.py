@@ -0,0 +1,193 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+from types import SimpleNamespace
+import pytest
+import rate_limits
+from rate_limits import (
+    TokenBucket,
+    DeadlineExceeded,
+    deadline_scope,
+    limit_client,
+    THROTTLE_DECREASE,
+    SUCCESS_INCREASE,
+    MIN_CALLS_PER_SECOND,
+)
+
+
+class FakeClock:
+    """Stands for the time module of rate_limits: sleeping moves the clock forward"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class FakeEvents:
+    def __init__(self):
+        self.handlers = {}
+
+    def register(self, event_name, handler):
+        self.handlers[event_name] = handler
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limits, "time", clock)
+    monkeypatch.setattr(rate_limits, "_buckets", {})
+    return clock
+
+
+@pytest.fixture
+def handlers(clock, monkeypatch):
+    """The handlers registered by limit_client, with the backoff delay at its upper bound"""
+
+    monkeypatch.setattr(rate_limits.random, "uniform", lambda low, high: high)
+    client = SimpleNamespace(
+        meta=SimpleNamespace(
+            service_model=SimpleNamespace(service_name="sagemaker"),
+            region_name="eu-west-1",
+            events=FakeEvents(),
+        )
+    )
+    limit_client(client)
+    return client.meta.events.handlers
+
+
+def response(status_code, code=None):
+    parsed = {"Error": {"Code": code}} if code else {}
+    return (SimpleNamespace(status_code=status_code), parsed)
+
+
+EVENT = "needs-retry.sagemaker.ListTrainingJobs"
+
+
+def bucket():
+    return rate_limits.get_bucket("sagemaker", "eu-west-1", "ListTrainingJobs")
+
+
+def test_throttling_halves_the_rate_and_successes_grow_it_back(clock):
+    bucket = TokenBucket(10)
+
+    bucket.throttled()
+    assert bucket.rate == 10 * THROTTLE_DECREASE
+    bucket.throttled()
+    assert bucket.rate == 10 * THROTTLE_DECREASE ** 2
+
+    bucket.succeeded()
+    assert bucket.rate == pytest.approx(10 * THROTTLE_DECREASE ** 2 + 10 * SUCCESS_INCREASE)
+    for _ in range(100):
+        bucket.succeeded()
+    assert bucket.rate == 10
+
+    for _ in range(100):
+        bucket.throttled()
+    assert bucket.rate == MIN_CALLS_PER_SECOND
+
+
+def test_bucket_allows_a_burst_then_spaces_the_calls(clock):
+    bucket = TokenBucket(10)
+
+    for _ in range(10):
+        bucket.acquire()
+    assert clock.slept == []
+
+    bucket.acquire()
+    assert clock.slept == [pytest.approx(0.1)]
+
+    # the tokens refill with time, up to one second of calls
+    clock.now += 60
+    for _ in range(10):
+        bucket.acquire()
+    assert len(clock.slept) == 1
+
+
+def test_throttling_spaces_the_waiting_calls_at_the_new_rate(clock):
+    bucket = TokenBucket(10)
+
+    bucket.throttled()
+    bucket.acquire()
+    assert clock.slept == [pytest.approx(1 / 5)]
+
+
+def test_bucket_does_not_wait_beyond_the_deadline(clock):
+    bucket = TokenBucket(1)
+    bucket.acquire()
+
+    with pytest.raises(DeadlineExceeded):
+        bucket.acquire(deadline=clock.now + 0.5)
+    assert clock.slept == []
+
+    bucket.acquire(deadline=clock.now + 2)
+    assert clock.slept == [pytest.approx(1)]
+
+
+def test_throttled_call_is_retried_after_a_backoff(handlers):
+    needs_retry = handlers["needs-retry"]
+
+    delays = [
+        needs_retry(EVENT, response(400, "ThrottlingException"), attempts)
+        for attempts in range(1, 4)
+    ]
+    assert delays == [
+        rate_limits.API_BASE_BACKOFF_SECONDS,
+        rate_limits.API_BASE_BACKOFF_SECONDS * 2,
+        rate_limits.API_BASE_BACKOFF_SECONDS * 4,
+    ]
+    assert bucket().rate == bucket().max_rate * THROTTLE_DECREASE ** 3
+
+    # the backoff is capped
+    assert (
+        needs_retry(EVENT, response(400, "ThrottlingException"), 7)
+        == rate_limits.API_MAX_BACKOFF_SECONDS
+    )
+
+
+def test_transient_errors_are_retried_and_others_are_not(handlers):
+    needs_retry = handlers["needs-retry"]
+
+    assert needs_retry(EVENT, response(503, "ServiceUnavailable"), 1) is not None
+    assert needs_retry(EVENT, None, 1, caught_exception=ConnectionError()) is not None
+    assert needs_retry(EVENT, response(400, "ValidationException"), 1) is None
+    assert needs_retry(EVENT, response(200), 1) is None
+    assert bucket().rate == bucket().max_rate
+
+
+def test_retries_stop_after_the_max_attempts(handlers):
+    needs_retry = handlers["needs-retry"]
+
+    throttled = response(400, "ThrottlingException")
+    assert needs_retry(EVENT, throttled, rate_limits.API_MAX_ATTEMPTS - 1) is not None
+    assert needs_retry(EVENT, throttled, rate_limits.API_MAX_ATTEMPTS) is None
+
+
+def test_retries_are_given_up_at_the_deadline(handlers, clock):
+    needs_retry = handlers["needs-retry"]
+    throttled = response(400, "ThrottlingException")
+    delay = rate_limits.API_BASE_BACKOFF_SECONDS * 2
+
+    with deadline_scope(clock.now + delay + 0.01):
+        assert needs_retry(EVENT, throttled, 2) == delay
+    with deadline_scope(clock.now + delay):
+        assert needs_retry(EVENT, throttled, 2) is None
+
+    # a call given up before sending is not retried
+    assert needs_retry(EVENT, None, 1, caught_exception=DeadlineExceeded()) is None
+
+
+def test_calls_are_not_sent_after_the_deadline(handlers, clock):
+    before_send = handlers["before-send"]
+
+    with deadline_scope(clock.now + 1):
+        before_send("before-send.sagemaker.ListTrainingJobs")
+    with deadline_scope(clock.now):
+        with pytest.raises(DeadlineExceeded):
+            before_send("before-send.sagemaker.ListTrainingJobs")
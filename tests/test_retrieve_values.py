@@ -0,0 +1,30 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import time
+import metric
+import retrieve_values
+
+
+class SlowMetricForTest(metric.Metric):
+    """Calls an API over and over, well past its deadline"""
+
+    _timeout_seconds = 0.2
+
+    def _compute_value(self):
+        for _ in range(50):
+            metric.ssm_client.get_parameter(Name="slow")
+            time.sleep(0.02)
+        return 0
+
+
+def test_an_abandoned_metric_stops_at_its_next_api_call(spoke, monkeypatch):
+    monkeypatch.setenv("METRIC_NAMES", "SlowMetricForTest,NumberEndPointsInService")
+
+    response = retrieve_values.lambda_handler({}, None)
+    assert response["timed_out"] == ["SlowMetricForTest"]
+    assert response["emitted"] == 1
+
+    calls = spoke["ssm"].calls["get_parameter"]
+    time.sleep(0.2)
+    assert spoke["ssm"].calls["get_parameter"] == calls
@@ -0,0 +1,90 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import random
+from decimal import Decimal
+import pytest
+from sketch import QuantileSketch, merge_all, DEFAULT_RELATIVE_ACCURACY
+
+QUANTILES = [0.0, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 1.0]
+
+
+def durations(n, seed=0):
+    """Durations of training jobs, from seconds to days"""
+
+    rng = random.Random(seed)
+    return [rng.lognormvariate(6, 2) for _ in range(n)]
+
+
+def sketch_of(values, **kwargs):
+    sketch = QuantileSketch(**kwargs)
+    for v in values:
+        sketch.add(v)
+    return sketch
+
+
+def exact_quantile(values, q):
+    return sorted(values)[int(q * (len(values) - 1))]
+
+
+@pytest.mark.parametrize("accuracy", [DEFAULT_RELATIVE_ACCURACY, 0.01])
+def test_quantiles_are_within_the_relative_accuracy(accuracy):
+    values = durations(10000)
+    sketch = sketch_of(values, relative_accuracy=accuracy)
+
+    for q in QUANTILES:
+        exact = exact_quantile(values, q)
+        assert abs(sketch.quantile(q) - exact) <= accuracy * exact * (1 + 1e-9), q
+
+
+def test_merging_gives_the_sketch_of_the_union():
+    values = durations(3000)
+    parts = [values[:100], values[100:1200], values[1200:]]
+
+    merged = merge_all(sketch_of(p).to_dict() for p in parts)
+    whole = sketch_of(values)
+
+    assert merged.bins == whole.bins
+    assert (merged.count, merged.min, merged.max) == (whole.count, whole.min, whole.max)
+    assert merged.sum == pytest.approx(whole.sum)
+    assert [merged.quantile(q) for q in QUANTILES] == [whole.quantile(q) for q in QUANTILES]
+
+
+def test_merge_all_skips_the_other_values():
+    assert merge_all([1, "text", None]) is None
+    assert merge_all([3, sketch_of([1.0]).to_dict()]).count == 1
+
+
+def test_sketches_of_different_accuracy_are_not_merged():
+    with pytest.raises(ValueError):
+        sketch_of([1.0]).merge(sketch_of([1.0], relative_accuracy=0.01))
+
+
+def test_serialization_round_trip():
+    sketch = sketch_of(durations(500) + [0.0, 0.0])
+
+    # as stored in the hub table: json, with the numbers as Decimals
+    stored = json.loads(json.dumps(sketch.to_dict()), parse_float=Decimal)
+    read = QuantileSketch.from_dict(stored)
+
+    assert read.to_dict() == sketch.to_dict()
+    assert read.zeros == 2
+    assert [read.quantile(q) for q in QUANTILES] == [sketch.quantile(q) for q in QUANTILES]
+
+
+def test_the_size_is_bounded():
+    # 3 orders of magnitude, when 128 bins hold about 2: only the lowest quantiles degrade
+    values = [10 ** (i / 1000) for i in range(3000)]
+    sketch = sketch_of(values, max_bins=128)
+
+    assert len(sketch.bins) <= 128
+    for q in [0.5, 0.9, 0.99]:
+        exact = exact_quantile(values, q)
+        assert abs(sketch.quantile(q) - exact) <= DEFAULT_RELATIVE_ACCURACY * exact * (1 + 1e-9)
+
+
+def test_negative_values_are_rejected():
+    with pytest.raises(ValueError):
+        QuantileSketch().add(-1)
+    assert QuantileSketch().quantile(0.5) is None
@@ -0,0 +1,53 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import datetime
+import pytest
+import training_job_index
+from training_job_index import get_training_job_index
+from fakes import FakeSageMaker
+
+
+class InterruptedSageMaker(FakeSageMaker):
+    """Fails the listings after their first page while interrupted is set"""
+
+    interrupted = False
+
+    def list_training_jobs(self, NextToken=None, **kwargs):
+        if self.interrupted and NextToken is not None:
+            raise TimeoutError("listing interrupted")
+        return super().list_training_jobs(NextToken=NextToken, **kwargs)
+
+
+def add_jobs(fake, n):
+    """Adds n jobs modified after all the others, newest first like the listing"""
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    fake.jobs[:0] = [
+        {
+            "TrainingJobName": f"new-{i}",
+            "TrainingJobStatus": "Completed",
+            "CreationTime": now,
+            "LastModifiedTime": now + datetime.timedelta(seconds=n - i),
+            "TrainingEndTime": now,
+        }
+        for i in range(n)
+    ]
+
+
+def test_an_interrupted_refresh_loses_no_jobs(spoke, monkeypatch):
+    monkeypatch.setattr(training_job_index, "JOB_INDEX_MAX_AGE_SECONDS", 0)
+    fake = InterruptedSageMaker(n_jobs=50)
+
+    assert len(get_training_job_index(fake).jobs) == 50
+
+    # the newest page is read, then the listing fails: the index is left as it was
+    add_jobs(fake, 250)
+    fake.interrupted = True
+    with pytest.raises(TimeoutError):
+        get_training_job_index(fake)
+    assert len(training_job_index._indexes[None].jobs) == 50
+
+    # the next refresh still lists the jobs of the pages not read
+    fake.interrupted = False
+    assert len(get_training_job_index(fake).jobs) == 300
@@ -0,0 +1,42 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import retrieve_values
+import training_job_index
+
+
+def test_older_than_seconds_reuses_the_values(spoke, monkeypatch):
+    monkeypatch.setenv("METRIC_NAMES", "NumberEndPointsInService,SSMParamStoreValueMyName")
+
+    first = retrieve_values.lambda_handler({}, None)
+    assert first["emitted"] == 2
+    assert spoke["sagemaker"].calls["list_endpoints"] == 1
+    assert spoke["ssm"].calls["get_parameter"] == 1
+
+    # SSMParamStoreValueMyName declares no _ttl_seconds: the request alone makes it fresh
+    second = retrieve_values.lambda_handler({"detail": {"OlderThanSeconds": 3600}}, None)
+    assert sorted(second["reused"]) == ["NumberEndPointsInService", "SSMParamStoreValueMyName"]
+    assert spoke["sagemaker"].calls["list_endpoints"] == 1
+    assert spoke["ssm"].calls["get_parameter"] == 1
+
+    # with 0, the metrics are computed again, whatever their _ttl_seconds
+    retrieve_values.lambda_handler({"detail": {"OlderThanSeconds": 0}}, None)
+    assert spoke["sagemaker"].calls["list_endpoints"] == 2
+    assert spoke["ssm"].calls["get_parameter"] == 2
+
+
+def test_costly_metrics_are_not_computed_within_their_ttl(spoke, monkeypatch):
+    monkeypatch.setattr(training_job_index, "JOB_INDEX_MAX_AGE_SECONDS", 0)
+    monkeypatch.setenv(
+        "METRIC_NAMES",
+        "TotalCompletedTrainingJobs,CompletedTrainingJobs24h,NumberEndPointsInService",
+    )
+
+    retrieve_values.lambda_handler({}, None)
+    listed = spoke["sagemaker"].calls["list_training_jobs"]
+    assert listed > 0
+
+    second = retrieve_values.lambda_handler({}, None)
+    assert len(second["reused"]) == 3
+    assert spoke["sagemaker"].calls["list_training_jobs"] == listed
+    assert spoke["sagemaker"].calls["list_endpoints"] == 1